@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Entry point ASGI (mode async) untuk Portfolio RAG.
+
+/send_message dan /send_message_stream dilayani native async: chain dipanggil dengan
+ainvoke/astream sehingga request yang menunggu OpenAI tidak menahan thread, sedangkan
+file I/O (chat history, cache, user store) dijalankan di thread pool. Route lain diteruskan
+ke app Flask (WSGI) di thread pool, jadi semua route sync tetap berjalan sama.
+
+Jalankan:
+    uvicorn asgi:app --host 0.0.0.0 --port 8000 --workers 2
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from flask import jsonify
+
+import index
+from index import app as flask_app
+
+# Thread pool untuk file I/O, route WSGI, dan bagian chain yang sync (retrieval)
+ASYNC_THREADPOOL_SIZE = int(os.getenv('ASYNC_THREADPOOL_SIZE', '64'))
+
+# (method, path) -> streaming?
+NATIVE_CHAT_ROUTES = {
+    ("POST", "/send_message"): False,
+    ("POST", "/send_message_stream"): True,
+}
+
+
+async def read_body(receive):
+    """Baca seluruh body request ASGI"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def build_environ(scope, body):
+    """Konversi scope ASGI + body menjadi environ WSGI (PEP 3333)"""
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").lower()
+        value = value.decode("latin-1")
+        if name == "content-length":
+            continue
+        key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+async def send_start(send, status, headers):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(str(k).lower().encode("latin-1"), str(v).encode("latin-1")) for k, v in headers],
+    })
+
+
+async def call_wsgi(environ, send):
+    """
+    Jalankan app Flask untuk satu request di thread pool. Semua langkah (dispatch dan iterasi body,
+    termasuk generator stream_with_context) jalan di satu contextvars.Context milik request ini.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    response_start = {}
+
+    def start_response(status, headers, exc_info=None):
+        response_start["status"] = int(status.split(" ", 1)[0])
+        response_start["headers"] = headers
+        return lambda data: None  # write() callable tidak dipakai Flask
+
+    def run_in_context(func, *args):
+        return loop.run_in_executor(None, context.run, func, *args)
+
+    iterable = await run_in_context(flask_app.wsgi_app, environ, start_response)
+    iterator = iter(iterable)
+    started = False
+    try:
+        while True:
+            chunk = await run_in_context(next, iterator, None)
+            if chunk is None:
+                break
+            if not started:
+                await send_start(send, response_start["status"], response_start["headers"])
+                started = True
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    finally:
+        if hasattr(iterable, "close"):
+            await run_in_context(iterable.close)
+    if not started:
+        await send_start(send, response_start["status"], response_start["headers"])
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def send_flask_response(rv, send):
+    """Kirim return value view Flask (after_request hooks + session cookie ikut diproses)"""
+    response = flask_app.process_response(flask_app.make_response(rv))
+    await send_start(send, response.status_code, response.headers.items())
+    await send({"type": "http.response.body", "body": response.get_data(), "more_body": False})
+
+
+async def join_answer_flight(turn):
+    """
+    Single-flight jawaban (lihat index.begin_answer_flight) untuk jalur async. Return
+    (key, future, answer): answer terisi jika pertanyaan identik sudah dijawab request lain,
+    selain itu turn ini leader dan wajib memanggil index.end_answer_flight().
+    """
+    key, future, leader = index.begin_answer_flight(turn)
+    if leader:
+        return key, future, None
+    try:
+        answer = await asyncio.wrap_future(future)
+    except index.SingleFlightAborted:
+        return None, None, None
+    turn["coalesced"] = True
+    return None, None, answer
+
+
+async def invoke_chat(turn, send):
+    """Versi async /send_message: menunggu LLM tanpa menahan thread"""
+    try:
+        if turn["cached"]:
+            answer = turn["answer"]
+        elif turn["rag_chain"]:
+            key, future, answer = await join_answer_flight(turn)
+            if answer is None:
+                try:
+                    with index.timed_stage("chain_invoke"):
+                        response = await turn["rag_chain"].ainvoke(index.chat_chain_inputs(turn))
+                except BaseException as e:
+                    index.end_answer_flight(key, future, error=e)
+                    raise
+                answer = response["answer"]
+                index.end_answer_flight(key, future, answer)
+        else:
+            answer = index.AI_UNAVAILABLE_ANSWER
+        rv = jsonify(await asyncio.to_thread(index.finish_chat_turn, turn, answer))
+    except Exception as e:
+        flask_app.logger.error(f"Error in send_message (async): {str(e)}")
+        rv = (jsonify({"error": str(e)}), 500)
+    await send_flask_response(rv, send)
+
+
+async def stream_chat(turn, send):
+    """Versi async /send_message_stream: event SSE sama dengan route sync"""
+    response = flask_app.process_response(
+        flask_app.response_class(mimetype="text/event-stream", headers=index.SSE_HEADERS)
+    )
+    await send_start(send, response.status_code, response.headers.items())
+
+    async def emit(event, data):
+        await send({"type": "http.response.body", "body": index.format_sse(event, data).encode("utf-8"),
+                    "more_body": True})
+
+    answer_parts = []
+    try:
+        if turn["cached"]:
+            answer = turn["answer"]
+            await emit("token", {"token": answer})
+        elif turn["rag_chain"]:
+            key, future, answer = await join_answer_flight(turn)
+            if answer is not None:
+                await emit("token", {"token": answer})
+            else:
+                try:
+                    with index.timed_stage("chain_stream"):
+                        stream_start = time.perf_counter()
+                        async for chunk in turn["rag_chain"].astream(index.chat_chain_inputs(turn)):
+                            token = chunk.get("answer")
+                            if token:
+                                if not answer_parts:
+                                    index.record_first_token(stream_start)
+                                answer_parts.append(token)
+                                await emit("token", {"token": token})
+                except BaseException as e:
+                    index.end_answer_flight(key, future, error=e)
+                    raise
+                answer = "".join(answer_parts)
+                index.end_answer_flight(key, future, answer)
+        else:
+            answer = index.AI_UNAVAILABLE_ANSWER
+            await emit("token", {"token": answer})
+
+        await emit("done", await asyncio.to_thread(index.finish_chat_turn, turn, answer))
+    except Exception as e:
+        flask_app.logger.error(f"Error in send_message_stream (async): {str(e)}")
+        await emit("error", {"error": str(e)})
+    await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+async def handle_chat(environ, send, stream):
+    """
+    Endpoint chat native async. Request context Flask di-push di task ini (session, g, hooks),
+    bagian sync (prepare/finish) dijalankan di thread pool dengan context yang sama.
+    """
+    request_ctx = flask_app.request_context(environ)
+    request_ctx.push()
+    try:
+        rv = flask_app.preprocess_request()
+        turn = None
+        if rv is None:
+            try:
+                turn, rv = await asyncio.to_thread(index.prepare_chat_turn)
+            except Exception as e:
+                flask_app.logger.error(f"Error in {environ['PATH_INFO']} (async): {str(e)}")
+                rv = (jsonify({"error": str(e)}), 500)
+        if rv is not None:
+            await send_flask_response(rv, send)
+        elif stream:
+            await stream_chat(turn, send)
+        else:
+            await invoke_chat(turn, send)
+    finally:
+        request_ctx.pop()
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=ASYNC_THREADPOOL_SIZE, thread_name_prefix="asgi-io")
+            )
+            # Base index + BM25 dibuka di background, startup tidak menunggu
+            index.warm_worker_state()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await asyncio.to_thread(index.flush_ingest_queue)
+            for client in index.pop_openai_http_clients():
+                if isinstance(client, httpx.AsyncClient):
+                    await client.aclose()
+                else:
+                    client.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """Aplikasi ASGI: endpoint chat native async, route lain lewat app Flask"""
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    environ = build_environ(scope, await read_body(receive))
+    stream = NATIVE_CHAT_ROUTES.get((scope["method"], environ["PATH_INFO"]))
+    if stream is None:
+        await call_wsgi(environ, send)
+    else:
+        await handle_chat(environ, send, stream)
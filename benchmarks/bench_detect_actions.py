@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark detect_actions: implementasi lama (scan any(keyword in text) per rule)
+vs rule table yang di-compile. Memastikan output identik lalu membandingkan waktu
+untuk berbagai panjang jawaban AI, ditambah dua varian single pass sebagai referensi
+(regex gabungan, dan tokenisasi sekali + lookup token -> rule). Keduanya lebih lambat
+dari scan substring per keyword, jadi detect_actions tetap memakai scan tersebut.
+
+Jalankan dari root repo:
+    python benchmarks/bench_detect_actions.py
+"""
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import DEFAULT_ACTION_RULES, detect_actions  # noqa: E402
+
+# Referensi: satu regex alternation berisi semua keyword (single pass per teks). Dipakai hanya
+# untuk membandingkan waktu; engine regex CPython mencoba alternation di setiap posisi karakter,
+# sedangkan `keyword in text` memakai fast search di C, jadi satu pass regex lebih lambat dari
+# beberapa puluh scan substring.
+_ALL_KEYWORDS = sorted({kw for rule in DEFAULT_ACTION_RULES for kw in rule["keywords"]}, key=len, reverse=True)
+_COMBINED_REGEX = re.compile("|".join(re.escape(kw) for kw in _ALL_KEYWORDS))
+
+
+def combined_regex_scan(user_message, ai_response):
+    return ({m.group(0) for m in _COMBINED_REGEX.finditer(user_message.lower())},
+            {m.group(0) for m in _COMBINED_REGEX.finditer(ai_response.lower())})
+
+
+# Referensi: single pass per token. Teks dipecah sekali per whitespace, setiap token unik
+# di-lookup ke memo token -> bitmask rule (keyword substring dicek sekali per token baru),
+# keyword multi-kata dicek lewat tabel frasa. Output identik dengan detect_actions, tapi
+# text.split() + set() saja sudah lebih mahal dari semua scan `keyword in text`.
+_TOKEN_KEYWORDS = [(kw.lower(), 1 << i) for i, rule in enumerate(DEFAULT_ACTION_RULES)
+                   for kw in rule["keywords"] if len(kw.split()) == 1]
+_PHRASE_KEYWORDS = [(kw.lower(), 1 << i) for i, rule in enumerate(DEFAULT_ACTION_RULES)
+                    for kw in rule["keywords"] if len(kw.split()) > 1]
+_RESPONSE_MASK = sum(1 << i for i, rule in enumerate(DEFAULT_ACTION_RULES) if rule.get("scope") == "both")
+_token_masks = {}
+
+
+def _token_mask(token):
+    mask = _token_masks.get(token)
+    if mask is None:
+        mask = 0
+        for keyword, bit in _TOKEN_KEYWORDS:
+            if keyword in token:
+                mask |= bit
+        _token_masks[token] = mask
+    return mask
+
+
+def _token_scan(text, allowed):
+    found = 0
+    for token in set(text.split()):
+        found |= _token_mask(token)
+    for keyword, bit in _PHRASE_KEYWORDS:
+        if allowed & bit and not found & bit and keyword in text:
+            found |= bit
+    return found & allowed
+
+
+def token_single_pass(user_message, ai_response):
+    found = _token_scan(user_message.lower(), (1 << len(DEFAULT_ACTION_RULES)) - 1)
+    if _RESPONSE_MASK & ~found:
+        found |= _token_scan(ai_response.lower(), _RESPONSE_MASK & ~found)
+    return found
+
+
+def legacy_detect_actions(user_message, ai_response):
+    """Salinan detect_actions sebelum rule table (referensi output dan baseline waktu)"""
+    actions = []
+    user_lower = user_message.lower()
+    ai_lower = ai_response.lower()
+
+    project_keywords = ['proyek', 'project', 'portfolio', 'karya', 'aplikasi yang dibuat']
+    if any(keyword in user_lower for keyword in project_keywords) or any(keyword in ai_lower for keyword in project_keywords):
+        actions.append({"type": "project_list", "label": "Lihat Semua Proyek", "icon": "💼", "style": "primary"})
+
+    skill_keywords = ['skill', 'kemampuan', 'keahlian', 'teknologi', 'tech stack', 'bahasa pemrograman']
+    if any(keyword in user_lower for keyword in skill_keywords) or any(keyword in ai_lower for keyword in skill_keywords):
+        actions.append({"type": "skills_detail", "label": "Detail Skills", "icon": "🚀", "style": "info"})
+
+    experience_keywords = ['pengalaman', 'kerja', 'pekerjaan', 'karir', 'career', 'work experience']
+    if any(keyword in user_lower for keyword in experience_keywords) or any(keyword in ai_lower for keyword in experience_keywords):
+        actions.append({"type": "experience_timeline", "label": "Timeline Karir", "icon": "📊", "style": "secondary"})
+
+    cv_keywords = ['cv', 'resume', 'download', 'unduh']
+    if any(keyword in user_lower for keyword in cv_keywords):
+        actions.append({"type": "download_cv", "label": "Download CV", "icon": "📄", "style": "success"})
+
+    contact_keywords = ['kontak', 'hubungi', 'contact', 'email', 'linkedin', 'github']
+    if any(keyword in user_lower for keyword in contact_keywords):
+        actions.append({"type": "contact_info", "label": "Info Kontak", "icon": "📧", "style": "warning"})
+
+    if len(actions) > 0:
+        actions.append({"type": "help", "label": "Tanya Lainnya?", "icon": "❓", "style": "light"})
+
+    return actions
+
+
+FILLER_WORDS = (
+    "adam adalah developer yang berfokus pada sistem terdistribusi dan machine learning "
+    "dengan pendekatan praktis serta kolaboratif bersama tim lintas fungsi"
+).split()
+KEYWORD_WORDS = [
+    "proyek", "Project", "skill", "Kemampuan", "pengalaman", "bekerja", "career", "CV",
+    "unduh", "GitHub", "email", "tech stack", "karya", "PEKERJAAN", "linkedin",
+]
+
+
+def random_text(rng, words, keyword_rate):
+    parts = []
+    for _ in range(words):
+        parts.append(rng.choice(KEYWORD_WORDS) if rng.random() < keyword_rate else rng.choice(FILLER_WORDS))
+    return " ".join(parts)
+
+
+def check_equivalence(samples=5000):
+    """Bandingkan output kedua implementasi pada teks acak. Return jumlah mismatch"""
+    rng = random.Random(42)
+    mismatches = 0
+    for _ in range(samples):
+        user = random_text(rng, rng.randint(1, 12), 0.15)
+        answer = random_text(rng, rng.randint(0, 400), rng.choice([0.0, 0.001, 0.02, 0.2]))
+        expected = legacy_detect_actions(user, answer)
+        if expected != detect_actions(user, answer):
+            mismatches += 1
+        expected_types = {action["type"] for action in expected}
+        if {rule["type"] for i, rule in enumerate(DEFAULT_ACTION_RULES)
+                if token_single_pass(user, answer) >> i & 1} != expected_types - {"help"}:
+            mismatches += 1
+    return mismatches
+
+
+def main():
+    mismatches = check_equivalence()
+    print(f"Equivalence check: {'OK' if mismatches == 0 else f'FAIL ({mismatches} mismatches)'}\n")
+
+    rng = random.Random(7)
+    user = "ceritakan tentang Adam"
+    print(f"{'answer chars':>12} | {'legacy (us)':>11} | {'compiled (us)':>13} | {'speedup':>7} | "
+          f"{'1-regex (us)':>12} | {'token pass (us)':>15}")
+    print("-" * 86)
+    for words in (20, 150, 600, 3000):
+        # Jawaban tanpa keyword = kasus terburuk (semua keyword di-scan sampai habis)
+        answer = random_text(rng, words, 0.0)
+        number = 2000
+        legacy = timeit.timeit(lambda: legacy_detect_actions(user, answer), number=number) / number * 1e6
+        compiled = timeit.timeit(lambda: detect_actions(user, answer), number=number) / number * 1e6
+        regex = timeit.timeit(lambda: combined_regex_scan(user, answer), number=number) / number * 1e6
+        token = timeit.timeit(lambda: token_single_pass(user, answer), number=number) / number * 1e6
+        print(f"{len(answer):>12} | {legacy:>11.2f} | {compiled:>13.2f} | {legacy / compiled:>6.2f}x | "
+              f"{regex:>12.2f} | {token:>15.2f}")
+
+    return 0 if mismatches == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Server HTTP lokal yang meniru OpenAI API (/v1/chat/completions dan /v1/embeddings)
+untuk load test tanpa network. Jawaban dan embedding deterministik, latency bisa diatur.
+
+Jalankan sendiri:
+    python benchmarks/fake_openai_server.py --port 8900 --latency 0.8 --token-latency 0.01
+lalu arahkan app ke server ini:
+    OPENAI_BASE_URL=http://127.0.0.1:8900/v1 OPENAI_API_KEY=sk-fake gunicorn index:app
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+FAKE_ANSWER = (
+    "Adam memiliki pengalaman 5+ tahun sebagai Full Stack Developer dan AI Engineer dengan "
+    "expertise di Python, React, dan sistem RAG. Beberapa proyek utama antara lain platform "
+    "e-commerce, sistem customer support berbasis AI, dan portfolio website dengan chatbot."
+)
+EMBEDDING_DIMENSIONS = 1536
+
+
+def fake_embedding(text):
+    """Hashed bag-of-words embedding (sama dengan benchmarks.fakes.FakeEmbeddings)"""
+    vector = np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32)
+    for token in re.findall(r"\w+", text.lower()):
+        vector[zlib.crc32(token.encode('utf-8')) % EMBEDDING_DIMENSIONS] += 1.0
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm > 0 else vector).tolist()
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeOpenAI/1.0"
+
+    def log_message(self, format, *args):
+        pass  # Jangan spam stdout saat load test
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        config = self.server.config
+        with self.server.stats_lock:
+            self.server.stats[self.path] = self.server.stats.get(self.path, 0) + 1
+        try:
+            payload = self._read_json()
+            if self.path.endswith("/chat/completions"):
+                self._chat_completions(payload, config)
+            elif self.path.endswith("/embeddings"):
+                self._embeddings(payload, config)
+            else:
+                self._send_json({"error": {"message": f"Unknown path {self.path}"}}, 404)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _chat_completions(self, payload, config):
+        tokens = FAKE_ANSWER.split(" ")
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in payload.get("messages", []))
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        created = int(time.time())
+        model = payload.get("model", "gpt-3.5-turbo")
+        time.sleep(config["latency"])
+
+        if not payload.get("stream"):
+            time.sleep(config["token_latency"] * len(tokens))
+            self._send_json({
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": FAKE_ANSWER},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_event(data):
+            chunk = f"data: {data}\n\n".encode('utf-8')
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.flush()
+
+        for i, token in enumerate(tokens):
+            time.sleep(config["token_latency"])
+            write_event(json.dumps({
+                "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": token if i == 0 else " " + token}, "finish_reason": None}],
+            }))
+        write_event(json.dumps({
+            "id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }))
+        write_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _embeddings(self, payload, config):
+        inputs = payload.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        time.sleep(config["embed_latency"])
+        data = []
+        for i, item in enumerate(inputs):
+            # langchain_openai mengirim token ids (list int) jika tiktoken aktif
+            text = " ".join(str(t) for t in item) if isinstance(item, list) else str(item)
+            data.append({"object": "embedding", "index": i, "embedding": fake_embedding(text)})
+        self._send_json({
+            "object": "list", "data": data, "model": payload.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)},
+        })
+
+
+def start_fake_openai_server(host="127.0.0.1", port=0, latency=0.0, token_latency=0.0, embed_latency=0.0):
+    """Start server di background thread. Return (server, base_url)"""
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.config = {"latency": latency, "token_latency": token_latency, "embed_latency": embed_latency}
+    server.stats = {}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name="fake-openai", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server untuk load test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5, help="Latency chat completion sebelum token pertama (detik)")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Latency per token (detik)")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Latency per embedding request (detik)")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_openai_server(args.host, args.port, args.latency, args.token_latency, args.embed_latency)
+    print(f"Fake OpenAI server listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Pengganti lokal (tanpa network) untuk ChatOpenAI dan OpenAIEmbeddings, dipakai oleh benchmark.
+Output deterministik, latency bisa diatur supaya mendekati kondisi production.
+"""
+import re
+import time
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+FAKE_ANSWER = (
+    "Adam memiliki pengalaman 5+ tahun sebagai Full Stack Developer dan AI Engineer dengan "
+    "expertise di Python, React, dan sistem RAG. Beberapa proyek utama antara lain platform "
+    "e-commerce, sistem customer support berbasis AI, dan portfolio website dengan chatbot."
+)
+
+
+class FakeEmbeddings(Embeddings):
+    """Hashed bag-of-words embedding: teks yang mirip menghasilkan vector yang mirip"""
+
+    def __init__(self, latency=0.0, per_text_latency=0.0, dimensions=1536, **kwargs):
+        self.model = "fake-embedding"
+        self.latency = latency
+        self.per_text_latency = per_text_latency
+        self.dimensions = dimensions
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def _embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(token.encode('utf-8')) % self.dimensions] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm > 0 else vector).tolist()
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        time.sleep(self.latency + self.per_text_latency * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model dengan jawaban tetap; latency = waktu tunggu awal + waktu per token"""
+
+    latency: float = 0.0
+    token_latency: float = 0.0
+    answer: str = FAKE_ANSWER
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "fake-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        tokens = self.answer.split(" ")
+        time.sleep(self.latency + self.token_latency * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        for i, token in enumerate(self.answer.split(" ")):
+            time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token if i == 0 else " " + token))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def install_fakes(index_module, llm_latency=0.0, token_latency=0.0, embed_latency=0.0, embed_per_text_latency=0.0):
+    """Ganti ChatOpenAI/OpenAIEmbeddings di module index dengan fake lokal. Return dict instance fake"""
+    created = {"llms": [], "embeddings": []}
+
+    def chat_factory(*args, **kwargs):
+        llm = FakeChatModel(latency=llm_latency, token_latency=token_latency, callbacks=kwargs.get("callbacks"))
+        created["llms"].append(llm)
+        return llm
+
+    def embeddings_factory(*args, **kwargs):
+        embeddings = FakeEmbeddings(latency=embed_latency, per_text_latency=embed_per_text_latency)
+        created["embeddings"].append(embeddings)
+        return embeddings
+
+    index_module.ChatOpenAI = chat_factory
+    index_module.OpenAIEmbeddings = embeddings_factory
+    return created
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Load generator untuk app Flask: replay sesi user secara concurrent terhadap server sungguhan
+(gunicorn, werkzeug threaded, atau uvicorn untuk mode async asgi.py), dengan OpenAI diganti fake_openai_server.py sehingga
+tidak butuh network maupun API key.
+
+Setiap virtual user punya cookie jar + koneksi keep-alive sendiri dan menjalankan:
+    check_session -> [login] -> get_history -> N x send_message (atau send_message_stream)
+Rasio guest/logged-in dan jumlah turn per sesi diambil dari isi users_data/ (fallback ke default).
+
+Output per endpoint: count, error rate, throughput, p50/p95/p99/mean/max (ms).
+
+Jalankan dari root repo:
+    python benchmarks/load_test.py --concurrency 10 --sessions 100
+    python benchmarks/load_test.py --concurrency 20 --duration 60 --stream --output load.json
+    python benchmarks/load_test.py --target http://127.0.0.1:5000 --concurrency 5
+"""
+import argparse
+import glob
+import http.client
+import importlib.util
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_openai_server import start_fake_openai_server  # noqa: E402
+
+DEFAULT_LOGGED_IN_RATIO = 0.3
+DEFAULT_TURNS = [1, 2, 3, 4, 5]
+
+OPENING_QUESTIONS = [
+    "Halo, siapa Adam?",
+    "apa saja skill Adam?",
+    "Ceritakan pengalaman kerja Adam",
+    "Proyek apa saja yang pernah dikerjakan?",
+    "Bagaimana cara menghubungi Adam?",
+    "Boleh lihat CV Adam?",
+]
+FOLLOW_UP_QUESTIONS = [
+    "ceritakan lebih detail",
+    "teknologi apa yang dipakai di proyek itu?",
+    "kalau pendidikannya?",
+    "sertifikasi apa saja yang dimiliki?",
+    "apakah Adam pernah pakai AWS?",
+    "berapa lama pengalamannya di bidang AI?",
+    "kontak email dan github",
+]
+
+# Wrapper app untuk server yang di-spawn: tokenizer tiktoken butuh download dari internet,
+# jadi embedding dikirim sebagai teks mentah ke fake server.
+LOADTEST_APP_SOURCE = '''\
+import functools
+
+from langchain_openai import OpenAIEmbeddings
+
+import index
+
+index.OpenAIEmbeddings = functools.partial(OpenAIEmbeddings, check_embedding_ctx_length=False)
+app = index.app
+
+import asgi  # noqa: E402  (mode async, --server uvicorn)
+
+asgi_app = asgi.app
+'''
+
+
+# ================= WORKLOAD PROFILE =================
+
+def load_workload_profile(users_dir):
+    """Rasio logged-in dan distribusi jumlah turn per sesi dari users_data/"""
+    user_dirs = [d for d in glob.glob(os.path.join(users_dir, "*")) if os.path.isdir(d)]
+    if not user_dirs:
+        return {"source": "default", "logged_in_ratio": DEFAULT_LOGGED_IN_RATIO, "turns": DEFAULT_TURNS}
+
+    logged_in = 0
+    turns = []
+    for user_dir in user_dirs:
+        if not os.path.basename(user_dir).startswith("guest_"):
+            logged_in += 1
+        messages = 0
+        log_file = os.path.join(user_dir, "chat_history.jsonl")
+        json_file = os.path.join(user_dir, "chat_history.json")
+        try:
+            if os.path.exists(log_file):
+                with open(log_file, 'r', encoding='utf-8') as f:
+                    messages = sum(1 for line in f if line.strip())
+            elif os.path.exists(json_file):
+                with open(json_file, 'r', encoding='utf-8') as f:
+                    messages = len(json.load(f))
+        except (OSError, ValueError):
+            pass
+        if messages:
+            turns.append(messages // 2 or 1)
+
+    return {
+        "source": users_dir,
+        "logged_in_ratio": logged_in / len(user_dirs),
+        "turns": turns or DEFAULT_TURNS,
+    }
+
+
+# ================= HTTP CLIENT =================
+
+class VirtualUser:
+    """Satu browser: cookie jar sederhana + satu koneksi keep-alive"""
+
+    def __init__(self, base_url, recorder, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.recorder = recorder
+        self.timeout = timeout
+        self.cookies = {}
+        self.conn = None
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def _headers(self, has_body):
+        headers = {}
+        if has_body:
+            headers["Content-Type"] = "application/json"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        return headers
+
+    def _store_cookies(self, response):
+        for header in response.msg.get_all("Set-Cookie") or []:
+            name, _, value = header.split(";", 1)[0].partition("=")
+            self.cookies[name.strip()] = value.strip()
+
+    def request(self, endpoint, method, path, payload=None, stream=False):
+        """Kirim request dan catat latency. Return (status, body) atau (None, None) jika gagal"""
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        start = time.perf_counter()
+        first_event = None
+        try:
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self.conn.request(method, path, body=body, headers=self._headers(body is not None))
+            response = self.conn.getresponse()
+            self._store_cookies(response)
+            if stream:
+                chunks = []
+                while True:
+                    line = response.readline()
+                    if not line:
+                        break
+                    if first_event is None and line.startswith(b"event: token"):
+                        first_event = time.perf_counter() - start
+                    chunks.append(line)
+                data = b"".join(chunks)
+            else:
+                data = response.read()
+            status = response.status
+            if response.will_close:
+                self.close()
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            self.recorder.record(endpoint, time.perf_counter() - start, False, type(e).__name__)
+            return None, None
+
+        elapsed = time.perf_counter() - start
+        ok = 200 <= status < 300
+        if stream and ok and b"event: error" in data:
+            ok = False
+        self.recorder.record(endpoint, elapsed, ok, status)
+        if first_event is not None:
+            self.recorder.record(endpoint + ":first_token", first_event, True, status)
+        return status, data
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = []
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, elapsed, ok, status):
+        with self.lock:
+            self.samples.append((endpoint, elapsed, ok, status))
+
+
+# ================= SESSION REPLAY =================
+
+def run_session(session_id, base_url, profile, args, recorder, rng):
+    user = VirtualUser(base_url, recorder, args.timeout)
+    try:
+        user.request("check_session", "GET", "/check_session")
+
+        if rng.random() < profile["logged_in_ratio"]:
+            username = f"loadtest_{session_id % args.user_pool}"
+            user.request("login", "POST", "/login", {"username": username})
+
+        user.request("get_history", "GET", f"/get_history?limit={args.history_limit}")
+
+        turns = max(args.min_turns, min(args.max_turns, rng.choice(profile["turns"])))
+        endpoint = "send_message_stream" if args.stream else "send_message"
+        for turn in range(turns):
+            if args.think_time:
+                time.sleep(rng.uniform(0, 2 * args.think_time))
+            question = rng.choice(OPENING_QUESTIONS if turn == 0 else FOLLOW_UP_QUESTIONS)
+            user.request(endpoint, "POST", "/" + endpoint, {"message": question}, stream=args.stream)
+    finally:
+        user.close()
+
+
+def run_load(base_url, profile, args):
+    recorder = Recorder()
+    deadline = time.monotonic() + args.duration if args.duration else None
+    counter = iter(range(sys.maxsize))
+    counter_lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(args.seed + worker_id)
+        while True:
+            with counter_lock:
+                session_id = next(counter)
+            if deadline is not None:
+                if time.monotonic() >= deadline:
+                    return
+            elif session_id >= args.sessions:
+                return
+            run_session(session_id, base_url, profile, args, recorder, rng)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+    wall_time = time.perf_counter() - start
+    return recorder.samples, wall_time
+
+
+# ================= REPORT =================
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize_samples(samples, wall_time):
+    by_endpoint = {}
+    for endpoint, elapsed, ok, status in samples:
+        by_endpoint.setdefault(endpoint, []).append((elapsed, ok, status))
+
+    report = {}
+    for endpoint, entries in sorted(by_endpoint.items()):
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in entries)
+        errors = [status for _, ok, status in entries if not ok]
+        error_codes = {}
+        for status in errors:
+            error_codes[str(status)] = error_codes.get(str(status), 0) + 1
+        report[endpoint] = {
+            "count": len(entries),
+            "errors": len(errors),
+            "error_rate": round(len(errors) / len(entries), 4),
+            "error_codes": error_codes,
+            "throughput_rps": round(len(entries) / wall_time, 3) if wall_time else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "max_ms": round(latencies[-1], 2),
+        }
+    return report
+
+
+def print_report(report, wall_time):
+    print(f"\n{'endpoint':<32}{'count':>7}{'err%':>7}{'rps':>9}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for endpoint, row in report.items():
+        print(f"{endpoint:<32}{row['count']:>7}{row['error_rate'] * 100:>6.1f}%{row['throughput_rps']:>9.2f}"
+              f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['max_ms']:>10.1f}")
+        if row["error_codes"]:
+            print(f"{'':<32}errors: {row['error_codes']}")
+    print(f"\nWall time: {wall_time:.2f}s (latency dalam ms)")
+
+
+# ================= SERVER UNDER TEST =================
+
+def find_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def prepare_workspace(workspace):
+    """Copy kode + data app ke workspace sementara agar repo tidak ikut termodifikasi"""
+    for path in glob.glob(os.path.join(REPO_ROOT, "*.py")) + glob.glob(os.path.join(REPO_ROOT, "*.json")):
+        shutil.copy(path, workspace)
+    for name in ("templates", "static"):
+        src = os.path.join(REPO_ROOT, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, os.path.join(workspace, name))
+    with open(os.path.join(workspace, "loadtest_app.py"), 'w', encoding='utf-8') as f:
+        f.write(LOADTEST_APP_SOURCE)
+
+
+def start_app_server(args, openai_base_url, workspace):
+    port = find_free_port()
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-loadtest",
+        "OPENAI_BASE_URL": openai_base_url,
+        "OPENAI_API_BASE": openai_base_url,
+        "EMBEDDING_CACHE_FILE": os.path.join(workspace, "embedding_cache.sqlite3"),
+        "APP_DB_FILE": os.path.join(workspace, "app_data.sqlite3"),
+        "PYTHONUNBUFFERED": "1",
+    })
+
+    server = args.server
+    if server == "uvicorn" and importlib.util.find_spec("uvicorn") is None:
+        print(">>> uvicorn tidak ditemukan, fallback ke gunicorn")
+        server = "gunicorn"
+    if server == "gunicorn" and shutil.which("gunicorn") is None:
+        print(">>> gunicorn tidak ditemukan, fallback ke werkzeug threaded server")
+        server = "werkzeug"
+
+    if server == "gunicorn":
+        command = ["gunicorn", "loadtest_app:app", "--bind", f"127.0.0.1:{port}",
+                   "--workers", str(args.workers), "--threads", str(args.threads),
+                   "--worker-class", "gthread", "--timeout", "120"]
+    elif server == "uvicorn":
+        command = [sys.executable, "-m", "uvicorn", "loadtest_app:asgi_app", "--host", "127.0.0.1",
+                   "--port", str(port), "--workers", str(args.workers), "--log-level", "warning"]
+    else:
+        command = [sys.executable, "-c",
+                   f"from loadtest_app import app; app.run(port={port}, threaded=True)"]
+
+    log_file = open(os.path.join(workspace, "server.log"), 'w')
+    process = subprocess.Popen(command, cwd=workspace, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/check_session")
+            conn.getresponse().read()
+            conn.close()
+            return process, base_url, server
+        except OSError:
+            time.sleep(0.2)
+
+    process.terminate()
+    log_file.close()
+    with open(os.path.join(workspace, "server.log"), 'r') as f:
+        print(f.read()[-4000:])
+    raise RuntimeError(f"App server ({server}) gagal start dalam {args.startup_timeout}s")
+
+
+def warm_up(base_url, args):
+    """Satu sesi sebelum pengukuran agar index dibangun sebelum load dimulai"""
+    recorder = Recorder()
+    user = VirtualUser(base_url, recorder, args.timeout)
+    user.request("warmup", "POST", "/send_message", {"message": OPENING_QUESTIONS[0]})
+    user.close()
+    _, _, ok, status = recorder.samples[0]
+    if not ok:
+        print(f">>> Warning: warm-up request gagal ({status})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test untuk portfolio RAG app")
+    parser.add_argument("--concurrency", type=int, default=10, help="Jumlah virtual user paralel")
+    parser.add_argument("--sessions", type=int, default=50, help="Total sesi (diabaikan jika --duration di-set)")
+    parser.add_argument("--duration", type=float, default=0, help="Jalankan selama N detik")
+    parser.add_argument("--stream", action="store_true", help="Pakai /send_message_stream (catat juga first_token)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Rata-rata jeda antar pesan (detik)")
+    parser.add_argument("--min-turns", type=int, default=2)
+    parser.add_argument("--max-turns", type=int, default=8)
+    parser.add_argument("--user-pool", type=int, default=20, help="Jumlah username berbeda untuk sesi logged-in")
+    parser.add_argument("--logged-in-ratio", type=float, default=None, help="Override rasio dari users_data/")
+    parser.add_argument("--history-limit", type=int, default=50)
+    parser.add_argument("--users-dir", default=os.path.join(REPO_ROOT, "users_data"))
+    parser.add_argument("--target", default=None, help="URL app yang sudah jalan (skip spawn server + fake OpenAI)")
+    parser.add_argument("--server", choices=["gunicorn", "werkzeug", "uvicorn"], default="gunicorn",
+                        help="uvicorn = mode async (asgi.py), --threads diabaikan")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Fake LLM latency sebelum token pertama (detik)")
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Timeout per request (detik)")
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Tulis hasil JSON ke file ini")
+    parser.add_argument("--keep-workspace", action="store_true")
+    args = parser.parse_args()
+
+    profile = load_workload_profile(args.users_dir)
+    if args.logged_in_ratio is not None:
+        profile["logged_in_ratio"] = args.logged_in_ratio
+    print(f">>> Workload profile: logged-in ratio {profile['logged_in_ratio']:.2f}, "
+          f"turns {sorted(profile['turns'])} ({profile['source']})")
+
+    process = None
+    fake_server = None
+    workspace = None
+    server = "external"
+    try:
+        if args.target:
+            base_url = args.target.rstrip("/")
+        else:
+            fake_server, openai_base_url = start_fake_openai_server(
+                latency=args.llm_latency, token_latency=args.token_latency, embed_latency=args.embed_latency
+            )
+            workspace = tempfile.mkdtemp(prefix="portfolio_rag_load_")
+            prepare_workspace(workspace)
+            process, base_url, server = start_app_server(args, openai_base_url, workspace)
+            print(f">>> App ({server}) di {base_url}, fake OpenAI di {openai_base_url}, workspace {workspace}")
+            warm_up(base_url, args)
+
+        mode = f"{args.duration:.0f}s" if args.duration else f"{args.sessions} sesi"
+        print(f">>> Load: {args.concurrency} virtual user, {mode}")
+        samples, wall_time = run_load(base_url, profile, args)
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if fake_server is not None:
+            fake_server.shutdown()
+        if workspace and not args.keep_workspace:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    report = summarize_samples(samples, wall_time)
+    print_report(report, wall_time)
+    if fake_server is not None:
+        print(f"Fake OpenAI calls: {fake_server.stats}")
+
+    if args.output:
+        result = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "server": server,
+                "workers": args.workers,
+                "threads": args.threads,
+                "concurrency": args.concurrency,
+                "sessions": args.sessions,
+                "duration": args.duration,
+                "stream": args.stream,
+                "wall_time_s": round(wall_time, 3),
+                "profile": profile,
+                "fake_openai_calls": fake_server.stats if fake_server is not None else None,
+            },
+            "endpoints": report,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f">>> Hasil ditulis ke {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark offline untuk request path: ChatOpenAI/OpenAIEmbeddings diganti fake lokal
+(deterministik, latency bisa diatur) sehingga bisa jalan tanpa network dan tanpa API key.
+
+Setiap stage diukur terpisah dan hasilnya ditulis sebagai JSON:
+  - setup_rag_chain   : cold (index + embedding cache kosong), warm dari disk, warm di memori, cache hit
+  - retrieval         : retriever.invoke() untuk berbagai ukuran corpus
+  - chat_history      : save/load/load tail/append untuk 10 - 10k pesan
+  - detect_actions    : berbagai panjang jawaban
+  - add_to_vectorstore: satu percakapan dan satu batch
+  - chain_invoke      : rag_chain.invoke() end-to-end dengan fake LLM
+
+Jalankan dari root repo:
+    python benchmarks/run_benchmarks.py --output bench_results.json
+    python benchmarks/run_benchmarks.py --quick --compare bench_results.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fakes import install_fakes  # noqa: E402
+
+FULL_CONFIG = {
+    "repeat": 20,
+    "cold_repeat": 3,
+    "corpus_sizes": [28, 250, 1000, 5000],
+    "history_sizes": [10, 100, 1000, 10000],
+    "answer_lengths": [200, 2000, 20000],
+}
+QUICK_CONFIG = {
+    "repeat": 5,
+    "cold_repeat": 1,
+    "corpus_sizes": [28, 250],
+    "history_sizes": [10, 1000],
+    "answer_lengths": [200, 2000],
+}
+
+QUERIES = [
+    "apa saja skill Adam?",
+    "pengalaman kerja Adam",
+    "proyek apa yang pernah dikerjakan?",
+    "pendidikan S2 Adam",
+    "kontak email dan github",
+    "sertifikasi AWS",
+]
+
+
+def summarize(samples):
+    """Ringkasan sampel waktu (detik) dalam milidetik"""
+    ms = sorted(sample * 1000 for sample in samples)
+    return {
+        "n": len(ms),
+        "mean_ms": round(sum(ms) / len(ms), 4),
+        "p50_ms": round(ms[len(ms) // 2], 4),
+        "p95_ms": round(ms[min(len(ms) - 1, int(len(ms) * 0.95))], 4),
+        "min_ms": round(ms[0], 4),
+        "max_ms": round(ms[-1], 4),
+    }
+
+
+def measure(fn, repeat, before_each=None):
+    samples = []
+    for _ in range(repeat):
+        if before_each:
+            before_each()
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+class Recorder:
+    def __init__(self):
+        self.results = []
+
+    def add(self, stage, name, params, samples):
+        result = {"stage": stage, "name": name, "params": params, **summarize(samples)}
+        self.results.append(result)
+        label = ", ".join(f"{k}={v}" for k, v in params.items())
+        print(f"  {stage:<18} {name:<24} {label:<28} p50={result['p50_ms']:>10.3f} ms  p95={result['p95_ms']:>10.3f} ms")
+
+
+def synthetic_corpus(index, size):
+    """Corpus sintetis: variasi dari entry portfolio kanonik"""
+    base = index.load_knowledge_base()
+    return [f"{base[i % len(base)]} (varian {i // len(base)})" for i in range(size)]
+
+
+def bench_setup_rag_chain(index, recorder, config):
+    def reset_cold():
+        index.clear_rag_chain_cache()
+        index.reset_base_vectorstore()
+        shutil.rmtree(index.BASE_CHROMA_DIR, ignore_errors=True)
+        if index._embeddings is not None:
+            index._embeddings._conn.close()
+        index._embeddings = None
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(index.EMBEDDING_CACHE_FILE + suffix):
+                os.remove(index.EMBEDDING_CACHE_FILE + suffix)
+
+    recorder.add("setup_rag_chain", "cold", {}, measure(index.setup_rag_chain, config["cold_repeat"], reset_cold))
+    recorder.add("setup_rag_chain", "warm_disk", {}, measure(index.setup_rag_chain, config["repeat"], index.reset_base_vectorstore))
+    recorder.add("setup_rag_chain", "warm_memory", {}, measure(index.setup_rag_chain, config["repeat"]))
+    index.get_rag_chain()
+    recorder.add("setup_rag_chain", "chain_cache_hit", {}, measure(index.get_rag_chain, config["repeat"]))
+
+
+def bench_retrieval(index, recorder, config):
+    for size in config["corpus_sizes"]:
+        persist_dir = f"bench_corpus_{size}"
+        vectorstore = index.Chroma.from_texts(
+            texts=synthetic_corpus(index, size),
+            embedding=index.get_embeddings(),
+            persist_directory=persist_dir,
+            collection_name=f"bench_{size}",
+        )
+        retriever = vectorstore.as_retriever(search_kwargs={"k": index.RETRIEVER_K})
+        queries = iter(QUERIES * (config["repeat"] // len(QUERIES) + 1))
+        recorder.add("retrieval", "retriever_invoke", {"corpus_size": size},
+                     measure(lambda: retriever.invoke(next(queries)), config["repeat"]))
+
+        # Engine numpy di atas index yang sama: retriever end-to-end, search satu query, dan batch query
+        engine = index.load_vector_engine(vectorstore, index._vectorstore_signature(vectorstore))
+        numpy_retriever = index.MergedRetriever(vectorstores=[engine], k=index.RETRIEVER_K)
+        query_vectors = index.get_embeddings().embed_documents(QUERIES)
+        numpy_queries = iter(QUERIES * (config["repeat"] // len(QUERIES) + 1))
+        recorder.add("retrieval", "numpy_retriever_invoke", {"corpus_size": size},
+                     measure(lambda: numpy_retriever.invoke(next(numpy_queries)), config["repeat"]))
+        recorder.add("retrieval", "numpy_search", {"corpus_size": size},
+                     measure(lambda: engine.search(query_vectors[:1], index.RETRIEVER_K), config["repeat"]))
+        recorder.add("retrieval", "numpy_search_batch", {"corpus_size": size, "queries": len(query_vectors)},
+                     measure(lambda: engine.search(query_vectors, index.RETRIEVER_K), config["repeat"]))
+
+
+def bench_chat_history(index, recorder, config):
+    for size in config["history_sizes"]:
+        user_id = f"bench_history_{size}"
+        messages = []
+        for i in range(size):
+            if i % 2 == 0:
+                messages.append({"is_user": True, "q": f"Pertanyaan nomor {i} tentang skill Adam?", "timestamp": datetime.now().isoformat()})
+            else:
+                messages.append({"is_user": False, "a": "Adam memiliki pengalaman luas. " * 10, "timestamp": datetime.now().isoformat(), "actions": []})
+
+        params = {"messages": size}
+        recorder.add("chat_history", "save_full", params, measure(lambda: index.save_chat_history(messages, user_id), config["repeat"]))
+        recorder.add("chat_history", "load_full", params, measure(lambda: index.load_chat_history(user_id), config["repeat"]))
+        recorder.add("chat_history", "load_tail", params,
+                     measure(lambda: index.load_chat_history(user_id, limit=index.CHAT_HISTORY_WINDOW), config["repeat"]))
+        turn = messages[-2:] if size >= 2 else messages
+        recorder.add("chat_history", "append_turn", params, measure(lambda: index.append_chat_messages(turn, user_id), config["repeat"]))
+
+
+def bench_detect_actions(index, recorder, config):
+    filler = "Adam adalah developer yang berfokus pada sistem terdistribusi dan machine learning. "
+    for length in config["answer_lengths"]:
+        answer = (filler * (length // len(filler) + 1))[:length]
+        recorder.add("detect_actions", "detect_actions", {"answer_chars": length},
+                     measure(lambda: index.detect_actions("ceritakan tentang Adam", answer), config["repeat"] * 50))
+
+
+def bench_add_to_vectorstore(index, recorder, config):
+    counter = iter(range(10 ** 9))
+    recorder.add("add_to_vectorstore", "single", {},
+                 measure(lambda: index.add_to_vectorstore(f"pertanyaan {next(counter)}", "jawaban benchmark"), config["repeat"]))
+    batch_size = index.INGEST_BATCH_SIZE
+
+    def add_batch():
+        index.add_conversations_to_vectorstore(
+            [(f"pertanyaan {next(counter)}", "jawaban benchmark", {}) for _ in range(batch_size)]
+        )
+    recorder.add("add_to_vectorstore", "batch", {"batch_size": batch_size}, measure(add_batch, max(1, config["repeat"] // 4)))
+
+
+def bench_chain_invoke(index, recorder, config):
+    chain = index.get_rag_chain()
+    queries = iter(QUERIES * (config["repeat"] // len(QUERIES) + 1))
+    recorder.add("chain_invoke", "no_history", {},
+                 measure(lambda: chain.invoke({"input": next(queries), "chat_history": []}), config["repeat"]))
+
+
+STAGES = {
+    "setup_rag_chain": bench_setup_rag_chain,
+    "retrieval": bench_retrieval,
+    "chat_history": bench_chat_history,
+    "detect_actions": bench_detect_actions,
+    "add_to_vectorstore": bench_add_to_vectorstore,
+    "chain_invoke": bench_chain_invoke,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path, threshold, min_delta_ms):
+    """
+    Bandingkan p50 dengan hasil sebelumnya. Return jumlah regresi di atas threshold (%)
+    yang juga lebih besar dari min_delta_ms (supaya noise di stage sub-milidetik diabaikan).
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+
+    def key(result):
+        return (result["stage"], result["name"], json.dumps(result["params"], sort_keys=True))
+
+    previous = {key(result): result for result in baseline["results"]}
+    regressions = 0
+    print(f"\n=== Compare with {baseline_path} (rev {baseline['meta'].get('git_revision')}) ===")
+    for result in results:
+        old = previous.get(key(result))
+        if not old or old["p50_ms"] <= 0:
+            continue
+        delta = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100
+        flag = ""
+        if delta > threshold and result["p50_ms"] - old["p50_ms"] > min_delta_ms:
+            flag = "  <-- REGRESSION"
+            regressions += 1
+        print(f"  {result['stage']:<18} {result['name']:<24} {old['p50_ms']:>10.3f} -> {result['p50_ms']:>10.3f} ms ({delta:+.1f}%){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark untuk request path portfolio RAG")
+    parser.add_argument("--quick", action="store_true", help="Ukuran dan jumlah repeat kecil (untuk CI)")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Stage yang dijalankan, dipisah koma")
+    parser.add_argument("--output", help="Tulis hasil JSON ke file ini")
+    parser.add_argument("--compare", help="File JSON hasil sebelumnya untuk deteksi regresi")
+    parser.add_argument("--threshold", type=float, default=20.0, help="Batas regresi p50 dalam persen (default 20)")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1, help="Selisih p50 minimal (ms) untuk dianggap regresi")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Latency fake LLM per call (detik)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Latency fake embedding per call (detik)")
+    args = parser.parse_args()
+
+    config = QUICK_CONFIG if args.quick else FULL_CONFIG
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+
+    # Workspace sementara supaya index, cache, dan history benchmark tidak menyentuh data asli
+    workdir = tempfile.mkdtemp(prefix="portfolio_rag_bench_")
+    shutil.copy(os.path.join(REPO_ROOT, "portfolio_data.json"), workdir)
+    os.chdir(workdir)
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark-fake")
+    os.environ["EMBEDDING_CACHE_FILE"] = os.path.join(workdir, "embedding_cache.sqlite3")
+    os.environ["APP_DB_FILE"] = os.path.join(workdir, "app_data.sqlite3")
+
+    import index
+    install_fakes(index, llm_latency=args.llm_latency, embed_latency=args.embed_latency)
+
+    print(f"=== Portfolio RAG benchmark ({'quick' if args.quick else 'full'}) in {workdir} ===")
+    recorder = Recorder()
+    try:
+        for stage in stages:
+            STAGES[stage](index, recorder, config)
+    finally:
+        index.flush_ingest_queue()
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "mode": "quick" if args.quick else "full",
+            "config": config,
+            "llm_latency": args.llm_latency,
+            "embed_latency": args.embed_latency,
+        },
+        "results": recorder.results,
+    }
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(recorder.results, args.compare, args.threshold, args.min_delta_ms)
+        if regressions:
+            print(f"\n[FAIL] {regressions} regression(s) above {args.threshold}%")
+            return 1
+        print("\n[OK] No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
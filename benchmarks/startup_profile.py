@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Profiler cold start: setiap run adalah interpreter Python baru di workspace sementara, dengan OpenAI
+diganti fake_openai_server.py (tanpa network/API key). Yang diukur:
+  - import_seconds        : `import index` (plus modul paling mahal dari -X importtime)
+  - preload_seconds       : warm_shared_state() seperti di master gunicorn (--preload)
+  - first_request_seconds : request pertama tanpa LLM (GET /check_session)
+  - first_chat_seconds    : /send_message pertama (buka/bangun index, build chain, LLM call)
+  - warm_chat_seconds     : /send_message kedua, pembanding setelah semua siap
+  - time_to_first_response: import + preload + first_chat
+serta jumlah embedding call ke fake server per run.
+
+Jalankan dari root repo:
+    python benchmarks/startup_profile.py                            # index chroma_db yang sudah ada
+    python benchmarks/startup_profile.py --fresh-index              # tanpa chroma_db: embed semua chunk
+    python benchmarks/startup_profile.py --fresh-index --artifact   # tanpa chroma_db, dari artifact build-index
+    python benchmarks/startup_profile.py --preload --runs 5 --output startup.json
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fake_openai_server import start_fake_openai_server  # noqa: E402
+
+RESULT_PREFIX = "STARTUP_PROFILE "
+
+# Dijalankan di workspace sebagai `python startup_probe.py build|profile [--preload]`.
+# OpenAIEmbeddings dibungkus tanpa meng-import langchain_openai lebih awal (supaya biaya import
+# tetap terhitung di request pertama); tokenizer tiktoken butuh download, jadi embedding dikirim
+# sebagai teks mentah ke fake server.
+PROBE_SOURCE = '''\
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import index
+import_seconds = time.perf_counter() - start
+
+
+def offline_embeddings(**kwargs):
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(check_embedding_ctx_length=False, **kwargs)
+
+
+index.OpenAIEmbeddings = offline_embeddings
+
+if sys.argv[1] == "build":
+    print("STARTUP_PROFILE " + json.dumps(index.build_index_artifact()))
+    sys.exit(0)
+
+result = {"import_seconds": import_seconds, "preload_seconds": 0.0}
+if "--preload" in sys.argv:
+    start = time.perf_counter()
+    index.warm_shared_state()
+    result["preload_seconds"] = time.perf_counter() - start
+
+client = index.app.test_client()
+start = time.perf_counter()
+client.get("/check_session")
+result["first_request_seconds"] = time.perf_counter() - start
+
+for key, message in (("first_chat_seconds", sys.argv[2]), ("warm_chat_seconds", sys.argv[3])):
+    start = time.perf_counter()
+    response = client.post("/send_message", json={"message": message})
+    result[key] = time.perf_counter() - start
+    if response.status_code != 200 or not response.get_json().get("response"):
+        result["error"] = f"{key}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}"
+
+result["time_to_first_response"] = result["import_seconds"] + result["preload_seconds"] + result["first_chat_seconds"]
+result["index_artifact"] = index.get_index_artifact_stats()
+index.flush_ingest_queue()
+print("STARTUP_PROFILE " + json.dumps(result))
+'''
+
+TIMING_KEYS = ("import_seconds", "preload_seconds", "first_request_seconds", "first_chat_seconds",
+               "warm_chat_seconds", "time_to_first_response")
+
+
+def prepare_workspace(workspace, fresh_index, artifact_dir=None):
+    """Copy kode + data app (dan chroma_db kecuali fresh_index) ke workspace sementara"""
+    for path in glob.glob(os.path.join(REPO_ROOT, "*.py")) + glob.glob(os.path.join(REPO_ROOT, "*.json")):
+        shutil.copy(path, workspace)
+    names = ["templates", "static"] + ([] if fresh_index else ["chroma_db"])
+    for name in names:
+        src = os.path.join(REPO_ROOT, name)
+        if os.path.isdir(src):
+            shutil.copytree(src, os.path.join(workspace, name))
+    if artifact_dir:
+        shutil.copytree(artifact_dir, os.path.join(workspace, "index_artifacts"))
+    with open(os.path.join(workspace, "startup_probe.py"), 'w', encoding='utf-8') as f:
+        f.write(PROBE_SOURCE)
+
+
+def probe_env(workspace, openai_base_url):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "sk-startup-profile",
+        "OPENAI_BASE_URL": openai_base_url,
+        "OPENAI_API_BASE": openai_base_url,
+        "EMBEDDING_CACHE_FILE": os.path.join(workspace, "embedding_cache.sqlite3"),
+        "APP_DB_FILE": os.path.join(workspace, "app_data.sqlite3"),
+        "INDEX_ARTIFACT_DIR": os.path.join(workspace, "index_artifacts"),
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+
+def run_probe(workspace, env, args, *extra):
+    command = [sys.executable, "startup_probe.py", *extra]
+    completed = subprocess.run(command, cwd=workspace, env=env, capture_output=True, text=True,
+                               timeout=args.timeout)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Probe gagal (exit {completed.returncode}):\n{completed.stdout[-2000:]}\n{completed.stderr[-2000:]}")
+
+
+def import_breakdown(workspace, env, top):
+    """Modul yang di-import langsung oleh index, diurutkan berdasarkan waktu import kumulatif (-X importtime)"""
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", "import index"], cwd=workspace,
+                               env=env, capture_output=True, text=True)
+    modules = []
+    for line in completed.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)", line)
+        # Indentasi 2 spasi = import langsung dari modul index
+        if match and len(match.group(3)) == 2:
+            modules.append({"module": match.group(4), "cumulative_ms": round(int(match.group(2)) / 1000, 1)})
+    modules.sort(key=lambda item: item["cumulative_ms"], reverse=True)
+    return modules[:top]
+
+
+def summarize(runs):
+    summary = {}
+    for key in TIMING_KEYS:
+        values = [run[key] for run in runs if key in run]
+        if values:
+            summary[key] = {
+                "median": round(statistics.median(values), 3),
+                "min": round(min(values), 3),
+                "max": round(max(values), 3),
+            }
+    summary["embedding_calls"] = statistics.median(run["embedding_calls"] for run in runs)
+    return summary
+
+
+def print_report(summary, breakdown):
+    print(f"\n{'stage':<24}{'median':>10}{'min':>10}{'max':>10}  (detik)")
+    for key in TIMING_KEYS:
+        if key in summary:
+            row = summary[key]
+            print(f"{key:<24}{row['median']:>10.3f}{row['min']:>10.3f}{row['max']:>10.3f}")
+    print(f"embedding calls per run: {summary['embedding_calls']}")
+    print("\nImport paling mahal (kumulatif, ms):")
+    for item in breakdown:
+        print(f"  {item['module']:<40}{item['cumulative_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profil cold start: import time dan time-to-first-response")
+    parser.add_argument("--runs", type=int, default=3, help="Jumlah interpreter baru yang diukur")
+    parser.add_argument("--preload", action="store_true", help="Jalankan warm_shared_state() seperti gunicorn --preload")
+    parser.add_argument("--fresh-index", action="store_true", help="Mulai tanpa chroma_db (index dibangun saat request pertama)")
+    parser.add_argument("--artifact", action="store_true", help="Bangun artifact index dulu (flask build-index), lalu dipakai saat startup")
+    parser.add_argument("--message", default="apa saja skill Adam?")
+    parser.add_argument("--follow-up", default="Proyek apa saja yang pernah dikerjakan?")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Fake LLM latency (detik)")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="Fake latency per embedding request (detik)")
+    parser.add_argument("--top-imports", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--output", default=None, help="Tulis hasil JSON ke file ini")
+    args = parser.parse_args()
+
+    fake_server, openai_base_url = start_fake_openai_server(latency=args.llm_latency, embed_latency=args.embed_latency)
+    root = tempfile.mkdtemp(prefix="portfolio_rag_startup_")
+    runs, breakdown, artifact = [], [], None
+    try:
+        artifact_dir = None
+        if args.artifact:
+            build_dir = os.path.join(root, "build")
+            os.makedirs(build_dir)
+            prepare_workspace(build_dir, fresh_index=True)
+            artifact = run_probe(build_dir, probe_env(build_dir, openai_base_url), args, "build")
+            artifact_dir = os.path.join(build_dir, "index_artifacts")
+            print(f">>> Artifact {artifact['artifact']}: {artifact['chunks']} chunks, {artifact['duration_seconds']}s")
+
+        for i in range(args.runs):
+            workspace = os.path.join(root, f"run{i}")
+            os.makedirs(workspace)
+            prepare_workspace(workspace, args.fresh_index, artifact_dir)
+            env = probe_env(workspace, openai_base_url)
+            if i == 0:
+                breakdown = import_breakdown(workspace, env, args.top_imports)
+            before = fake_server.stats.get("/v1/embeddings", 0)
+            extra = ["--preload"] if args.preload else []
+            result = run_probe(workspace, env, args, "profile", args.message, args.follow_up, *extra)
+            result["embedding_calls"] = fake_server.stats.get("/v1/embeddings", 0) - before
+            runs.append(result)
+            print(f">>> Run {i + 1}/{args.runs}: import {result['import_seconds']:.2f}s, "
+                  f"first chat {result['first_chat_seconds']:.2f}s, "
+                  f"time-to-first-response {result['time_to_first_response']:.2f}s"
+                  + (f" ERROR {result['error']}" if "error" in result else ""))
+    finally:
+        fake_server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+    summary = summarize(runs)
+    print_report(summary, breakdown)
+
+    if args.output:
+        result = {
+            "meta": {
+                "timestamp": datetime.now().isoformat(),
+                "python": sys.version.split()[0],
+                "runs": args.runs,
+                "preload": args.preload,
+                "fresh_index": args.fresh_index,
+                "artifact": artifact,
+            },
+            "summary": summary,
+            "imports": breakdown,
+            "runs": runs,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"\n>>> Hasil ditulis ke {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+"""
+Konfigurasi gunicorn (otomatis dibaca dari working directory: gunicorn index:app).
+
+App di-load sekali di master (preload) lalu di-fork ke worker: import LangChain/Chroma, versi
+knowledge base, artifact index, dan tokenizer disiapkan sekali dan dipakai bersama (copy-on-write),
+bukan diulang di setiap worker. Set GUNICORN_PRELOAD=0 untuk mematikan.
+"""
+import gc
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+
+
+def when_ready(server):
+    """Master, setelah app di-load dan sebelum worker pertama di-fork"""
+    if not preload_app:
+        return
+    import index
+    index.warm_shared_state()
+    # Objek yang sudah ada tidak di-scan GC lagi, jadi halaman memorinya tetap dipakai bersama worker
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    """Worker, setelah fork: buka base index + BM25 di background sebelum request pertama"""
+    import index
+    index.warm_worker_state()
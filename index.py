@@ -1,16 +1,72 @@
-from flask import Flask, request, render_template, jsonify, session
+from flask import Flask, request, render_template, jsonify, session, Response, stream_with_context, g
 import os
+import re
 import json
+import time
+import queue
+import bisect
+import atexit
+import contextlib
+import contextvars
+import hashlib
+import importlib
+import zlib
+import shutil
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime
+# Tetap di-import di awal (diukur dengan benchmarks/startup_profile.py): click sudah di-import flask
+# (~0 ms tambahan); numpy (~80 ms) dipakai semua jalur yang membuka index, dan chromadb tetap
+# meng-import-nya. httpx di-import saat client OpenAI pertama dibuat.
+import click
+import numpy as np
 from dotenv import load_dotenv
 
-# Import LangChain components
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_chroma import Chroma
+try:
+    import fcntl  # File lock untuk append chat history lintas proses
+except ImportError:  # Windows
+    fcntl = None
+
+# Import LangChain components. langchain_core (~800 ms, kebanyakan langsmith lewat callbacks.manager)
+# tetap eager: kelas di modul ini mewarisi BaseRetriever / Embeddings / BaseCallbackHandler, dan setiap
+# invoke chain butuh modul yang sama, jadi menundanya hanya memindahkan biaya ke request pertama.
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.embeddings import Embeddings
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+# Import berat (langchain_openai + openai, langchain_chroma + chromadb, langchain.chains) ditunda
+# sampai pertama dipakai supaya import modul (cold start) cepat. Nama tetap bisa diakses dan
+# di-patch sebagai atribut modul (index.ChatOpenAI = ...); kode di modul ini memakai lazy_import().
+_LAZY_IMPORTS = {
+    "ChatOpenAI": ("langchain_openai", "ChatOpenAI"),
+    "OpenAIEmbeddings": ("langchain_openai", "OpenAIEmbeddings"),
+    "Chroma": ("langchain_chroma", "Chroma"),
+    "SharedSystemClient": ("chromadb.api.client", "SharedSystemClient"),
+    "create_retrieval_chain": ("langchain.chains", "create_retrieval_chain"),
+    "create_stuff_documents_chain": ("langchain.chains.combine_documents", "create_stuff_documents_chain"),
+}
+
+def lazy_import(name):
+    """Ambil nama dari _LAZY_IMPORTS, import modulnya saat pertama dipakai (nilai yang di-patch diutamakan)"""
+    value = globals().get(name)
+    if value is None:
+        module_name, attr = _LAZY_IMPORTS[name]
+        value = getattr(importlib.import_module(module_name), attr)
+        globals()[name] = value
+    return value
+
+def __getattr__(name):
+    if name in _LAZY_IMPORTS:
+        return lazy_import(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Load environment variables
 load_dotenv()
@@ -18,6 +74,186 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here-change-in-production-2024')
 
+# ================= METRICS =================
+
+# Histogram in-process (per worker) untuk durasi tiap stage, request HTTP, dan token per LLM call.
+# Diekspos dalam format teks Prometheus di /metrics.
+METRICS_PREFIX = "portfolio_rag"
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+# Jika aktif, response /send_message (dan event "done" streaming) menyertakan breakdown waktu per stage
+DEBUG_TIMINGS = os.getenv('DEBUG_TIMINGS', '0').lower() in ('1', 'true', 'yes')
+
+_metrics_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> {"buckets": tuple, "counts": list, "sum": float, "count": int}
+_histogram_help = {
+    "stage_duration_seconds": "Durasi tiap stage request path (detik)",
+    "http_request_duration_seconds": "Durasi request HTTP per endpoint (detik, streaming: sampai response dibuat)",
+    "llm_call_duration_seconds": "Durasi LLM call (detik)",
+    "llm_tokens_per_call": "Jumlah token per LLM call",
+}
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def observe_histogram(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Catat satu observasi ke histogram `name` dengan label tertentu"""
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        index = bisect.bisect_left(histogram["buckets"], value)
+        if index < len(histogram["counts"]):
+            histogram["counts"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def record_request_timing(stage, seconds):
+    """Tambahkan durasi stage ke breakdown request aktif (hanya jika DEBUG_TIMINGS)"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 2)
+
+@contextlib.contextmanager
+def timed_stage(stage):
+    """Context manager / decorator: ukur durasi stage ke histogram + breakdown request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe_histogram("stage_duration_seconds", elapsed, stage=stage)
+        record_request_timing(stage, elapsed)
+
+class RAGMetricsCallback(BaseCallbackHandler):
+    """Callback LangChain: durasi retrieval, serta durasi dan jumlah token setiap LLM call (contextualize / summarize / answer)"""
+
+    # Handler murah dan non-blocking: di jalur async dipanggil langsung, tanpa hop ke thread pool per token
+    run_inline = True
+
+    def __init__(self):
+        self._starts = {}
+
+    def on_retriever_start(self, serialized, query, *, run_id, **kwargs):
+        self._starts[run_id] = (time.perf_counter(), "retrieval", 0)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        entry = self._starts.pop(run_id, None)
+        if entry is not None:
+            elapsed = time.perf_counter() - entry[0]
+            observe_histogram("stage_duration_seconds", elapsed, stage="retrieval")
+            record_request_timing("retrieval", elapsed)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        call = next((tag for tag in ("contextualize", "summarize") if tags and tag in tags), "answer")
+        self._starts[run_id] = (time.perf_counter(), call, 0)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        entry = self._starts.get(run_id)
+        if entry is not None:
+            self._starts[run_id] = (entry[0], entry[1], entry[2] + 1)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        entry = self._starts.pop(run_id, None)
+        if entry is None:
+            return
+        start, call, streamed_chunks = entry
+        elapsed = time.perf_counter() - start
+        observe_histogram("llm_call_duration_seconds", elapsed, call=call)
+        record_request_timing(f"llm_{call}", elapsed)
+
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+        if prompt_tokens is None and response.generations and response.generations[0]:
+            message = getattr(response.generations[0][0], "message", None)
+            usage_metadata = getattr(message, "usage_metadata", None) or {}
+            prompt_tokens = usage_metadata.get("input_tokens")
+            completion_tokens = usage_metadata.get("output_tokens")
+        if completion_tokens is None and streamed_chunks:
+            completion_tokens = streamed_chunks  # Perkiraan: satu chunk streaming ~ satu token
+        if prompt_tokens is not None:
+            observe_histogram("llm_tokens_per_call", prompt_tokens, TOKEN_BUCKETS, call=call, kind="prompt")
+        if completion_tokens is not None:
+            observe_histogram("llm_tokens_per_call", completion_tokens, TOKEN_BUCKETS, call=call, kind="completion")
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+rag_metrics_callback = RAGMetricsCallback()
+
+@app.before_request
+def _start_request_metrics():
+    g.request_start = time.perf_counter()
+    _request_timings.set({} if DEBUG_TIMINGS else None)
+
+@app.after_request
+def _record_request_metrics(response):
+    start = g.get("request_start")
+    if start is not None:
+        observe_histogram("http_request_duration_seconds", time.perf_counter() - start,
+                          endpoint=request.endpoint or "unknown", method=request.method,
+                          status=str(response.status_code))
+    return response
+
+def get_request_timings():
+    """Breakdown waktu request aktif dalam ms (None jika DEBUG_TIMINGS mati)"""
+    timings = _request_timings.get()
+    return dict(timings) if timings is not None else None
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape_label_value(value)}"' for key, value in labels) + "}"
+
+def _flatten_gauges(prefix, stats, out):
+    """Ambil semua nilai numerik dari dict stats (nested) sebagai gauge"""
+    for key, value in stats.items():
+        name = f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', str(key))}"
+        if isinstance(value, dict):
+            _flatten_gauges(name, value, out)
+        elif isinstance(value, bool):
+            out.append((name, int(value)))
+        elif isinstance(value, (int, float)):
+            out.append((name, value))
+
+def render_metrics(stats_sections):
+    """Render histogram + gauge dari stats_sections ({section: dict stats}) ke format teks Prometheus"""
+    lines = []
+    with _metrics_lock:
+        snapshot = sorted(
+            (name, labels, dict(h, counts=list(h["counts"]))) for (name, labels), h in _histograms.items()
+        )
+
+    current = None
+    for name, labels, histogram in snapshot:
+        metric = f"{METRICS_PREFIX}_{name}"
+        if name != current:
+            current = name
+            lines.append(f"# HELP {metric} {_histogram_help.get(name, name)}")
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            cumulative += count
+            lines.append(f"{metric}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+        lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {histogram['count']}")
+
+    gauges = []
+    for section, section_stats in stats_sections.items():
+        if section_stats:
+            _flatten_gauges(f"{METRICS_PREFIX}_{section}", section_stats, gauges)
+    for name, value in gauges:
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
 # ================= MULTI-USER CONFIGURATION =================
 
 # Directory untuk menyimpan data per user
@@ -25,26 +261,175 @@ USERS_DATA_DIR = "users_data"
 if not os.path.exists(USERS_DATA_DIR):
     os.makedirs(USERS_DATA_DIR)
 
-# File untuk menyimpan daftar username yang terdaftar
+# File lama daftar username (dimigrasi otomatis ke SQLite user store)
 USERS_FILE = "registered_users.json"
 
-def load_registered_users():
-    """Load list of registered usernames"""
+# ================= USER STORE (SQLITE) =================
+
+# User, guest id, last-seen dan lokasi storage disimpan di SQLite (WAL mode)
+# supaya lookup ter-index dan aman dipakai paralel oleh beberapa gunicorn worker.
+APP_DB_FILE = os.getenv('APP_DB_FILE', 'app_data.sqlite3')
+USER_TOUCH_FLUSH_INTERVAL = float(os.getenv('USER_TOUCH_FLUSH_INTERVAL', '30'))  # detik
+USER_TOUCH_FLUSH_SIZE = 100
+
+_app_db_local = threading.local()
+_app_db_init_lock = threading.Lock()
+_app_db_initialized_pid = None
+_pending_user_touches = {}  # user_id -> (is_guest, last_seen)
+_pending_user_touches_lock = threading.Lock()
+_last_user_touch_flush = time.time()
+
+def _init_app_db(conn):
+    """Buat schema dan migrasi registered_users.json (idempotent)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            is_guest INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            last_seen REAL NOT NULL,
+            storage_dir TEXT NOT NULL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_guest_last_seen ON users(is_guest, last_seen)")
+
     if os.path.exists(USERS_FILE):
         try:
             with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
+                legacy_users = json.load(f)
+            now = time.time()
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (user_id, is_guest, created_at, last_seen, storage_dir) VALUES (?, 0, ?, ?, ?)",
+                [(username, now, now, os.path.join(USERS_DATA_DIR, username)) for username in legacy_users]
+            )
+        except Exception as e:
+            print(f"Error migrating registered users: {e}")
+
+    # Direktori guest lama yang belum tercatat: last_seen = waktu modifikasi terakhir
+    if os.path.isdir(USERS_DATA_DIR):
+        rows = []
+        for entry in os.scandir(USERS_DATA_DIR):
+            if entry.is_dir() and entry.name.startswith("guest_"):
+                mtime = entry.stat().st_mtime
+                rows.append((entry.name, mtime, mtime, entry.path))
+        conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, is_guest, created_at, last_seen, storage_dir) VALUES (?, 1, ?, ?, ?)",
+            rows
+        )
+    conn.commit()
+
+def get_app_db():
+    """Koneksi SQLite per thread (schema diinisialisasi sekali per proses)"""
+    global _app_db_initialized_pid
+    conn = getattr(_app_db_local, "conn", None)
+    if conn is None or getattr(_app_db_local, "pid", None) != os.getpid():
+        conn = sqlite3.connect(APP_DB_FILE, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _app_db_local.conn = conn
+        _app_db_local.pid = os.getpid()
+    if _app_db_initialized_pid != os.getpid():
+        with _app_db_init_lock:
+            if _app_db_initialized_pid != os.getpid():
+                _init_app_db(conn)
+                _app_db_initialized_pid = os.getpid()
+    return conn
+
+def _upsert_users(rows):
+    """rows: [(user_id, is_guest, last_seen)] -> insert user baru atau update last_seen"""
+    conn = get_app_db()
+    conn.executemany("""
+        INSERT INTO users (user_id, is_guest, created_at, last_seen, storage_dir)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            last_seen = MAX(users.last_seen, excluded.last_seen),
+            is_guest = MIN(users.is_guest, excluded.is_guest)
+    """, [(user_id, int(is_guest), last_seen, last_seen, os.path.join(USERS_DATA_DIR, user_id))
+          for user_id, is_guest, last_seen in rows])
+    conn.commit()
+
+def touch_user(user_id, is_guest):
+    """
+    Catat aktivitas user (last_seen). Update di-buffer dan ditulis per batch
+    setiap USER_TOUCH_FLUSH_INTERVAL detik atau USER_TOUCH_FLUSH_SIZE user.
+    """
+    global _last_user_touch_flush
+    now = time.time()
+    with _pending_user_touches_lock:
+        _pending_user_touches[user_id] = (is_guest, now)
+        due = (len(_pending_user_touches) >= USER_TOUCH_FLUSH_SIZE
+               or now - _last_user_touch_flush >= USER_TOUCH_FLUSH_INTERVAL)
+    if due:
+        flush_user_touches()
+
+def flush_user_touches():
+    """Tulis semua last_seen yang masih di buffer dalam satu transaksi"""
+    global _last_user_touch_flush
+    with _pending_user_touches_lock:
+        rows = [(user_id, is_guest, last_seen) for user_id, (is_guest, last_seen) in _pending_user_touches.items()]
+        _pending_user_touches.clear()
+        _last_user_touch_flush = time.time()
+    if rows:
+        try:
+            _upsert_users(rows)
+        except Exception as e:
+            print(f"Error flushing user activity: {e}")
+
+atexit.register(flush_user_touches)
+
+def load_registered_users():
+    """Load list of registered usernames"""
+    try:
+        rows = get_app_db().execute(
+            "SELECT user_id FROM users WHERE is_guest = 0 ORDER BY created_at, user_id"
+        ).fetchall()
+        return [row[0] for row in rows]
+    except Exception as e:
+        print(f"Error loading registered users: {e}")
+        return []
 
 def save_registered_user(username):
     """Save new username to registered users"""
-    users = load_registered_users()
-    if username not in users:
-        users.append(username)
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
+    _upsert_users([(username, False, time.time())])
+
+def get_user_record(user_id):
+    """Ambil data user dari store (dict) atau None jika belum pernah tercatat"""
+    flush_user_touches()
+    row = get_app_db().execute(
+        "SELECT user_id, is_guest, created_at, last_seen, storage_dir FROM users WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {"user_id": row[0], "is_guest": bool(row[1]), "created_at": row[2], "last_seen": row[3], "storage_dir": row[4]}
+
+def list_inactive_users(inactive_since, guests_only=True):
+    """List user yang last_seen-nya lebih lama dari timestamp `inactive_since` (untuk cleanup job)"""
+    flush_user_touches()
+    query = "SELECT user_id, is_guest, last_seen, storage_dir FROM users WHERE last_seen < ?"
+    if guests_only:
+        query += " AND is_guest = 1"
+    rows = get_app_db().execute(query + " ORDER BY last_seen", (inactive_since,)).fetchall()
+    return [{"user_id": r[0], "is_guest": bool(r[1]), "last_seen": r[2], "storage_dir": r[3]} for r in rows]
+
+def delete_user_record(user_id):
+    """Hapus user dari store (dipakai saat data user dibersihkan)"""
+    conn = get_app_db()
+    conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+    conn.commit()
+
+def get_user_store_stats():
+    """Jumlah user terdaftar/guest di store dan update last_seen yang belum ditulis"""
+    try:
+        registered, guests = get_app_db().execute(
+            "SELECT COALESCE(SUM(is_guest = 0), 0), COALESCE(SUM(is_guest = 1), 0) FROM users"
+        ).fetchone()
+    except Exception as e:
+        print(f"Error reading user store stats: {e}")
+        registered, guests = None, None
+    return {
+        "registered_users": registered,
+        "guest_users": guests,
+        "pending_activity_updates": len(_pending_user_touches),
+    }
 
 def get_user_directory(username):
     """Get or create user's data directory"""
@@ -63,140 +448,2885 @@ def get_user_portfolio_file(username):
     user_dir = get_user_directory(username)
     return os.path.join(user_dir, "portfolio_data.json")
 
-def get_user_chroma_dir(username):
-    """Get path to user's ChromaDB directory"""
-    user_dir = get_user_directory(username)
-    chroma_dir = os.path.join(user_dir, "chroma_db")
-    if not os.path.exists(chroma_dir):
-        os.makedirs(chroma_dir)
-    return chroma_dir
+def get_user_overlay_dir(username):
+    """Get path to user's private overlay ChromaDB directory"""
+    user_dir = get_user_directory(username)
+    overlay_dir = os.path.join(user_dir, "overlay_db")
+    if not os.path.exists(overlay_dir):
+        os.makedirs(overlay_dir)
+    return overlay_dir
+
+# ================= PERSISTENT STORAGE =================
+
+CHAT_HISTORY_FILE = "chat_history.json"  # Legacy, akan diganti dengan per-user
+# Batas atas pesan yang dibaca dari ekor log per request; yang benar-benar masuk prompt
+# ditentukan oleh token budget (lihat CHAT HISTORY TOKEN BUDGET)
+CHAT_HISTORY_WINDOW = int(os.getenv('CHAT_HISTORY_WINDOW', '40'))
+CHAT_SUMMARY_FILE = "chat_summary.json"
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_LOG_READ_BLOCK = 8192
+
+# Chat history disimpan append-only sebagai JSONL (satu pesan per baris):
+# setiap turn hanya menulis baris baru, dan N pesan terakhir dibaca dari ekor file.
+def get_chat_log_file(username=None):
+    """Get path to chat history log (JSONL) untuk user, atau file global jika username None"""
+    chat_file = get_user_chat_history_file(username) if username else CHAT_HISTORY_FILE
+    return chat_file + "l"
+
+def _lock_file(f):
+    """Exclusive lock lintas proses (gunicorn workers); no-op jika fcntl tidak tersedia"""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _encode_chat_messages(messages):
+    return "".join(json.dumps(msg, ensure_ascii=False) + "\n" for msg in messages).encode('utf-8')
+
+def _decode_chat_line(line):
+    """Parse satu baris JSONL; baris rusak (misalnya write terpotong) dilewati"""
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+def _migrate_legacy_chat_history(username):
+    """Konversi chat_history.json lama menjadi log JSONL (sekali saja)"""
+    legacy_file = get_user_chat_history_file(username) if username else CHAT_HISTORY_FILE
+    log_file = legacy_file + "l"
+    if os.path.exists(log_file) or not os.path.exists(legacy_file):
+        return
+    try:
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            messages = json.load(f)
+        tmp_file = f"{log_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(_encode_chat_messages(messages))
+        os.replace(tmp_file, log_file)
+        os.remove(legacy_file)
+    except FileNotFoundError:
+        pass  # Sudah dimigrasi oleh worker lain
+    except Exception as e:
+        print(f"Error migrating chat history: {e}")
+
+def _read_chat_log_entries(log_file, limit, before=None):
+    """
+    Baca maksimal `limit` pesan terakhir sebelum byte offset `before` dengan membaca
+    file dari belakang per blok. Return (entries, start_offset) dimana entries adalah
+    list (offset, message) dan start_offset adalah offset baris pertama yang dikembalikan
+    (0 jika sudah mencapai awal file).
+    """
+    with open(log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell() if before is None else min(before, f.tell())
+        pos = end
+        buffer = b""
+        while pos > 0 and buffer.count(b"\n") <= limit:
+            read_size = min(CHAT_LOG_READ_BLOCK, pos)
+            pos -= read_size
+            f.seek(pos)
+            buffer = f.read(read_size) + buffer
+
+    lines = buffer.split(b"\n")
+    if lines and lines[-1] == b"":
+        lines.pop()
+    # Baris pertama bisa terpotong jika belum sampai awal file
+    offsets = []
+    offset = pos
+    for line in lines:
+        offsets.append(offset)
+        offset += len(line) + 1
+    if pos > 0:
+        lines, offsets = lines[1:], offsets[1:]
+
+    lines, offsets = lines[-limit:], offsets[-limit:]
+    entries = [(offset, msg) for offset, msg in zip(offsets, map(_decode_chat_line, lines)) if msg is not None]
+    return entries, (offsets[0] if offsets else pos)
+
+def _read_chat_log_tail(log_file, limit, before=None):
+    """Seperti _read_chat_log_entries, tapi hanya pesannya: return (messages, start_offset)"""
+    entries, start_offset = _read_chat_log_entries(log_file, limit, before)
+    return [msg for _, msg in entries], start_offset
+
+@timed_stage("history_load")
+def load_chat_history(username=None, limit=None):
+    """Load chat history dari log JSONL (hanya `limit` pesan terakhir jika diberikan)"""
+    _migrate_legacy_chat_history(username)
+    log_file = get_chat_log_file(username)
+
+    if os.path.exists(log_file):
+        try:
+            if limit is not None:
+                return _read_chat_log_tail(log_file, limit)[0]
+            with open(log_file, 'rb') as f:
+                return [msg for msg in (_decode_chat_line(line) for line in f) if msg is not None]
+        except Exception as e:
+            print(f"Error loading chat history: {e}")
+            return []
+    return []
+
+@timed_stage("history_load")
+def load_chat_history_page(username=None, limit=CHAT_HISTORY_PAGE_SIZE, before=None):
+    """
+    Ambil satu halaman chat history (urut lama -> baru) yang berakhir sebelum cursor `before`.
+    Return (messages, next_cursor); next_cursor None jika tidak ada pesan yang lebih lama.
+    """
+    _migrate_legacy_chat_history(username)
+    log_file = get_chat_log_file(username)
+    if not os.path.exists(log_file):
+        return [], None
+    messages, start_offset = _read_chat_log_tail(log_file, limit, before)
+    return messages, (start_offset if start_offset > 0 else None)
+
+@timed_stage("history_load")
+def load_chat_history_entries(username=None, limit=CHAT_HISTORY_WINDOW):
+    """
+    Ambil `limit` pesan terakhir beserta byte offset-nya. Return (entries, log_id) dimana
+    log_id (inode file log) berubah jika log ditulis ulang (reset / trim).
+    """
+    _migrate_legacy_chat_history(username)
+    log_file = get_chat_log_file(username)
+    try:
+        log_id = os.stat(log_file).st_ino
+        return _read_chat_log_entries(log_file, limit)[0], log_id
+    except FileNotFoundError:
+        return [], None
+    except Exception as e:
+        print(f"Error loading chat history: {e}")
+        return [], None
+
+def get_chat_summary_file(username=None):
+    """Ringkasan rolling disimpan di samping log JSONL user"""
+    return os.path.join(os.path.dirname(get_chat_log_file(username)), CHAT_SUMMARY_FILE)
+
+def _remove_chat_summary(log_file):
+    """Offset ringkasan tidak berlaku lagi setelah log ditulis ulang"""
+    try:
+        os.remove(os.path.join(os.path.dirname(log_file), CHAT_SUMMARY_FILE))
+    except FileNotFoundError:
+        pass
+
+@timed_stage("history_append")
+def append_chat_messages(new_messages, username=None):
+    """Append pesan baru ke log JSONL dengan satu write di bawah file lock (atomic antar worker)"""
+    _migrate_legacy_chat_history(username)
+    log_file = get_chat_log_file(username)
+    data = _encode_chat_messages(new_messages)
+
+    try:
+        while True:
+            with open(log_file, 'ab') as f:
+                _lock_file(f)
+                try:
+                    # File bisa di-replace (reset) saat menunggu lock, tulis ke file yang baru
+                    if os.path.exists(log_file) and os.fstat(f.fileno()).st_ino == os.stat(log_file).st_ino:
+                        f.write(data)
+                        f.flush()
+                        return
+                finally:
+                    _unlock_file(f)
+    except Exception as e:
+        print(f"Error appending chat history: {e}")
+
+@timed_stage("history_save")
+def save_chat_history(messages, username=None):
+    """Tulis ulang seluruh chat history (dipakai untuk reset), diganti secara atomic"""
+    _migrate_legacy_chat_history(username)
+    log_file = get_chat_log_file(username)
+    tmp_file = f"{log_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        with open(log_file, 'ab') as lock_f:
+            _lock_file(lock_f)
+            try:
+                with open(tmp_file, 'wb') as f:
+                    f.write(_encode_chat_messages(messages))
+                os.replace(tmp_file, log_file)
+                _remove_chat_summary(log_file)
+            finally:
+                _unlock_file(lock_f)
+    except Exception as e:
+        print(f"Error saving chat history: {e}")
+
+def trim_chat_log(log_file, max_bytes):
+    """
+    Potong log JSONL sehingga hanya pesan terbaru (maksimal `max_bytes`) yang tersisa.
+    Dilakukan di bawah file lock dan diganti secara atomic. Return jumlah byte yang dibuang.
+    """
+    if not os.path.exists(log_file) or os.path.getsize(log_file) <= max_bytes:
+        return 0
+    tmp_file = f"{log_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(log_file, 'ab') as lock_f:
+        _lock_file(lock_f)
+        try:
+            with open(log_file, 'rb') as f:
+                data = f.read()
+            if len(data) <= max_bytes:
+                return 0
+            # Mulai dari batas baris pertama di dalam `max_bytes` terakhir
+            cut = data.find(b"\n", len(data) - max_bytes - 1) + 1
+            kept = data[cut:] if cut > 0 else b""
+            with open(tmp_file, 'wb') as f:
+                f.write(kept)
+            os.replace(tmp_file, log_file)
+            _remove_chat_summary(log_file)
+            return len(data) - len(kept)
+        finally:
+            _unlock_file(lock_f)
+
+def add_to_vectorstore(user_message, ai_response):
+    """
+    Menambahkan percakapan baru ke ChromaDB sebagai knowledge tambahan
+    Format: "User bertanya: [question]. Jawabannya: [answer]"
+    """
+    add_conversations_to_vectorstore([(user_message, ai_response, {})])
+
+@contextlib.contextmanager
+def _locked_base_vectorstore():
+    """
+    Base vectorstore versi aktif dengan file lock versi itu dipegang, untuk read-modify-write.
+    Build versi baru menyamakan isi versi lama di bawah lock yang sama sebelum pointer diganti,
+    jadi pointer dicek ulang setelah lock didapat: tidak ada tulisan ke versi yang sudah pensiun.
+    Yield None jika base vectorstore tidak tersedia.
+    """
+    while True:
+        get_base_index_dir(max_age=0)  # Versi index bisa baru saja di-swap oleh worker lain
+        vectorstore = get_base_vectorstore()
+        if vectorstore is None:
+            yield None
+            return
+        persist_dir = _vectorstore_persist_dir(vectorstore)
+        with _index_lock(persist_dir):
+            if os.path.abspath(get_base_index_dir(max_age=0)) == os.path.abspath(persist_dir):
+                yield vectorstore
+                return
+
+@timed_stage("vectorstore_add")
+def add_conversations_to_vectorstore(conversations):
+    """
+    Menambahkan batch percakapan [(question, answer, metadata), ...] ke shared ChromaDB
+    dengan satu embedding call. Duplikat tidak ditulis ulang: pertanyaan yang sama setelah
+    normalisasi (id dokumen = hash pertanyaan) atau embedding yang hampir identik di-merge
+    ke dokumen yang sudah ada (dup_count/last_seen dinaikkan). Return True jika berhasil.
+    """
+    try:
+        with _locked_base_vectorstore() as vectorstore:
+            if vectorstore is None:
+                print("Error adding to vectorstore: base vectorstore not available")
+                return False
+            kept, merged = _ingest_conversations(vectorstore, conversations)
+
+        print(f">>> {kept} conversation(s) added to vectorstore at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+              f" ({merged} merged into existing)")
+        return True
+
+    except Exception as e:
+        print(f"Error adding to vectorstore: {e}")
+        return False
+
+def _ingest_conversations(vectorstore, conversations):
+    """Dedup + tulis batch percakapan ke vectorstore (pemanggil memegang lock index). Return (ditambah, di-merge)"""
+    collection = vectorstore._collection
+    now = time.time()
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    # 1. Duplikat exact (pertanyaan ter-normalisasi sama), di dalam batch dan di index
+    pending = OrderedDict()  # doc_id -> (text, metadata)
+    for user_message, ai_response, metadata in conversations:
+        doc_id = conversation_doc_id(user_message)
+        text = f"User bertanya: {user_message}. Jawabannya: {ai_response}"
+        if doc_id in pending:
+            # Jawaban terbaru yang disimpan
+            pending[doc_id] = (text, pending[doc_id][1])
+            pending[doc_id][1]["dup_count"] += 1
+            continue
+        # Format percakapan sebagai knowledge + metadata untuk tracking dan retention
+        pending[doc_id] = (text, {
+            "source": "chat_history",
+            "timestamp": timestamp,
+            "type": "conversation",
+            "created_at": now,
+            "last_seen": now,
+            "last_hit": 0.0,
+            "hits": 0,
+            "dup_count": 1,
+            **(metadata or {})
+        })
+    merges = {}  # doc_id yang sudah ada di index -> jumlah duplikat yang di-merge
+    answers = {}  # doc_id duplikat exact -> teks percakapan terbaru (mengganti jawaban lama)
+    if pending:
+        for doc_id in collection.get(ids=list(pending), include=[])["ids"]:
+            answers[doc_id], metadata = pending.pop(doc_id)
+            merges[doc_id] = metadata["dup_count"]
+
+    # 2. Near-duplicate berdasarkan embedding similarity
+    ids = list(pending)
+    kept = []
+    if ids:
+        vectors = np.asarray(get_embeddings().embed_documents([pending[doc_id][0] for doc_id in ids]),
+                             dtype=np.float32)
+        for row, target in enumerate(find_similar_conversations(collection, ids, vectors)):
+            if target is None:
+                kept.append(row)
+                continue
+            dup_count = pending[ids[row]][1]["dup_count"]
+            if target in pending:
+                pending[target][1]["dup_count"] += dup_count
+            else:
+                merges[target] = merges.get(target, 0) + dup_count
+        if kept:
+            kept_ids = [ids[row] for row in kept]
+            texts = [pending[doc_id][0] for doc_id in kept_ids]
+            metadatas = [pending[doc_id][1] for doc_id in kept_ids]
+            signature = _vectorstore_signature(vectorstore)
+            collection.upsert(ids=kept_ids, embeddings=vectors[kept].tolist(), documents=texts,
+                              metadatas=metadatas)
+            bump_index_content_version(vectorstore)
+            # BM25 dan engine numpy ditambah dokumen baru saja, bukan dibangun ulang dari seluruh index
+            extend_index_replicas(vectorstore, signature, kept_ids, texts, metadatas, vectors[kept])
+    if merges and merge_conversation_duplicates(collection, merges, now, answers):
+        # Teks dokumen berubah, jumlahnya tidak: hanya content version yang memberi tahu worker lain
+        bump_index_content_version(vectorstore)
+        invalidate_index_replicas(vectorstore)
+    record_conversation_ingest(len(kept), len(conversations) - len(kept))
+
+    return len(kept), len(conversations) - len(kept)
+
+# ================= CONVERSATION INGESTION QUEUE =================
+
+# Write-behind: request hanya enqueue percakapan lalu langsung return,
+# worker di background menulis ke ChromaDB per batch (jumlah item / jendela waktu).
+INGEST_QUEUE_MAXSIZE = int(os.getenv('INGEST_QUEUE_MAXSIZE', '1000'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '32'))
+INGEST_BATCH_WINDOW = float(os.getenv('INGEST_BATCH_WINDOW', '2.0'))  # detik
+INGEST_ENQUEUE_TIMEOUT = float(os.getenv('INGEST_ENQUEUE_TIMEOUT', '0.05'))  # detik menunggu saat queue penuh
+
+_ingest_queue = queue.Queue(maxsize=INGEST_QUEUE_MAXSIZE)
+_ingest_worker = None
+_ingest_worker_pid = None
+_ingest_worker_lock = threading.Lock()
+_ingest_stop = threading.Event()
+_ingest_stats = {
+    "enqueued": 0,
+    "dropped": 0,
+    "written": 0,
+    "failed": 0,
+    "batches": 0,
+    "last_batch_size": 0,
+    "last_batch_lag_seconds": 0.0,
+    "max_lag_seconds": 0.0,
+}
+_ingest_oldest_pending = None  # enqueued_at dari item tertua yang belum ditulis
+
+def _ensure_ingest_worker():
+    """Start worker thread (lazy, dan start ulang di proses hasil fork gunicorn)"""
+    global _ingest_worker, _ingest_worker_pid
+    if _ingest_worker is not None and _ingest_worker.is_alive() and _ingest_worker_pid == os.getpid():
+        return
+    with _ingest_worker_lock:
+        if _ingest_worker is not None and _ingest_worker.is_alive() and _ingest_worker_pid == os.getpid():
+            return
+        _ingest_stop.clear()
+        _ingest_worker = threading.Thread(target=_ingest_worker_loop, name="ingest-worker", daemon=True)
+        _ingest_worker_pid = os.getpid()
+        _ingest_worker.start()
+
+def enqueue_conversation(user_message, ai_response, metadata=None):
+    """
+    Masukkan percakapan ke ingestion queue tanpa menunggu embedding/penulisan.
+    Jika queue penuh lebih lama dari INGEST_ENQUEUE_TIMEOUT, item dibuang (backpressure).
+    """
+    global _ingest_oldest_pending
+    _ensure_ingest_worker()
+    enqueued_at = time.time()
+    try:
+        _ingest_queue.put((user_message, ai_response, metadata or {}, enqueued_at), timeout=INGEST_ENQUEUE_TIMEOUT)
+    except queue.Full:
+        _ingest_stats["dropped"] += 1
+        print("WARNING: Ingestion queue full, conversation dropped")
+        return False
+    _ingest_stats["enqueued"] += 1
+    if _ingest_oldest_pending is None:
+        _ingest_oldest_pending = enqueued_at
+    return True
+
+def _collect_ingest_batch(first_timeout):
+    """Ambil satu batch dari queue: sampai INGEST_BATCH_SIZE item atau INGEST_BATCH_WINDOW habis"""
+    try:
+        batch = [_ingest_queue.get(timeout=first_timeout)]
+    except queue.Empty:
+        return []
+    deadline = time.time() + INGEST_BATCH_WINDOW
+    while len(batch) < INGEST_BATCH_SIZE:
+        remaining = deadline - time.time()
+        if remaining <= 0 or _ingest_stop.is_set():
+            break
+        try:
+            batch.append(_ingest_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def _write_ingest_batch(batch):
+    """Tulis satu batch ke vectorstore dan update metrics"""
+    global _ingest_oldest_pending
+    ok = add_conversations_to_vectorstore([(q, a, meta) for q, a, meta, _ in batch])
+    now = time.time()
+    lag = now - min(item[3] for item in batch)
+    _ingest_stats["batches"] += 1
+    _ingest_stats["last_batch_size"] = len(batch)
+    _ingest_stats["last_batch_lag_seconds"] = round(lag, 3)
+    _ingest_stats["max_lag_seconds"] = round(max(_ingest_stats["max_lag_seconds"], lag), 3)
+    _ingest_stats["written" if ok else "failed"] += len(batch)
+    for _ in batch:
+        _ingest_queue.task_done()
+    _ingest_oldest_pending = None if _ingest_queue.empty() else now
+
+def _ingest_worker_loop():
+    """Loop worker: kumpulkan batch lalu tulis, sampai diminta berhenti dan queue kosong"""
+    while not (_ingest_stop.is_set() and _ingest_queue.empty()):
+        batch = _collect_ingest_batch(first_timeout=0.5)
+        if batch:
+            _write_ingest_batch(batch)
+        run_conversation_maintenance()
+
+def flush_ingest_queue(timeout=30.0):
+    """Tulis semua item yang masih di queue lalu hentikan worker (dipanggil saat shutdown)"""
+    _ingest_stop.set()
+    worker = _ingest_worker
+    if worker is not None and worker.is_alive() and _ingest_worker_pid == os.getpid():
+        worker.join(timeout)
+    # Sisa item (misalnya worker tidak pernah jalan di proses ini) ditulis langsung
+    while not _ingest_queue.empty():
+        batch = _collect_ingest_batch(first_timeout=0)
+        if not batch:
+            break
+        _write_ingest_batch(batch)
+    flush_conversation_hits()
+
+atexit.register(flush_ingest_queue)
+
+def get_ingest_queue_stats():
+    """Metrics ingestion queue: kedalaman queue dan lag penulisan"""
+    oldest = _ingest_oldest_pending
+    return {
+        **_ingest_stats,
+        "queue_depth": _ingest_queue.qsize(),
+        "queue_capacity": INGEST_QUEUE_MAXSIZE,
+        "oldest_pending_age_seconds": round(time.time() - oldest, 3) if oldest else 0.0,
+        "worker_alive": _ingest_worker is not None and _ingest_worker.is_alive(),
+    }
+
+# ================= OPENAI HTTP POOL =================
+
+# Satu connection pool (sync + async) per proses untuk semua request ke model provider:
+# chat model dan embeddings memakai client yang sama, koneksi keep-alive dipakai ulang.
+OPENAI_MAX_CONNECTIONS = int(os.getenv('OPENAI_MAX_CONNECTIONS', '256'))
+OPENAI_MAX_KEEPALIVE = int(os.getenv('OPENAI_MAX_KEEPALIVE', '64'))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', '60'))
+
+_http_clients = {}
+_http_clients_pid = None
+_http_clients_lock = threading.Lock()
+
+def _get_openai_http_client(kind):
+    """Client httpx bersama per proses (dibuat ulang di proses hasil fork gunicorn)"""
+    global _http_clients, _http_clients_pid
+    with _http_clients_lock:
+        if _http_clients_pid != os.getpid():
+            _http_clients, _http_clients_pid = {}, os.getpid()
+        client = _http_clients.get(kind)
+        if client is None:
+            import httpx
+            limits = httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                  max_keepalive_connections=OPENAI_MAX_KEEPALIVE)
+            client_class = httpx.AsyncClient if kind == "async" else httpx.Client
+            client = _http_clients[kind] = client_class(limits=limits, timeout=OPENAI_TIMEOUT)
+        return client
+
+def get_openai_http_client():
+    return _get_openai_http_client("sync")
+
+def get_openai_async_http_client():
+    return _get_openai_http_client("async")
+
+def pop_openai_http_clients():
+    """Lepas client bersama (untuk ditutup saat shutdown). Return list client"""
+    with _http_clients_lock:
+        clients = list(_http_clients.values())
+        _http_clients.clear()
+        return clients
+
+def openai_client_kwargs():
+    """kwargs untuk ChatOpenAI / OpenAIEmbeddings supaya memakai pool bersama"""
+    return {
+        "api_key": os.getenv('OPENAI_API_KEY'),
+        "http_client": get_openai_http_client(),
+        "http_async_client": get_openai_async_http_client(),
+    }
+
+def _pool_usage(client):
+    """Isi connection pool httpcore di balik client httpx (None jika internal httpx berubah)"""
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "_connections", None)
+    requests = getattr(pool, "_requests", None)
+    if connections is None or requests is None:
+        return None
+    connections, requests = list(connections), list(requests)
+    queued = sum(1 for r in requests if r.is_queued())
+    active = sum(1 for c in connections if not c.is_idle())
+    return {
+        "connections": len(connections),
+        "active_connections": active,
+        "idle_connections": len(connections) - active,
+        "active_requests": len(requests) - queued,
+        "queued_requests": queued,
+        "max_connections": OPENAI_MAX_CONNECTIONS,
+        "utilization": round(active / OPENAI_MAX_CONNECTIONS, 4) if OPENAI_MAX_CONNECTIONS else 0.0,
+    }
+
+def get_openai_pool_stats():
+    """Utilisasi pool koneksi bersama (sync dan async) di proses ini"""
+    with _http_clients_lock:
+        clients = dict(_http_clients) if _http_clients_pid == os.getpid() else {}
+    return {
+        "chat_models": len(_chat_models) if _chat_models_pid == os.getpid() else 0,
+        **{kind: _pool_usage(client) for kind, client in clients.items()},
+    }
+
+# ================= SHARED MODEL CLIENTS =================
+
+# Satu instance ChatOpenAI per konfigurasi model per proses: semua chain (RAG per user, summary)
+# memakai objek dan pool koneksi yang sama, bukan membuat client baru setiap setup_rag_chain().
+_chat_models = {}
+_chat_models_pid = None
+_chat_models_lock = threading.Lock()
+
+def get_chat_model(model="gpt-3.5-turbo", **settings):
+    """ChatOpenAI bersama untuk (model, settings); dibuat ulang di proses hasil fork gunicorn"""
+    global _chat_models, _chat_models_pid
+    key = (model, tuple(sorted(settings.items())))
+    with _chat_models_lock:
+        if _chat_models_pid != os.getpid():
+            _chat_models, _chat_models_pid = {}, os.getpid()
+        llm = _chat_models.get(key)
+        if llm is None:
+            llm = _chat_models[key] = lazy_import("ChatOpenAI")(
+                model=model, callbacks=[rag_metrics_callback], **settings, **openai_client_kwargs())
+        return llm
+
+# ================= SINGLE-FLIGHT COALESCING =================
+
+# Call identik yang sedang berjalan tidak dikirim ulang ke provider: request yang datang belakangan
+# menunggu call pertama (leader) dan memakai hasil/exception-nya. Dipakai untuk embedding per teks
+# dan untuk jawaban pertanyaan pembuka (tanpa chat history) yang identik setelah normalisasi.
+SINGLE_FLIGHT = os.getenv('SINGLE_FLIGHT', '1').lower() in ('1', 'true', 'yes')
+
+class SingleFlightAborted(RuntimeError):
+    """Leader berhenti tanpa hasil (misalnya client disconnect): follower menjalankan call sendiri"""
+
+class SingleFlight:
+    """Coalescing call in-flight per key (thread-safe, follower async bisa await future-nya)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.stats = {"calls": 0, "leaders": 0, "coalesced": 0, "errors": 0}
+        self._inflight = {}  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+
+    def begin(self, key):
+        """Return (future, leader). Leader wajib memanggil finish(); follower menunggu future"""
+        with self._lock:
+            self.stats["calls"] += 1
+            future = self._inflight.get(key)
+            if future is not None:
+                self.stats["coalesced"] += 1
+                return future, False
+            self.stats["leaders"] += 1
+            future = self._inflight[key] = Future()
+            future.set_running_or_notify_cancel()  # Tidak bisa di-cancel oleh follower (asyncio.wrap_future)
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            if error is not None:
+                self.stats["errors"] += 1
+        if error is not None:
+            if not isinstance(error, Exception):
+                error = SingleFlightAborted(f"{self.name} leader aborted: {type(error).__name__}")
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key, func):
+        """Jalankan func() sekali untuk semua caller dengan key sama. Return (result, shared)"""
+        future, leader = self.begin(key)
+        if not leader:
+            try:
+                return future.result(), True
+            except SingleFlightAborted:
+                return func(), False
+        try:
+            result = func()
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result, False
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                **self.stats,
+                "coalescing_ratio": round(self.stats["coalesced"] / self.stats["calls"], 4) if self.stats["calls"] else 0.0,
+                "inflight": len(self._inflight),
+            }
+
+_embedding_flight = SingleFlight("embedding")
+_answer_flight = SingleFlight("answer")
+
+def get_coalescing_stats():
+    """Statistik single-flight per jenis call"""
+    return {"enabled": SINGLE_FLIGHT, **{f.name: f.get_stats() for f in (_embedding_flight, _answer_flight)}}
+
+# ================= EMBEDDING CACHE =================
+
+# Cache embedding persisten (content-addressed): key = hash(model + text).
+# Teks yang pernah di-embed tidak dikirim lagi ke provider, termasuk antar restart/worker.
+EMBEDDING_CACHE_FILE = os.getenv('EMBEDDING_CACHE_FILE', 'embedding_cache.sqlite3')
+EMBEDDING_CACHE_MAX_MB = float(os.getenv('EMBEDDING_CACHE_MAX_MB', '256'))
+EMBEDDING_CACHE_BATCH_SIZE = 500  # Batas parameter per query SQLite
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper dengan cache SQLite di depan provider (batch lookup + eviction by size)"""
+
+    def __init__(self, underlying, cache_file=EMBEDDING_CACHE_FILE, max_mb=EMBEDDING_CACHE_MAX_MB):
+        self.underlying = underlying
+        self.model_name = getattr(underlying, "model", type(underlying).__name__)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.stats = {"hits": 0, "misses": 0, "provider_calls": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_file, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def _lookup(self, keys):
+        """Batch lookup ke SQLite, return dict key -> vector"""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(keys), EMBEDDING_CACHE_BATCH_SIZE):
+                chunk = keys[i:i + EMBEDDING_CACHE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_access = ? WHERE key IN ({placeholders})", [now, *chunk]
+                    )
+            self._conn.commit()
+        return found
+
+    def _store(self, items):
+        """Simpan vector baru lalu evict entry paling lama jika cache melebihi batas ukuran"""
+        now = time.time()
+        rows = []
+        for key, vector in items:
+            blob = array('f', vector).tobytes()
+            rows.append((key, self.model_name, blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+            if total > self.max_bytes:
+                # Buang entry yang paling lama tidak diakses sampai ukuran turun ke 90% batas
+                excess = total - int(self.max_bytes * 0.9)
+                evicted = 0
+                for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access ASC"):
+                    if excess <= 0:
+                        break
+                    excess -= size
+                    evicted += 1
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                    (evicted,)
+                )
+                self.stats["evictions"] += evicted
+            self._conn.commit()
+
+    @timed_stage("embed_documents")
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        # Embed hanya teks yang belum pernah dilihat (dedup di dalam batch juga)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.stats["hits"] += len(texts) - len(missing)
+        self.stats["misses"] += len(missing)
+
+        if missing:
+            # Teks yang sedang di-embed oleh request lain tidak dikirim lagi: tunggu hasilnya
+            led, waiting = {}, {}
+            for key in missing:
+                future, leader = _embedding_flight.begin(key) if SINGLE_FLIGHT else (None, True)
+                (led if leader else waiting)[key] = future
+            if led:
+                self.stats["provider_calls"] += 1
+                try:
+                    vectors = self.underlying.embed_documents([missing[key] for key in led])
+                except BaseException as e:
+                    for key, future in led.items():
+                        if future is not None:
+                            _embedding_flight.finish(key, future, error=e)
+                    raise
+                new_items = list(zip(led, vectors))
+                for key, vector in new_items:
+                    if led[key] is not None:
+                        _embedding_flight.finish(key, led[key], vector)
+                self._store(new_items)
+                cached.update(new_items)
+            for key, future in waiting.items():
+                try:
+                    cached[key] = future.result()
+                except SingleFlightAborted:
+                    cached[key] = self.underlying.embed_documents([missing[key]])[0]
+
+        return [cached[key] for key in keys]
+
+    @timed_stage("embed_query")
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def get_stats(self):
+        """Statistik cache: hit rate, jumlah entry, ukuran di disk"""
+        with self._lock:
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "size_mb": round(total / (1024 * 1024), 2),
+            "max_size_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "model": self.model_name,
+        }
+
+# ================= EMBEDDING BACKENDS =================
+
+# Backend embedding dipilih per deployment. "hashing" jalan lokal di CPU (tanpa network/API key):
+# feature hashing unigram + bigram dengan bobot sublinear tf, dihitung per batch dengan numpy.
+# Backend yang membangun index dicatat di state index, index dari backend lain tidak di-query.
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'openai')  # openai | hashing
+HASHING_EMBEDDING_DIM = int(os.getenv('HASHING_EMBEDDING_DIM', '768'))
+# Index lama tanpa catatan backend dibangun dengan OpenAIEmbeddings default
+LEGACY_EMBEDDING_BACKEND_ID = "openai:text-embedding-ada-002"
+EMBEDDING_REEMBED_ON_MISMATCH = os.getenv('EMBEDDING_REEMBED_ON_MISMATCH', '1').lower() in ('1', 'true', 'yes')
+
+class HashingEmbeddings(Embeddings):
+    """Embedding lokal CPU berbasis feature hashing (deterministik lintas proses)"""
+
+    def __init__(self, dimensions=HASHING_EMBEDDING_DIM):
+        self.dimensions = dimensions
+        self.model = f"hashing-{dimensions}"
+        self.stats = {"texts": 0, "batches": 0}
+
+    def _features(self, text):
+        tokens = re.findall(r"\w+", text.lower())
+        return tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    def embed_documents(self, texts):
+        rows, cols, weights = [], [], []
+        for row, text in enumerate(texts):
+            counts = {}
+            for feature in self._features(text):
+                counts[feature] = counts.get(feature, 0) + 1
+            for feature, count in counts.items():
+                h = zlib.crc32(feature.encode('utf-8'))
+                rows.append(row)
+                cols.append(h % self.dimensions)
+                # Bit tertinggi hash sebagai tanda supaya tabrakan hash saling meniadakan
+                weights.append((1.0 + np.log(count)) * (1.0 if h & 0x80000000 else -1.0))
+
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        if rows:
+            np.add.at(matrix, (np.array(rows), np.array(cols)), np.array(weights, dtype=np.float32))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms > 0, norms, 1.0)
+        self.stats["texts"] += len(texts)
+        self.stats["batches"] += 1
+        return matrix.tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    def get_stats(self):
+        return {**self.stats, "model": self.model, "dimensions": self.dimensions}
+
+def create_embedding_backend(name=None):
+    """Buat embeddings untuk backend `name` (default EMBEDDING_BACKEND)"""
+    name = name or EMBEDDING_BACKEND
+    if name == "hashing":
+        return HashingEmbeddings()
+    if name == "openai":
+        return CachedEmbeddings(lazy_import("OpenAIEmbeddings")(**openai_client_kwargs()))
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {name}")
+
+def get_embedding_backend_id(embeddings=None):
+    """Identitas backend + model yang dicatat di metadata index, misalnya 'openai:text-embedding-ada-002'"""
+    embeddings = embeddings or get_embeddings()
+    if isinstance(embeddings, HashingEmbeddings):
+        return f"hashing:{embeddings.dimensions}"
+    return f"{EMBEDDING_BACKEND}:{getattr(embeddings, 'model_name', None) or getattr(embeddings, 'model', '')}"
+
+# ================= SHARED KNOWLEDGE INDEX =================
+
+# Index dasar dibangun SEKALI dari portfolio kanonik dan dipakai bersama oleh semua user.
+# User hanya punya overlay kecil jika benar-benar memiliki dokumen privat.
+BASE_PORTFOLIO_FILE = 'portfolio_data.json'
+BASE_CHROMA_DIR = "./chroma_db"
+RETRIEVER_K = 6
+# Index di-sync secara incremental: setiap chunk punya id stabil (hash isi), hanya chunk
+# baru/berubah yang di-embed dan chunk yang hilang dari portfolio dihapus.
+KNOWLEDGE_CHUNK_SIZE = int(os.getenv('KNOWLEDGE_CHUNK_SIZE', '1000'))  # karakter per chunk
+KNOWLEDGE_INDEX_STATE_FILE = ".kb_index_state.json"  # Di dalam persist dir: versi portfolio terakhir yang di-sync
+# Di dalam persist dir: counter yang dinaikkan setiap isi dokumen berubah (tambah, hapus, teks diganti),
+# bagian dari signature replika BM25 / numpy supaya worker lain tahu replikanya basi
+KNOWLEDGE_CONTENT_VERSION_FILE = ".kb_content_version"
+
+_embeddings = None
+_base_vectorstore = None
+_base_index_dir = None  # Direktori versi index yang sedang dipakai _base_vectorstore
+_base_vectorstore_lock = threading.Lock()
+
+def get_embeddings():
+    """Ambil embeddings backend (OpenAI dengan cache persisten, atau lokal) yang dipakai bersama di dalam proses"""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = create_embedding_backend()
+    return _embeddings
+
+def load_knowledge_base(file_path=BASE_PORTFOLIO_FILE):
+    """Load list knowledge entries dari file portfolio"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def split_knowledge_entry(text, chunk_size=KNOWLEDGE_CHUNK_SIZE):
+    """Pecah entry panjang menjadi chunk <= chunk_size karakter di batas kalimat (kata jika terpaksa)"""
+    if len(text) <= chunk_size:
+        return [text]
+    pieces = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        while len(sentence) > chunk_size:
+            cut = sentence.rfind(" ", 0, chunk_size)
+            cut = cut if cut > 0 else chunk_size
+            pieces.append(sentence[:cut])
+            sentence = sentence[cut:].lstrip()
+        if sentence:
+            pieces.append(sentence)
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + 1 + len(piece) > chunk_size:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+def build_knowledge_chunks(entries, source="portfolio", chunk_size=KNOWLEDGE_CHUNK_SIZE):
+    """
+    Entry -> {id stabil: (teks chunk, metadata)}. Id = hash isi chunk, sehingga edit satu entry
+    hanya mengubah id chunk dari entry itu (urutan entry di file tidak berpengaruh).
+    """
+    chunks = {}
+    for entry in entries:
+        entry_hash = hashlib.sha256(entry.encode('utf-8')).hexdigest()
+        for i, chunk in enumerate(split_knowledge_entry(entry, chunk_size)):
+            chunk_id = f"{source}-{hashlib.sha256(chunk.encode('utf-8')).hexdigest()[:32]}"
+            chunks[chunk_id] = (chunk, {"source": source, "entry_hash": entry_hash[:16], "chunk": i})
+    return chunks
+
+def sync_vectorstore_entries(vectorstore, entries, source="portfolio", precomputed=None):
+    """
+    Sinkronkan dokumen `source` di vectorstore dengan `entries`: upsert chunk baru/berubah,
+    hapus chunk yang sudah tidak ada. Dokumen lain (misalnya percakapan, source="chat_history")
+    tidak disentuh; dokumen tanpa metadata (index versi lama) dianggap milik `source`.
+    `precomputed(ids)` -> {id: vector} (opsional, misalnya artifact index): chunk yang ada di sana
+    tidak di-embed. Return dict jumlah chunk added/deleted/unchanged/seeded.
+    """
+    desired = build_knowledge_chunks(entries, source)
+    existing = vectorstore.get(include=["metadatas"])
+    managed = {
+        doc_id for doc_id, metadata in zip(existing["ids"], existing["metadatas"])
+        if not metadata or metadata.get("source") == source
+    }
+
+    to_add = [chunk_id for chunk_id in desired if chunk_id not in managed]
+    to_delete = [doc_id for doc_id in managed if doc_id not in desired]
+    if to_delete:
+        vectorstore.delete(ids=to_delete)
+    vectors = precomputed(to_add) if precomputed and to_add else {}
+    if vectors:
+        seeded = list(vectors)
+        vectorstore._collection.upsert(
+            ids=seeded,
+            embeddings=[vectors[chunk_id] for chunk_id in seeded],
+            documents=[desired[chunk_id][0] for chunk_id in seeded],
+            metadatas=[desired[chunk_id][1] for chunk_id in seeded]
+        )
+    to_embed = [chunk_id for chunk_id in to_add if chunk_id not in vectors]
+    if to_embed:
+        # Satu embedding call untuk semua chunk yang berubah
+        vectorstore.add_texts(
+            texts=[desired[chunk_id][0] for chunk_id in to_embed],
+            metadatas=[desired[chunk_id][1] for chunk_id in to_embed],
+            ids=to_embed
+        )
+    if to_add or to_delete:
+        bump_index_content_version(vectorstore)
+        invalidate_index_replicas(vectorstore)
+    return {"added": len(to_add), "deleted": len(to_delete), "unchanged": len(desired) - len(to_add),
+            "seeded": len(vectors)}
+
+def _read_index_state(persist_dir):
+    try:
+        with open(os.path.join(persist_dir, KNOWLEDGE_INDEX_STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_index_state(persist_dir, state):
+    state_file = os.path.join(persist_dir, KNOWLEDGE_INDEX_STATE_FILE)
+    tmp_file = f"{state_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+def _read_content_version(persist_dir):
+    try:
+        with open(os.path.join(persist_dir, KNOWLEDGE_CONTENT_VERSION_FILE), 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+def bump_index_content_version(store):
+    """
+    Naikkan content version index `store` setelah dokumennya ditulis. Pemanggil memegang
+    _index_lock. Store in-memory tidak punya counter (replikanya hanya ada di proses ini).
+    """
+    persist_dir = _vectorstore_persist_dir(store)
+    if not persist_dir:
+        return
+    version_file = os.path.join(persist_dir, KNOWLEDGE_CONTENT_VERSION_FILE)
+    tmp_file = f"{version_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(str(_read_content_version(persist_dir) + 1))
+    os.replace(tmp_file, version_file)
+
+@contextlib.contextmanager
+def _index_lock(persist_dir):
+    """File lock per index, supaya sync / embed ulang tidak dikerjakan dua worker sekaligus"""
+    os.makedirs(persist_dir, exist_ok=True)
+    with open(os.path.join(persist_dir, ".kb_index.lock"), 'a') as lock_f:
+        _lock_file(lock_f)
+        try:
+            yield
+        finally:
+            _unlock_file(lock_f)
+
+def ensure_index_embedding_backend(persist_dir):
+    """
+    Pastikan index di persist_dir dibangun dengan backend embedding proses ini. Index dari backend
+    lain tidak boleh di-query: semua dokumennya di-embed ulang (EMBEDDING_REEMBED_ON_MISMATCH)
+    atau return False. Index tanpa catatan backend dianggap LEGACY_EMBEDDING_BACKEND_ID.
+    """
+    backend_id = get_embedding_backend_id()
+    with _index_lock(persist_dir):
+        state = _read_index_state(persist_dir)
+        if state.get("embedding_backend") == backend_id:
+            return True
+
+        vectorstore = lazy_import("Chroma")(persist_directory=persist_dir, embedding_function=get_embeddings())
+        count = vectorstore._collection.count()
+        indexed_with = state.get("embedding_backend") or (LEGACY_EMBEDDING_BACKEND_ID if count else backend_id)
+        if indexed_with != backend_id:
+            print(f"WARNING: index {persist_dir} dibangun dengan '{indexed_with}', backend aktif '{backend_id}'")
+            if not EMBEDDING_REEMBED_ON_MISMATCH:
+                return False
+            print(f">>> Re-embedding {count} documents in {persist_dir} with {backend_id}...")
+            data = vectorstore.get(include=["documents", "metadatas"])
+            vectorstore.reset_collection()
+            for start in range(0, len(data["ids"]), 256):
+                vectorstore.add_texts(
+                    texts=data["documents"][start:start + 256],
+                    metadatas=[metadata or {} for metadata in data["metadatas"][start:start + 256]],
+                    ids=data["ids"][start:start + 256]
+                )
+            bump_index_content_version(vectorstore)
+            invalidate_index_replicas(vectorstore)
+        _write_index_state(persist_dir, {**state, "embedding_backend": backend_id})
+        return True
+
+def sync_knowledge_index(vectorstore, force=False):
+    """
+    Sync incremental base index dengan portfolio kanonik. Dilewati jika versi portfolio, chunk size
+    dan backend embedding sama dengan sync terakhir (kecuali force). Dikunci lintas worker gunicorn.
+    """
+    if not os.path.exists(BASE_PORTFOLIO_FILE):
+        print(f"WARNING: Portfolio file not found: {BASE_PORTFOLIO_FILE}")
+        return {"skipped": "portfolio not found"}
+
+    persist_dir = _vectorstore_persist_dir(vectorstore)
+    with _index_lock(persist_dir):
+        version = get_knowledge_base_version()
+        state = {"kb_version": version, "chunk_size": KNOWLEDGE_CHUNK_SIZE,
+                 "embedding_backend": get_embedding_backend_id()}
+        if not force and _read_index_state(persist_dir) == state:
+            return {"skipped": "up to date", "kb_version": version}
+
+        start = time.perf_counter()
+        # Chunk yang ada di artifact index (build-index) tidak perlu di-embed
+        report = sync_vectorstore_entries(
+            vectorstore, load_knowledge_base(),
+            precomputed=lambda ids: artifact_embeddings(ids, state["embedding_backend"])
+        )
+        _index_artifact_stats["seeded_chunks"] += report["seeded"]
+        _write_index_state(persist_dir, state)
+        report.update(kb_version=version, duration_seconds=round(time.perf_counter() - start, 3))
+        print(f">>> Knowledge index synced: {report['added']} added ({report['seeded']} from artifact), "
+              f"{report['deleted']} deleted, {report['unchanged']} unchanged")
+        return report
+
+def get_base_vectorstore():
+    """
+    Ambil shared base vectorstore dari versi index aktif (lihat INDEX VERSIONS). Saat pertama
+    di-load, index di-sync incremental dengan portfolio kanonik (hanya entry baru/berubah yang
+    di-embed). Jika pointer versi berubah, proses ini pindah ke versi baru.
+    Return None jika portfolio tidak ditemukan dan index belum ada.
+    """
+    global _base_vectorstore, _base_index_dir
+    index_dir = get_base_index_dir()
+    vectorstore = _base_vectorstore
+    if vectorstore is not None and _base_index_dir == index_dir:
+        return vectorstore
+
+    with _base_vectorstore_lock:
+        if _base_vectorstore is not None and _base_index_dir == index_dir:
+            return _base_vectorstore
+
+        index_exists = os.path.exists(index_dir) and len(os.listdir(index_dir)) > 0
+        if not index_exists and not os.path.exists(BASE_PORTFOLIO_FILE):
+            print(f"WARNING: Portfolio file not found: {BASE_PORTFOLIO_FILE}")
+            return None
+
+        print(f">>> {'Loading' if index_exists else 'Creating'} shared base ChromaDB Vector Store ({index_dir})...")
+        if not ensure_index_embedding_backend(index_dir):
+            return None
+        vectorstore = lazy_import("Chroma")(
+            persist_directory=index_dir,
+            embedding_function=get_embeddings()
+        )
+        sync_knowledge_index(vectorstore)
+        previous_dir = _base_index_dir if _base_vectorstore is not None else None
+        _base_vectorstore, _base_index_dir = vectorstore, index_dir
+
+    if previous_dir is not None:
+        _on_base_index_swapped(previous_dir, index_dir)
+    return vectorstore
+
+def reindex_knowledge_base(force=False):
+    """Sync ulang base index dengan portfolio_data.json (on demand, tanpa rebuild penuh)"""
+    vectorstore = get_base_vectorstore()
+    if vectorstore is None:
+        return {"skipped": "base vectorstore not available"}
+    with _base_vectorstore_lock:
+        return sync_knowledge_index(vectorstore, force=force)
+
+def reset_base_vectorstore():
+    """Lepas shared base vectorstore supaya di-load ulang pada pemakaian berikutnya"""
+    global _base_vectorstore, _base_index_dir
+    with _base_vectorstore_lock:
+        _base_vectorstore = _base_index_dir = None
+        _index_pointer["checked_at"] = None  # Pointer versi dibaca ulang
+        # Chroma menyimpan client per path di dalam proses, buang supaya index dibuka ulang dari disk
+        lazy_import("SharedSystemClient").clear_system_cache()
+    invalidate_index_replicas()
+
+def get_knowledge_index_stats():
+    """Ukuran shared index: jumlah dokumen (jika sudah di-load) dan ukuran di disk"""
+    vectorstore = _base_vectorstore
+    index_dir = _base_index_dir or get_base_index_dir()
+    documents = None
+    if vectorstore is not None:
+        try:
+            documents = vectorstore._collection.count()
+        except Exception as e:
+            print(f"Error counting base index: {e}")
+    return {
+        "loaded": vectorstore is not None,
+        "directory": index_dir,
+        "embedding_backend": _read_index_state(index_dir).get("embedding_backend"),
+        "documents": documents,
+        "disk_bytes": get_directory_size(index_dir) if os.path.exists(index_dir) else 0,
+    }
+
+def get_user_private_documents(username):
+    """
+    Dokumen privat user = entry di portfolio milik user yang tidak ada di portfolio kanonik.
+    User tanpa file portfolio sendiri (misalnya semua guest) tidak punya dokumen privat.
+    """
+    user_file = os.path.join(USERS_DATA_DIR, username, "portfolio_data.json")
+    if not os.path.exists(user_file) or not os.path.exists(BASE_PORTFOLIO_FILE):
+        return []
+    try:
+        base_entries = set(load_knowledge_base())
+        return [entry for entry in load_knowledge_base(user_file) if entry not in base_entries]
+    except Exception as e:
+        print(f"Error loading private documents for {username}: {e}")
+        return []
+
+def get_user_overlay_vectorstore(username):
+    """
+    Ambil overlay vectorstore milik user, hanya berisi dokumen privat user.
+    Return None jika user tidak punya dokumen privat (tanpa embedding, tanpa disk).
+    Dengan engine numpy, overlay hanya ada di memori (embedding dari cache, tanpa Chroma di disk).
+    """
+    private_docs = get_user_private_documents(username)
+    if not private_docs:
+        return None
+
+    if VECTOR_ENGINE != "chroma" and use_numpy_engine(len(private_docs)):
+        chunks = build_knowledge_chunks(private_docs, source="private")
+        return NumpyVectorStore.from_texts(
+            [text for text, _metadata in chunks.values()], get_embeddings(),
+            metadatas=[metadata for _text, metadata in chunks.values()], ids=list(chunks),
+            name=f"overlay:{username}"
+        )
+
+    overlay_dir = get_user_overlay_dir(username)
+    if not ensure_index_embedding_backend(overlay_dir):
+        return None
+    overlay = lazy_import("Chroma")(
+        persist_directory=overlay_dir,
+        embedding_function=get_embeddings()
+    )
+    # Sinkronkan overlay dengan dokumen privat terbaru (hanya chunk yang berubah)
+    report = sync_vectorstore_entries(overlay, private_docs, source="private")
+    if report["added"] or report["deleted"]:
+        print(f">>> Overlay Vector Store synced for user {username}: {report['added']} added, {report['deleted']} deleted")
+    return overlay
+
+class MergedRetriever(BaseRetriever):
+    """Retriever yang query base index + overlay user, lalu merge hasil berdasarkan jarak"""
+
+    vectorstores: list
+    k: int = RETRIEVER_K
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        docs = self._vector_search(query)
+        record_conversation_hits(docs)
+        return docs
+
+    def _vector_search(self, query):
+        # Embed query sekali, lalu dipakai untuk semua index
+        query_embedding = get_embeddings().embed_query(query)
+        scored = []
+        for store in self.vectorstores:
+            engine = get_vector_engine(store)
+            scored.extend(engine.similarity_search_by_vector_with_relevance_scores(query_embedding, k=self.k))
+        scored.sort(key=lambda item: item[1])
+
+        docs, seen = [], set()
+        for doc, _distance in scored:
+            if doc.page_content in seen:
+                continue
+            seen.add(doc.page_content)
+            docs.append(doc)
+            if len(docs) >= self.k:
+                break
+        return docs
+
+# ================= INDEX VERSIONS =================
+
+# Rebuild base index (misalnya /clear_all) berjalan sebagai job background yang menulis ke direktori
+# versi baru INDEX_VERSIONS_DIR/<versi>/, sementara versi aktif tetap melayani query. Setelah build
+# selesai, pointer CURRENT diganti atomik (os.replace) dan setiap worker pindah ke versi baru saat
+# pointer dicek berikutnya (paling lama INDEX_POINTER_CHECK_INTERVAL detik). Versi lama disimpan
+# INDEX_VERSION_GRACE detik untuk query yang masih berjalan, lalu dihapus. Tanpa pointer (belum
+# pernah ada build), index di BASE_CHROMA_DIR yang dipakai dan tidak pernah dihapus.
+INDEX_VERSIONS_DIR = os.getenv('INDEX_VERSIONS_DIR', 'index_versions')
+INDEX_VERSION_GRACE = float(os.getenv('INDEX_VERSION_GRACE', '300'))  # detik
+INDEX_POINTER_CHECK_INTERVAL = float(os.getenv('INDEX_POINTER_CHECK_INTERVAL', '2'))  # detik
+INDEX_POINTER_FILE = "CURRENT"
+INDEX_BUILD_STATUS_FILE = "build_status.json"  # Status build terakhir, dibaca worker mana pun
+INDEX_COPY_BATCH_SIZE = 256
+
+_index_pointer = {"checked_at": None, "dir": None}
+_index_build_thread = None
+_index_build_lock = threading.Lock()
+_index_build_status = {"state": "idle"}
+_index_version_stats = {"builds": 0, "build_failures": 0, "swaps": 0, "versions_removed": 0}
+
+def _read_index_versions_file(name):
+    try:
+        with open(os.path.join(INDEX_VERSIONS_DIR, name), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_index_versions_file(name, data):
+    os.makedirs(INDEX_VERSIONS_DIR, exist_ok=True)
+    path = os.path.join(INDEX_VERSIONS_DIR, name)
+    tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_file, path)
+
+def get_base_index_dir(max_age=INDEX_POINTER_CHECK_INTERVAL):
+    """Direktori versi base index aktif. Pointer dibaca ulang paling sering tiap max_age detik"""
+    now = time.monotonic()
+    checked_at = _index_pointer["checked_at"]
+    if checked_at is None or now - checked_at >= max_age:
+        version = _read_index_versions_file(INDEX_POINTER_FILE).get("version")
+        version_dir = os.path.join(INDEX_VERSIONS_DIR, version) if version else None
+        _index_pointer["dir"] = version_dir if version_dir and os.path.isdir(version_dir) else BASE_CHROMA_DIR
+        _index_pointer["checked_at"] = now
+    return _index_pointer["dir"]
+
+def refresh_base_vectorstore():
+    """Pindah ke versi index baru jika pointer berubah (murah: hanya baca pointer, di-throttle)"""
+    if _base_vectorstore is not None and get_base_index_dir() != _base_index_dir:
+        get_base_vectorstore()
+
+def _release_chroma_client(persist_dir):
+    """Tutup client Chroma untuk persist_dir di proses ini (versi index yang sudah tidak dipakai)"""
+    system = lazy_import("SharedSystemClient")._identifier_to_system.pop(persist_dir, None)
+    if system is not None:
+        try:
+            system.stop()
+        except Exception as e:
+            print(f"Error closing index {persist_dir}: {e}")
+
+def _on_base_index_swapped(previous_dir, index_dir):
+    """Chain, jawaban tersimpan, dan replica index memakai versi lama: buang, lalu tutup client lama setelah grace"""
+    _index_version_stats["swaps"] += 1
+    clear_rag_chain_cache()
+    clear_answer_cache()
+    invalidate_index_replicas()
+    timer = threading.Timer(INDEX_VERSION_GRACE, _release_chroma_client, args=(previous_dir,))
+    timer.daemon = True
+    timer.start()
+    print(f">>> Base index switched: {previous_dir} -> {index_dir}")
+
+def _set_index_build_status(**fields):
+    _index_build_status.update(fields, updated_at=time.time())
+    _write_index_versions_file(INDEX_BUILD_STATUS_FILE, _index_build_status)
+
+def _copy_index_documents(source, target, ids=None, skip_source=None, progress=None):
+    """
+    Salin dokumen (beserta embedding tersimpan, tanpa embedding call) dari collection source ke
+    target per batch. ids=None = semua dokumen; dokumen dengan metadata source == skip_source
+    dilewati. Return jumlah dokumen yang disalin.
+    """
+    ids = source.get(include=[])["ids"] if ids is None else list(ids)
+    copied = 0
+    for offset in range(0, len(ids), INDEX_COPY_BATCH_SIZE):
+        data = source._collection.get(ids=ids[offset:offset + INDEX_COPY_BATCH_SIZE],
+                                      include=["documents", "metadatas", "embeddings"])
+        rows = [i for i, metadata in enumerate(data["metadatas"])
+                if not skip_source or (metadata or {}).get("source") != skip_source]
+        if rows:
+            target._collection.upsert(
+                ids=[data["ids"][i] for i in rows],
+                embeddings=[data["embeddings"][i].tolist() for i in rows],
+                documents=[data["documents"][i] for i in rows],
+                metadatas=[data["metadatas"][i] or None for i in rows]
+            )
+            copied += len(rows)
+        if progress:
+            progress(min(offset + INDEX_COPY_BATCH_SIZE, len(ids)), len(ids))
+    return copied
+
+def _catch_up_index_documents(source, target):
+    """
+    Samakan dokumen non-portfolio target dengan source: dokumen baru / berubah disalin, dokumen yang
+    sudah dihapus dari source (compaction) dihapus dari target. Return (disalin, dihapus).
+    """
+    source_data = source.get(include=["documents", "metadatas"])
+    target_data = target.get(include=["documents", "metadatas"])
+    current = {doc_id: (text, metadata or {})
+               for doc_id, text, metadata in zip(target_data["ids"], target_data["documents"], target_data["metadatas"])}
+    changed = [doc_id for doc_id, text, metadata in zip(source_data["ids"], source_data["documents"],
+                                                        source_data["metadatas"])
+               if (metadata or {}).get("source") != "portfolio" and current.get(doc_id) != (text, metadata or {})]
+    copied = _copy_index_documents(source, target, ids=changed, skip_source="portfolio")
+    source_ids = set(source_data["ids"])
+    removed = [doc_id for doc_id, (_text, metadata) in current.items()
+               if doc_id not in source_ids and metadata.get("source") != "portfolio"]
+    for offset in range(0, len(removed), INDEX_COPY_BATCH_SIZE):
+        target._collection.delete(ids=removed[offset:offset + INDEX_COPY_BATCH_SIZE])
+    if copied or removed:
+        bump_index_content_version(target)
+    return copied, len(removed)
+
+def build_index_version(keep_conversations=True, reason="manual"):
+    """
+    Bangun base index versi baru lalu aktifkan secara atomik:
+    1. keep_conversations: salin semua dokumen versi aktif (embedding tersimpan, tanpa embedding call);
+       tanpa itu versi baru hanya berisi portfolio kanonik (percakapan dibuang, dipakai /clear_all)
+    2. sync portfolio kanonik (chunk baru di-embed, atau dari artifact / embedding cache)
+    3. dengan lock versi aktif: samakan perubahan selama build (dokumen baru/berubah/dihapus), lalu
+       ganti pointer CURRENT
+    Hanya satu build sekaligus lintas worker. Return report.
+    """
+    start = time.perf_counter()
+    with _index_lock(INDEX_VERSIONS_DIR):
+        _gc_index_versions()
+        base_name = f"v{datetime.now().strftime('%Y%m%d-%H%M%S')}-{get_knowledge_base_version() or 'empty'}"
+        version, suffix = base_name, 1
+        while os.path.exists(os.path.join(INDEX_VERSIONS_DIR, version)):
+            suffix += 1
+            version = f"{base_name}-{suffix}"
+        version_dir = os.path.join(INDEX_VERSIONS_DIR, version)
+        _set_index_build_status(state="running", phase="prepare", version=version, progress=None)
+        try:
+            source = get_base_vectorstore() if keep_conversations else None
+            source_dir = get_base_index_dir(max_age=0)
+            if not ensure_index_embedding_backend(version_dir):
+                raise RuntimeError("embedding backend mismatch")
+            target = lazy_import("Chroma")(persist_directory=version_dir, embedding_function=get_embeddings())
+
+            copied = 0
+            if source is not None:
+                _set_index_build_status(phase="copy")
+                copied = _copy_index_documents(
+                    source, target,
+                    progress=lambda done, total: _set_index_build_status(progress={"done": done, "total": total})
+                )
+                retention = os.path.join(source_dir, CONVERSATION_RETENTION_STATE_FILE)
+                if os.path.exists(retention):
+                    shutil.copy(retention, version_dir)
+
+            _set_index_build_status(phase="sync", progress=None)
+            knowledge = sync_knowledge_index(target, force=True)
+
+            _set_index_build_status(phase="swap")
+            with _index_lock(source_dir):
+                # Perubahan di versi lama selama build (ingest, merge duplikat, compaction). Ingest
+                # menulis di bawah lock yang sama, jadi tidak ada tulisan yang lolos setelah diff ini
+                caught_up = removed = 0
+                if source is not None:
+                    caught_up, removed = _catch_up_index_documents(source, target)
+                pointer = _read_index_versions_file(INDEX_POINTER_FILE)
+                retired = pointer.get("retired", {})
+                if pointer.get("version"):
+                    retired[pointer["version"]] = time.time()
+                _write_index_versions_file(INDEX_POINTER_FILE, {
+                    "version": version,
+                    "activated_at": time.time(),
+                    "reason": reason,
+                    "retired": retired,
+                })
+        except BaseException:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            raise
+
+    get_base_index_dir(max_age=0)
+    get_base_vectorstore()
+    _index_version_stats["builds"] += 1
+    # Versi lama dihapus setelah grace period (query yang masih berjalan selesai)
+    timer = threading.Timer(INDEX_VERSION_GRACE + 1, gc_index_versions)
+    timer.daemon = True
+    timer.start()
+
+    report = {
+        "version": version,
+        "reason": reason,
+        "previous": source_dir,
+        "copied": copied,
+        "caught_up": caught_up,
+        "removed": removed,
+        "knowledge": knowledge,
+        "documents": target._collection.count(),
+        "disk_bytes": get_directory_size(version_dir),
+        "duration_seconds": round(time.perf_counter() - start, 3),
+    }
+    print(f">>> Index version {version} active ({report['documents']} documents, {report['duration_seconds']}s)")
+    return report
+
+def _run_index_build(job_id, keep_conversations, reason):
+    try:
+        report = build_index_version(keep_conversations=keep_conversations, reason=reason)
+        _set_index_build_status(state="succeeded", phase="done", progress=None, report=report,
+                                finished_at=time.time())
+    except Exception as e:
+        _index_version_stats["build_failures"] += 1
+        print(f"Error building index version: {e}")
+        _set_index_build_status(state="failed", phase="done", error=str(e), finished_at=time.time())
+
+def start_index_build(keep_conversations=True, reason="manual"):
+    """
+    Jalankan build_index_version di background thread. Return (status, started);
+    started False jika build lain masih berjalan di proses ini.
+    """
+    global _index_build_thread
+    with _index_build_lock:
+        if _index_build_thread is not None and _index_build_thread.is_alive():
+            return get_index_build_status(), False
+        _index_build_status.clear()
+        _set_index_build_status(
+            state="queued", job_id=f"{os.getpid()}-{int(time.time() * 1000)}", pid=os.getpid(),
+            reason=reason, keep_conversations=keep_conversations, started_at=time.time()
+        )
+        _index_build_thread = threading.Thread(
+            target=_run_index_build, name="index-build",
+            args=(_index_build_status["job_id"], keep_conversations, reason), daemon=True
+        )
+        _index_build_thread.start()
+        return dict(_index_build_status), True
+
+def get_index_build_status():
+    """Status build terakhir (dari file, supaya worker mana pun bisa menjawab)"""
+    return _read_index_versions_file(INDEX_BUILD_STATUS_FILE) or {"state": "idle"}
+
+def _gc_index_versions(now=None):
+    """Hapus versi yang sudah lewat grace period dan sisa build gagal (lock build harus dipegang)"""
+    if not os.path.isdir(INDEX_VERSIONS_DIR):
+        return []
+    now = time.time() if now is None else now
+    pointer = _read_index_versions_file(INDEX_POINTER_FILE)
+    retired = pointer.get("retired", {})
+    removed = []
+    for name in sorted(os.listdir(INDEX_VERSIONS_DIR)):
+        path = os.path.join(INDEX_VERSIONS_DIR, name)
+        if not os.path.isdir(path) or name == pointer.get("version"):
+            continue
+        retired_at = retired.get(name)
+        if retired_at is not None and now - retired_at < INDEX_VERSION_GRACE:
+            continue
+        _release_chroma_client(path)
+        shutil.rmtree(path, ignore_errors=True)
+        retired.pop(name, None)
+        removed.append(name)
+    if removed:
+        _index_version_stats["versions_removed"] += len(removed)
+        if pointer:
+            _write_index_versions_file(INDEX_POINTER_FILE, {**pointer, "retired": retired})
+        print(f">>> Removed old index versions: {', '.join(removed)}")
+    return removed
+
+def gc_index_versions():
+    """Garbage collection versi index lama (menunggu build yang sedang berjalan)"""
+    try:
+        with _index_lock(INDEX_VERSIONS_DIR):
+            return _gc_index_versions()
+    except Exception as e:
+        print(f"Error removing old index versions: {e}")
+        return []
+
+def get_index_versions():
+    """Daftar versi di disk: active / retired (menunggu GC) / building"""
+    pointer = _read_index_versions_file(INDEX_POINTER_FILE)
+    build = get_index_build_status()
+    versions = []
+    if os.path.isdir(INDEX_VERSIONS_DIR):
+        for name in sorted(os.listdir(INDEX_VERSIONS_DIR)):
+            path = os.path.join(INDEX_VERSIONS_DIR, name)
+            if not os.path.isdir(path):
+                continue
+            retired_at = pointer.get("retired", {}).get(name)
+            if name == pointer.get("version"):
+                state = "active"
+            elif retired_at is not None:
+                state = "retired"
+            elif build.get("state") == "running" and build.get("version") == name:
+                state = "building"
+            else:
+                state = "orphan"
+            versions.append({
+                "version": name,
+                "state": state,
+                "retired_at": retired_at,
+                "gc_after": retired_at + INDEX_VERSION_GRACE if retired_at is not None else None,
+                "disk_bytes": get_directory_size(path),
+            })
+    return versions
+
+def get_index_versions_stats():
+    """Versi aktif, state build terakhir, dan jumlah swap/build di proses ini"""
+    pointer = _read_index_versions_file(INDEX_POINTER_FILE)
+    return {
+        **_index_version_stats,
+        "active_version": pointer.get("version"),
+        "active_dir": _base_index_dir or get_base_index_dir(),
+        "build_state": get_index_build_status().get("state"),
+        "retired_versions": len(pointer.get("retired", {})),
+        "grace_seconds": INDEX_VERSION_GRACE,
+    }
+
+# ================= PREBUILT INDEX ARTIFACT =================
+
+# Artifact index dibangun saat build/deploy (flask --app index.py build-index): chunk portfolio kanonik
+# + embedding-nya untuk satu versi knowledge base, chunk size, dan backend embedding. Saat startup,
+# chunk yang belum ada di index diisi dari artifact yang cocok tanpa embedding call.
+INDEX_ARTIFACT_DIR = os.getenv('INDEX_ARTIFACT_DIR', 'index_artifacts')
+INDEX_ARTIFACT_FORMAT = 1
+INDEX_ARTIFACT_KEEP = int(os.getenv('INDEX_ARTIFACT_KEEP', '3'))  # Versi yang disimpan build-index
+
+_index_artifact = None  # {"name", "manifest", "embeddings", "rows"}
+_index_artifact_lock = threading.Lock()
+_index_artifact_stats = {"loads": 0, "seeded_chunks": 0}
+
+def index_artifact_name(kb_version, chunk_size, backend_id):
+    """Nama direktori artifact, misalnya kb-<versi>-c1000-openai-text-embedding-ada-002"""
+    return f"kb-{kb_version}-c{chunk_size}-{re.sub(r'[^A-Za-z0-9]+', '-', backend_id).strip('-')}"
+
+def prune_index_artifacts(artifact_dir=INDEX_ARTIFACT_DIR, keep=INDEX_ARTIFACT_KEEP):
+    """Hapus artifact lama, sisakan `keep` artifact terbaru. Return list nama yang dihapus"""
+    names = [name for name in os.listdir(artifact_dir)
+             if name.startswith("kb-") and not name.endswith(".tmp") and os.path.isdir(os.path.join(artifact_dir, name))]
+    names.sort(key=lambda name: os.path.getmtime(os.path.join(artifact_dir, name)), reverse=True)
+    for name in names[keep:]:
+        shutil.rmtree(os.path.join(artifact_dir, name), ignore_errors=True)
+    return names[keep:]
+
+def build_index_artifact(artifact_dir=INDEX_ARTIFACT_DIR, keep=INDEX_ARTIFACT_KEEP):
+    """
+    Embed semua chunk portfolio kanonik lalu tulis artifact versioned (manifest.json + embeddings.npy)
+    ke artifact_dir. Ditulis ke direktori sementara lalu di-rename, artifact lama di-prune.
+    """
+    version = get_knowledge_base_version()
+    if version is None:
+        raise FileNotFoundError(f"Portfolio file not found: {BASE_PORTFOLIO_FILE}")
+    chunks = build_knowledge_chunks(load_knowledge_base())
+    if not chunks:
+        raise ValueError(f"Portfolio kosong: {BASE_PORTFOLIO_FILE}")
+
+    start = time.perf_counter()
+    embeddings = get_embeddings()
+    backend_id = get_embedding_backend_id(embeddings)
+    ids = list(chunks)
+    vectors = np.asarray(embeddings.embed_documents([chunks[chunk_id][0] for chunk_id in ids]), dtype=np.float32)
+    manifest = {
+        "format": INDEX_ARTIFACT_FORMAT,
+        "kb_version": version,
+        "chunk_size": KNOWLEDGE_CHUNK_SIZE,
+        "embedding_backend": backend_id,
+        "dimensions": int(vectors.shape[1]),
+        "count": len(ids),
+        "built_at": datetime.now().isoformat(),
+        "ids": ids,
+        "documents": [chunks[chunk_id][0] for chunk_id in ids],
+        "metadatas": [chunks[chunk_id][1] for chunk_id in ids],
+    }
+
+    name = index_artifact_name(version, KNOWLEDGE_CHUNK_SIZE, backend_id)
+    target = os.path.join(artifact_dir, name)
+    tmp_dir = f"{target}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, "embeddings.npy"), vectors)
+    with open(os.path.join(tmp_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp_dir, target)
+
+    return {
+        "artifact": name,
+        "path": target,
+        "kb_version": version,
+        "embedding_backend": backend_id,
+        "chunks": len(ids),
+        "dimensions": manifest["dimensions"],
+        "size_bytes": get_directory_size(target),
+        "duration_seconds": round(time.perf_counter() - start, 3),
+        "pruned": prune_index_artifacts(artifact_dir, keep),
+    }
+
+def load_index_artifact():
+    """
+    Artifact untuk versi knowledge base + chunk size saat ini dengan backend EMBEDDING_BACKEND, di-cache
+    per proses. embeddings.npy di-mmap read-only, jadi dengan gunicorn --preload dipakai bersama worker.
+    Return None jika tidak ada artifact yang cocok.
+    """
+    global _index_artifact
+    version = get_knowledge_base_version()
+    prefix = f"kb-{version}-c{KNOWLEDGE_CHUNK_SIZE}-"
+    artifact = _index_artifact
+    if artifact is not None and artifact["name"].startswith(prefix):
+        return artifact
+    if version is None or not os.path.isdir(INDEX_ARTIFACT_DIR):
+        return None
+
+    with _index_artifact_lock:
+        for name in sorted(os.listdir(INDEX_ARTIFACT_DIR)):
+            if not name.startswith(prefix) or name.endswith(".tmp"):
+                continue
+            path = os.path.join(INDEX_ARTIFACT_DIR, name)
+            try:
+                with open(os.path.join(path, "manifest.json"), 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if (manifest.get("format") != INDEX_ARTIFACT_FORMAT
+                        or not manifest.get("embedding_backend", "").startswith(f"{EMBEDDING_BACKEND}:")):
+                    continue
+                vectors = np.load(os.path.join(path, "embeddings.npy"), mmap_mode='r')
+            except (OSError, ValueError) as e:
+                print(f"Error loading index artifact {name}: {e}")
+                continue
+            if vectors.shape[0] != len(manifest.get("ids", [])):
+                print(f"WARNING: index artifact {name} rusak (jumlah embedding tidak cocok), dilewati")
+                continue
+            _index_artifact = {
+                "name": name,
+                "manifest": manifest,
+                "embeddings": vectors,
+                "rows": {doc_id: row for row, doc_id in enumerate(manifest["ids"])},
+            }
+            _index_artifact_stats["loads"] += 1
+            print(f">>> Index artifact loaded: {name} ({vectors.shape[0]} chunks)")
+            return _index_artifact
+    return None
+
+def artifact_embeddings(ids, backend_id):
+    """Embedding dari artifact untuk `ids` (hanya jika backend artifact sama persis). Return dict id -> vector"""
+    artifact = load_index_artifact()
+    if artifact is None or artifact["manifest"]["embedding_backend"] != backend_id:
+        return {}
+    rows = artifact["rows"]
+    return {doc_id: artifact["embeddings"][rows[doc_id]].tolist() for doc_id in ids if doc_id in rows}
+
+def get_index_artifact_stats():
+    artifact = _index_artifact
+    return {
+        **_index_artifact_stats,
+        "artifact": artifact["name"] if artifact else None,
+        "built_at": artifact["manifest"].get("built_at") if artifact else None,
+    }
+
+# ================= NUMPY VECTOR ENGINE =================
+
+# Untuk corpus kecil (knowledge base + percakapan), pencarian exact dengan satu matmul numpy lebih cepat
+# daripada HNSW + fetch dokumen dari SQLite. Chroma tetap jadi store persisten (sync, ingestion,
+# retention); engine numpy adalah replika read-only yang di-refresh seperti index BM25. Embedding
+# base index ditulis sekali ke snapshot .npy di persist dir dan di-mmap oleh semua worker.
+# Overlay user (dokumen privat) di mode numpy hanya ada di memori, tanpa Chroma di disk.
+VECTOR_ENGINE = os.getenv('VECTOR_ENGINE', 'auto')  # auto | numpy | chroma
+# auto: di atas batas ini HNSW Chroma lebih cepat dari scan exact (benchmark retrieval, dimensi 1536)
+NUMPY_ENGINE_MAX_DOCS = int(os.getenv('NUMPY_ENGINE_MAX_DOCS', '3000'))
+NUMPY_ENGINE_MMAP = os.getenv('NUMPY_ENGINE_MMAP', '1').lower() in ('1', 'true', 'yes')
+VECTOR_SNAPSHOT_FILE = "vector_snapshot.json"  # Di dalam persist dir, menunjuk ke vector_snapshot-<hash>.npy
+
+# Replika (engine numpy, BM25) yang disimpan per proses: base index + overlay user yang terakhir dipakai
+INDEX_REPLICA_MAX_ENTRIES = int(os.getenv('INDEX_REPLICA_MAX_ENTRIES', '64'))
+
+_vector_engines = OrderedDict()  # key vectorstore -> {"engine", "signature", "checked_at"}
+_vector_engines_lock = threading.Lock()
+_vector_engine_stats = {"searches": 0, "queries": 0, "snapshot_exports": 0, "snapshot_loads": 0}
+
+class NumpyVectorStore:
+    """
+    Vector store in-memory: embedding ter-normalisasi dalam satu matrix float32 (n x d, boleh memmap).
+    Top-k exact untuk banyak query sekaligus dengan satu matmul. Jarak sama dengan Chroma (squared L2
+    antar vector unit = 2 - 2 cosine), jadi hasilnya bisa digabung dengan hasil Chroma.
+    """
+
+    def __init__(self, ids, documents, metadatas, matrix, name="memory"):
+        self.ids = list(ids)
+        self.documents = [
+            Document(page_content=text, metadata=metadata or {}, id=doc_id)
+            for doc_id, text, metadata in zip(self.ids, documents, metadatas)
+        ]
+        self.matrix = matrix
+        self.name = name
+
+    @classmethod
+    def from_texts(cls, texts, embeddings, metadatas, ids, name="memory"):
+        vectors = np.asarray(embeddings.embed_documents(list(texts)), dtype=np.float32) if texts else None
+        matrix = _unit_rows(vectors) if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        return cls(ids, texts, metadatas, matrix, name)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return int(self.matrix.nbytes)
+
+    def search(self, query_vectors, k=RETRIEVER_K):
+        """Top-k untuk setiap baris query_vectors (m x d). Return list per query [(Document, distance)]"""
+        queries = _unit_rows(np.atleast_2d(np.asarray(query_vectors, dtype=np.float32)))
+        _vector_engine_stats["searches"] += 1
+        _vector_engine_stats["queries"] += len(queries)
+        if not self.ids:
+            return [[] for _ in queries]
+
+        # (n x d) @ (d x m): matrix dibaca berurutan sekali untuk semua query
+        similarities = (self.matrix @ queries.T).T
+        k = min(k, len(self.ids))
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for row, candidates in enumerate(top):
+            ranked = candidates[np.argsort(-similarities[row, candidates])]
+            results.append([(self.documents[i], float(2.0 - 2.0 * similarities[row, i])) for i in ranked])
+        return results
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=RETRIEVER_K):
+        return self.search([embedding], k)[0]
+
+    def get(self, include=None):
+        return {
+            "ids": list(self.ids),
+            "documents": [doc.page_content for doc in self.documents],
+            "metadatas": [doc.metadata for doc in self.documents],
+        }
+
+    def extended(self, ids, documents, metadatas, vectors):
+        """
+        Store baru dengan dokumen tambahan. Matrix di-copy (tidak lagi mmap), store lama tetap utuh
+        untuk query yang sedang berjalan.
+        """
+        added = NumpyVectorStore(ids, documents, metadatas, _unit_rows(np.asarray(vectors, dtype=np.float32)),
+                                 self.name)
+        matrix = np.vstack([self.matrix, added.matrix]) if self.ids else added.matrix
+        store = NumpyVectorStore([], [], [], matrix, self.name)
+        store.ids = self.ids + added.ids
+        store.documents = self.documents + added.documents
+        return store
+
+def _remember_replica(replicas, key, entry):
+    """Simpan replika index; yang paling lama tidak dicek ulang dibuang jika melebihi batas"""
+    replicas[key] = entry
+    replicas.move_to_end(key)
+    while len(replicas) > INDEX_REPLICA_MAX_ENTRIES:
+        replicas.popitem(last=False)
+
+def _touch_replica(replicas, key):
+    try:
+        replicas.move_to_end(key)
+    except KeyError:
+        pass  # Baru saja di-invalidate
+
+def use_numpy_engine(document_count):
+    """Engine yang dipakai untuk vectorstore dengan `document_count` dokumen"""
+    if VECTOR_ENGINE == "numpy":
+        return True
+    return VECTOR_ENGINE == "auto" and document_count <= NUMPY_ENGINE_MAX_DOCS
+
+def _read_vector_snapshot(persist_dir, signature):
+    """Snapshot di persist_dir jika dibuat dari isi index yang sama (signature). Return NumpyVectorStore / None"""
+    try:
+        with open(os.path.join(persist_dir, VECTOR_SNAPSHOT_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get("signature") != list(signature):
+            return None
+        matrix = np.load(os.path.join(persist_dir, manifest["file"]), mmap_mode='r' if NUMPY_ENGINE_MMAP else None)
+    except (OSError, ValueError, KeyError):
+        return None
+    _vector_engine_stats["snapshot_loads"] += 1
+    return NumpyVectorStore(manifest["ids"], manifest["documents"], manifest["metadatas"], matrix, name=persist_dir)
+
+def _export_vectorstore(store):
+    """Semua dokumen vectorstore + matrix embedding ter-normalisasi (satu get dari Chroma)"""
+    data = store.get(include=["embeddings", "documents", "metadatas"])
+    if data["ids"]:
+        matrix = _unit_rows(np.asarray(data["embeddings"], dtype=np.float32))
+    else:
+        matrix = np.zeros((0, 0), dtype=np.float32)
+    return data, matrix
+
+def _write_vector_snapshot(store, signature):
+    """Export embedding + dokumen vectorstore ke vector_snapshot-<hash>.npy + manifest (rename atomic)"""
+    persist_dir = _vectorstore_persist_dir(store)
+    data, matrix = _export_vectorstore(store)
+    file_name = f"vector_snapshot-{hashlib.sha256(json.dumps(list(signature)).encode('utf-8')).hexdigest()[:16]}.npy"
+    tmp_file = os.path.join(persist_dir, f"{file_name}.{os.getpid()}.tmp")
+    with open(tmp_file, 'wb') as f:
+        np.save(f, matrix)
+    os.replace(tmp_file, os.path.join(persist_dir, file_name))
+    manifest_file = os.path.join(persist_dir, VECTOR_SNAPSHOT_FILE)
+    tmp_file = f"{manifest_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({
+            "signature": list(signature),
+            "file": file_name,
+            "ids": data["ids"],
+            "documents": data["documents"],
+            "metadatas": [metadata or {} for metadata in data["metadatas"]],
+        }, f, ensure_ascii=False)
+    os.replace(tmp_file, manifest_file)
+    # Snapshot lama: proses yang masih me-mmap-nya tetap bisa membaca sampai refresh berikutnya
+    for name in os.listdir(persist_dir):
+        if name.startswith("vector_snapshot-") and name.endswith(".npy") and name != file_name:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(persist_dir, name))
+    _vector_engine_stats["snapshot_exports"] += 1
+
+def load_vector_engine(store, signature):
+    """NumpyVectorStore untuk isi vectorstore saat ini: dari snapshot bersama, atau export dulu jika basi"""
+    persist_dir = _vectorstore_persist_dir(store)
+    if not persist_dir or not NUMPY_ENGINE_MMAP:
+        data, matrix = _export_vectorstore(store)
+        return NumpyVectorStore(data["ids"], data["documents"], data["metadatas"], matrix, name=persist_dir or "memory")
+
+    engine = _read_vector_snapshot(persist_dir, signature)
+    if engine is None:
+        # Satu worker yang export, worker lain menunggu lalu memakai snapshot yang sama
+        with _index_lock(persist_dir):
+            engine = _read_vector_snapshot(persist_dir, signature)
+            if engine is None:
+                _write_vector_snapshot(store, signature)
+                engine = _read_vector_snapshot(persist_dir, signature)
+    return engine
+
+def get_vector_engine(store):
+    """
+    Store untuk vector search: NumpyVectorStore (replika store Chroma, di-refresh jika isi index berubah)
+    atau store itu sendiri jika engine Chroma. Overlay in-memory dikembalikan apa adanya.
+    """
+    if isinstance(store, NumpyVectorStore) or VECTOR_ENGINE == "chroma":
+        return store
+    key = _vectorstore_key(store)
+    now = time.time()
+    entry = _vector_engines.get(key)
+    if entry is not None and now - entry["checked_at"] < LEXICAL_INDEX_REFRESH:
+        return entry["engine"] or store
+
+    with _vector_engines_lock:
+        entry = _vector_engines.get(key)
+        signature = _vectorstore_signature(store)
+        if entry is not None and entry["signature"] == signature:
+            entry["checked_at"] = now
+            _touch_replica(_vector_engines, key)
+            return entry["engine"] or store
+        engine = load_vector_engine(store, signature) if use_numpy_engine(signature[0]) else None
+        _remember_replica(_vector_engines, key, {"engine": engine, "signature": signature, "checked_at": now})
+        return engine or store
+
+def get_vector_engine_stats():
+    engines = [entry["engine"] for entry in list(_vector_engines.values()) if entry["engine"] is not None]
+    return {
+        **_vector_engine_stats,
+        "engine": VECTOR_ENGINE,
+        "numpy_indexes": len(engines),
+        "numpy_documents": sum(len(engine) for engine in engines),
+        "numpy_bytes": sum(engine.nbytes for engine in engines),
+        "mmap": NUMPY_ENGINE_MMAP,
+    }
+
+# ================= LEXICAL INDEX (BM25) + HYBRID RETRIEVAL =================
+
+# Inverted index BM25 in-memory dibangun dari dokumen yang sama dengan Chroma.
+# Mode "hybrid": hasil lexical + vector digabung dengan reciprocal rank fusion, dan query keyword
+# pendek yang jelas cocok ("email", "github") dijawab lexical saja tanpa embedding call.
+RETRIEVAL_MODE = os.getenv('RETRIEVAL_MODE', 'hybrid')  # hybrid | vector | lexical
+LEXICAL_FAST_PATH = os.getenv('LEXICAL_FAST_PATH', '1').lower() in ('1', 'true', 'yes')
+LEXICAL_FAST_PATH_MAX_TERMS = 3     # Query dengan <= N kata kunci yang boleh lewat fast path
+LEXICAL_COMMON_TERM_RATIO = 0.5     # Term yang muncul di > 50% dokumen tidak dianggap kata kunci
+LEXICAL_INDEX_REFRESH = 5.0         # Detik antar cek jumlah dokumen (tulisan dari worker lain)
+RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+LEXICAL_STOPWORDS = {
+    # Indonesia
+    "yang", "dan", "di", "ke", "dari", "apa", "saja", "siapa", "bagaimana", "adalah", "itu", "ini",
+    "untuk", "dengan", "ada", "tentang", "berapa", "apakah", "bisa", "pernah", "yg", "dia", "nya",
+    "juga", "atau", "pada", "dalam", "mana", "sudah", "punya", "boleh", "tolong", "lihat", "ceritakan",
+    # English
+    "the", "a", "an", "of", "to", "in", "is", "are", "what", "how", "and", "or", "for", "on", "with",
+    "me", "tell", "about", "do", "does", "his", "he", "has", "have", "which", "who",
+}
+
+_lexical_indexes = OrderedDict()  # key vectorstore -> {"index", "signature", "checked_at"}
+_lexical_indexes_lock = threading.Lock()
+_retrieval_stats = {"lexical_fast_path": 0, "hybrid": 0, "vector": 0, "lexical": 0, "embedding_fallbacks": 0}
+
+def tokenize_text(text):
+    """Lowercase word tokens tanpa stopword"""
+    return [token for token in re.findall(r"\w+", text.lower()) if token not in LEXICAL_STOPWORDS]
+
+class BM25Index:
+    """Inverted index BM25 sederhana di atas list Document"""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.postings = {}  # term -> [(doc_index, term_frequency)]
+        self.doc_lengths = []
+        for i, doc in enumerate(documents):
+            tokens = tokenize_text(doc.page_content)
+            self.doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, tf in counts.items():
+                self.postings.setdefault(token, []).append((i, tf))
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    def add_documents(self, documents):
+        """
+        Tambahkan dokumen ke index yang sedang dipakai. Dokumen dan panjangnya ditambahkan sebelum
+        postings, jadi search yang berjalan bersamaan tidak pernah melihat doc_index yang belum ada.
+        """
+        for doc in documents:
+            tokens = tokenize_text(doc.page_content)
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            doc_index = len(self.documents)
+            self.documents.append(doc)
+            self.doc_lengths.append(len(tokens))
+            for token, tf in counts.items():
+                self.postings.setdefault(token, []).append((doc_index, tf))
+        self.avg_length = (sum(self.doc_lengths) / len(self.doc_lengths)) if self.doc_lengths else 0.0
+
+    def idf(self, term):
+        df = len(self.postings.get(term, ()))
+        return np.log(1 + (len(self.documents) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k):
+        """Return (list [(Document, score)] terurut, term kata kunci query)"""
+        terms = list(dict.fromkeys(tokenize_text(query)))
+        scores = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for doc_index, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[doc_index] / (self.avg_length or 1))
+                scores[doc_index] = scores.get(doc_index, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[i], score) for i, score in ranked], terms
+
+    def is_keyword_term(self, term):
+        df = len(self.postings.get(term, ()))
+        return 0 < df <= max(1, len(self.documents) * LEXICAL_COMMON_TERM_RATIO)
+
+def _vectorstore_persist_dir(store):
+    """Persist directory vectorstore Chroma (None jika in-memory)"""
+    settings = store._client.get_settings()
+    return settings.persist_directory if settings.is_persistent else None
+
+def _vectorstore_key(store):
+    if isinstance(store, NumpyVectorStore):
+        return (store.name,)
+    return (_vectorstore_persist_dir(store) or id(store), store._collection.name)
+
+def _vectorstore_signature(store):
+    """
+    Penanda isi index: jumlah dokumen + content version (dinaikkan setiap tulis, juga oleh worker lain).
+    Jumlah saja tidak cukup: teks diganti, atau hapus + tambah dengan jumlah sama, tidak mengubahnya.
+    """
+    if isinstance(store, NumpyVectorStore):
+        return (len(store), id(store))  # Overlay in-memory dibuat ulang setiap dokumen privat berubah
+    persist_dir = _vectorstore_persist_dir(store)
+    return (store._collection.count(), _read_content_version(persist_dir) if persist_dir else None)
+
+def get_lexical_index(store):
+    """BM25 index untuk satu vectorstore, dibangun ulang jika isi index berubah"""
+    key = _vectorstore_key(store)
+    now = time.time()
+    entry = _lexical_indexes.get(key)
+    if entry is not None and now - entry["checked_at"] < LEXICAL_INDEX_REFRESH:
+        return entry["index"]
+
+    with _lexical_indexes_lock:
+        entry = _lexical_indexes.get(key)
+        signature = _vectorstore_signature(store)
+        if entry is not None and entry["signature"] == signature:
+            entry["checked_at"] = now
+            _lexical_indexes.move_to_end(key)
+            return entry["index"]
+        data = store.get(include=["documents", "metadatas"])
+        documents = [
+            Document(page_content=text, metadata=metadata or {}, id=doc_id)
+            for doc_id, text, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+        index = BM25Index(documents)
+        _remember_replica(_lexical_indexes, key, {"index": index, "signature": signature, "checked_at": now})
+        return index
+
+def invalidate_index_replicas(store=None):
+    """
+    Paksa BM25 index dan engine numpy dibangun ulang setelah tulis ke vectorstore di proses ini:
+    hanya replika `store`, atau semua replika jika None (index di-reset / di-swap).
+    """
+    key = _vectorstore_key(store) if store is not None else None
+    with _lexical_indexes_lock:
+        if key is None:
+            _lexical_indexes.clear()
+        else:
+            _lexical_indexes.pop(key, None)
+    # Tanpa lock: pemanggil bisa sedang memegang _index_lock yang ditunggu load_vector_engine
+    if key is None:
+        _vector_engines.clear()
+    else:
+        _vector_engines.pop(key, None)
+
+def extend_index_replicas(store, signature_before, ids, texts, metadatas, vectors):
+    """
+    Tambahkan dokumen yang baru ditulis proses ini (ingest percakapan) ke replika `store` yang sudah
+    ada, tanpa membaca ulang seluruh store. Pemanggil sudah menaikkan content version sekali untuk
+    tulis ini. Replika yang tidak sinkron dengan isi store sebelum tulis, atau jika worker lain ikut
+    menulis (jumlah dokumen / content version tidak cocok), dibuang dan dibangun ulang.
+    """
+    key = _vectorstore_key(store)
+    signature = _vectorstore_signature(store)
+    version = signature_before[1] + 1 if signature_before[1] is not None else None
+    if signature != (signature_before[0] + len(ids), version):
+        invalidate_index_replicas(store)
+        return
+    documents = [Document(page_content=text, metadata=metadata, id=doc_id)
+                 for doc_id, text, metadata in zip(ids, texts, metadatas)]
+    with _lexical_indexes_lock:
+        entry = _lexical_indexes.get(key)
+        if entry is not None:
+            if entry["signature"] == signature_before:
+                entry["index"].add_documents(documents)
+                entry["signature"] = signature
+            else:
+                _lexical_indexes.pop(key, None)
+    entry = _vector_engines.get(key)
+    if entry is not None:
+        if entry["signature"] != signature_before or (entry["engine"] is None) == use_numpy_engine(signature[0]):
+            _vector_engines.pop(key, None)
+        else:
+            if entry["engine"] is not None:
+                entry["engine"] = entry["engine"].extended(ids, texts, metadatas, vectors)
+            entry["signature"] = signature
+
+class HybridRetriever(MergedRetriever):
+    """
+    Retriever BM25 + vector (reciprocal rank fusion) di atas base index + overlay user.
+    Query keyword pendek yang semua kata kuncinya ada di dokumen teratas dijawab lexical saja.
+    Jika embedding gagal (misalnya offline), hasil lexical tetap dikembalikan.
+    """
+
+    mode: str = RETRIEVAL_MODE
+
+    def _lexical_search(self, query):
+        indexes = [get_lexical_index(store) for store in self.vectorstores]
+        scored, terms = [], []
+        keyword_terms = set()
+        for index in indexes:
+            results, terms = index.search(query, self.k)
+            scored.extend(results)
+            keyword_terms.update(term for term in terms if index.is_keyword_term(term))
+        scored.sort(key=lambda item: item[1], reverse=True)
+
+        docs, seen = [], set()
+        for doc, _score in scored:
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                docs.append(doc)
+
+        # Confident: query pendek, semua term dikenal, dan semua kata kunci ada di dokumen teratas
+        unknown = [term for term in terms if not any(term in index.postings for index in indexes)]
+        top_tokens = set(tokenize_text(docs[0].page_content)) if docs else set()
+        confident = (
+            bool(docs) and 0 < len(terms) <= LEXICAL_FAST_PATH_MAX_TERMS and not unknown
+            and bool(keyword_terms) and keyword_terms <= top_tokens
+        )
+        return docs[:self.k], confident
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        docs = self._hybrid_search(query)
+        record_conversation_hits(docs)
+        return docs
+
+    def _hybrid_search(self, query):
+        if self.mode == "vector":
+            _retrieval_stats["vector"] += 1
+            return self._vector_search(query)
+
+        lexical_docs, confident = self._lexical_search(query)
+        if self.mode == "lexical":
+            _retrieval_stats["lexical"] += 1
+            return lexical_docs
+        if confident and LEXICAL_FAST_PATH:
+            _retrieval_stats["lexical_fast_path"] += 1
+            return lexical_docs
+
+        try:
+            vector_docs = self._vector_search(query)
+        except Exception as e:
+            print(f"Error in vector retrieval, using lexical results: {e}")
+            _retrieval_stats["embedding_fallbacks"] += 1
+            return lexical_docs
+
+        # Reciprocal rank fusion
+        _retrieval_stats["hybrid"] += 1
+        fused, docs_by_text = {}, {}
+        for ranking in (vector_docs, lexical_docs):
+            for rank, doc in enumerate(ranking):
+                fused[doc.page_content] = fused.get(doc.page_content, 0.0) + 1.0 / (RRF_K + rank + 1)
+                docs_by_text.setdefault(doc.page_content, doc)
+        ranked = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        return [docs_by_text[text] for text in ranked]
+
+def get_retrieval_stats():
+    """Statistik jalur retrieval: berapa query dijawab lexical saja (tanpa embedding call)"""
+    total = sum(_retrieval_stats.values()) - _retrieval_stats["embedding_fallbacks"]
+    return {
+        **_retrieval_stats,
+        "mode": RETRIEVAL_MODE,
+        "fast_path_rate": round(_retrieval_stats["lexical_fast_path"] / total, 4) if total else 0.0,
+        "lexical_indexes": len(_lexical_indexes),
+    }
+
+# ================= CONVERSATION KNOWLEDGE RETENTION =================
+
+# Percakapan yang ditulis ke shared index di-dedup saat ingestion (hash pertanyaan ter-normalisasi
+# + cosine similarity embedding) dan dibatasi oleh retention policy: umur maksimal dan jumlah
+# maksimal dokumen (yang dibuang lebih dulu: paling lama tidak muncul di hasil retrieval).
+# Job compaction menerapkan policy, me-merge duplikat lama, dan bisa membangun ulang index.
+CONVERSATION_DEDUP_THRESHOLD = float(os.getenv('CONVERSATION_DEDUP_THRESHOLD', '0.95'))  # cosine similarity
+CONVERSATION_MAX_ENTRIES = int(os.getenv('CONVERSATION_MAX_ENTRIES', '2000'))
+CONVERSATION_MAX_AGE_DAYS = float(os.getenv('CONVERSATION_MAX_AGE_DAYS', '90'))  # 0 = tanpa batas umur
+CONVERSATION_COMPACT_INTERVAL = float(os.getenv('CONVERSATION_COMPACT_INTERVAL', '3600'))  # detik, 0 = mati
+CONVERSATION_HIT_FLUSH_INTERVAL = 30.0  # Detik antar batch write hit retrieval ke metadata Chroma
+CONVERSATION_RETENTION_STATE_FILE = ".conversation_retention.json"  # Di dalam persist dir
+CONVERSATION_TEXT_PATTERN = re.compile(r"^User bertanya: (.*?)\. Jawabannya: ", re.DOTALL)
+
+_conversation_lock = threading.Lock()
+_pending_conversation_hits = {}  # doc_id -> [hits, last_hit]
+_conversation_maintenance = {"last_flush": time.time(), "added_since_compaction": 0}
+_conversation_stats = {
+    "added": 0,
+    "merged": 0,           # Percakapan yang di-merge ke dokumen lain (tidak ditulis ulang)
+    "hits_recorded": 0,
+    "compactions": 0,
+    "last_compaction": None,
+}
+
+def normalize_question(text):
+    """Lowercase, tanpa tanda baca, spasi dirapikan ("Apa skill Adam??" == "apa  skill adam")"""
+    return " ".join(re.findall(r"\w+", text.lower()))
+
+def conversation_doc_id(question):
+    """Id dokumen percakapan = hash pertanyaan ter-normalisasi (pertanyaan sama -> id sama)"""
+    return "chat-" + hashlib.sha256(normalize_question(question).encode('utf-8')).hexdigest()[:32]
+
+def _unit_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1.0)
+
+def find_similar_conversations(collection, ids, vectors):
+    """
+    Untuk setiap vector baru, cari percakapan yang hampir identik (cosine >= threshold):
+    tetangga terdekat di index, atau vector sebelumnya di batch yang sama.
+    Return list id target per baris (None jika tidak ada duplikat).
+    """
+    units = _unit_rows(vectors)
+    neighbors = collection.query(query_embeddings=vectors.tolist(), n_results=1,
+                                 where={"type": "conversation"}, include=["embeddings"])
+    targets, kept_rows = [], []
+    for row in range(len(ids)):
+        target = None
+        if neighbors["ids"][row]:
+            neighbor = _unit_rows(neighbors["embeddings"][row][0])
+            if float(units[row] @ neighbor) >= CONVERSATION_DEDUP_THRESHOLD:
+                target = neighbors["ids"][row][0]
+        if target is None and kept_rows:
+            similarities = units[kept_rows] @ units[row]
+            best = int(np.argmax(similarities))
+            if similarities[best] >= CONVERSATION_DEDUP_THRESHOLD:
+                target = ids[kept_rows[best]]
+        if target is None:
+            kept_rows.append(row)
+        targets.append(target)
+    return targets
+
+def merge_conversation_duplicates(collection, merges, now, documents=None):
+    """
+    Naikkan dup_count + last_seen dokumen yang sudah ada, tanpa embedding ulang.
+    `documents` (doc_id -> teks): duplikat exact diganti dengan jawaban terbaru supaya jawaban dari
+    sebelum portfolio di-edit tidak ikut diperpanjang. Teks yang diganti di-embed ulang (satu call
+    per batch) supaya vector tetap cocok dengan teksnya. Return True jika ada teks dokumen yang berubah.
+    """
+    documents = documents or {}
+    data = collection.get(ids=list(merges), include=["metadatas", "documents"] if documents else ["metadatas"])
+    metadatas, replaced = [], []
+    for row, (doc_id, metadata) in enumerate(zip(data["ids"], data["metadatas"])):
+        metadata = dict(metadata or {})
+        metadata["dup_count"] = int(metadata.get("dup_count", 1)) + merges[doc_id]
+        metadata["last_seen"] = now
+        if doc_id in documents and documents[doc_id] != data["documents"][row]:
+            metadata["created_at"] = now
+            metadata["timestamp"] = datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+            replaced.append(row)
+        metadatas.append(metadata)
+    if not metadatas:
+        return False
+    collection.update(ids=data["ids"], metadatas=metadatas)
+    if replaced:
+        texts = [documents[data["ids"][row]] for row in replaced]
+        collection.update(ids=[data["ids"][row] for row in replaced], documents=texts,
+                          embeddings=get_embeddings().embed_documents(texts))
+    return bool(replaced)
+
+def record_conversation_ingest(added, merged):
+    with _conversation_lock:
+        _conversation_stats["added"] += added
+        _conversation_stats["merged"] += merged
+        _conversation_maintenance["added_since_compaction"] += added
+
+def record_conversation_hits(docs):
+    """Catat dokumen percakapan yang muncul di hasil retrieval (di-flush ke metadata per batch)"""
+    now = time.time()
+    with _conversation_lock:
+        for doc in docs:
+            if doc.id and (doc.metadata or {}).get("type") == "conversation":
+                entry = _pending_conversation_hits.setdefault(doc.id, [0, now])
+                entry[0] += 1
+                entry[1] = now
+
+def flush_conversation_hits():
+    """Tulis hit retrieval yang tertunda ke metadata Chroma (hits, last_hit). Return jumlah dokumen"""
+    global _pending_conversation_hits
+    with _conversation_lock:
+        pending, _pending_conversation_hits = _pending_conversation_hits, {}
+        _conversation_maintenance["last_flush"] = time.time()
+    if not pending or _base_vectorstore is None:
+        return 0
+    try:
+        # Ingest (dup_count/last_seen) dan compaction menulis metadata yang sama di bawah lock index
+        with _locked_base_vectorstore() as vectorstore:
+            if vectorstore is None:
+                return 0
+            data = vectorstore._collection.get(ids=list(pending), include=["metadatas"])
+            metadatas = []
+            for doc_id, metadata in zip(data["ids"], data["metadatas"]):
+                metadata = dict(metadata or {})
+                hits, last_hit = pending[doc_id]
+                metadata["hits"] = int(metadata.get("hits", 0)) + hits
+                metadata["last_hit"] = max(float(metadata.get("last_hit", 0.0)), last_hit)
+                metadatas.append(metadata)
+            if metadatas:
+                vectorstore._collection.update(ids=data["ids"], metadatas=metadatas)
+        with _conversation_lock:
+            _conversation_stats["hits_recorded"] += sum(hits for hits, _ in pending.values())
+        return len(metadatas)
+    except Exception as e:
+        print(f"Error flushing conversation hits: {e}")
+        return 0
+
+def _conversation_record(doc_id, text, metadata, vector, now):
+    """Normalisasi satu dokumen percakapan (termasuk format lama tanpa metadata retention)"""
+    metadata = dict(metadata or {})
+    if "created_at" not in metadata:
+        try:
+            created_at = datetime.strptime(metadata.get("timestamp", ""), "%Y-%m-%d %H:%M:%S").timestamp()
+        except ValueError:
+            created_at = now
+        metadata.update(created_at=created_at, last_seen=created_at, last_hit=0.0, hits=0, dup_count=1)
+    match = CONVERSATION_TEXT_PATTERN.match(text or "")
+    return {
+        "id": doc_id,
+        "metadata": metadata,
+        "question": normalize_question(match.group(1) if match else text or ""),
+        "last_used": max(float(metadata["last_seen"]), float(metadata.get("last_hit", 0.0))),
+        "unit": _unit_rows(vector),
+    }
+
+def compact_conversation_knowledge(dry_run=False, now=None):
+    """
+    Terapkan retention policy ke dokumen percakapan di shared index:
+    1. hapus yang tidak dipakai (last_seen / last_hit) lebih lama dari CONVERSATION_MAX_AGE_DAYS
+    2. merge duplikat yang masih ada (pertanyaan sama atau embedding hampir identik)
+    3. jika masih > CONVERSATION_MAX_ENTRIES, buang yang paling lama tidak muncul di hasil retrieval
+    Return report.
+    """
+    now = time.time() if now is None else now
+    vectorstore = get_base_vectorstore()
+    if vectorstore is None:
+        return {"skipped": "base vectorstore not available"}
+    flush_conversation_hits()
+    start = time.perf_counter()
+    collection = vectorstore._collection
+
+    with _index_lock(_vectorstore_persist_dir(vectorstore)):
+        data = collection.get(where={"type": "conversation"}, include=["documents", "metadatas", "embeddings"])
+        records = [
+            _conversation_record(doc_id, text, metadata, vector, now)
+            for doc_id, text, metadata, vector in zip(data["ids"], data["documents"], data["metadatas"],
+                                                      data["embeddings"] if len(data["ids"]) else [])
+        ]
+
+        max_age = CONVERSATION_MAX_AGE_DAYS * 86400
+        expired = [r for r in records if max_age > 0 and now - r["last_used"] > max_age]
+        live = [r for r in records if not (max_age > 0 and now - r["last_used"] > max_age)]
+
+        # Survivor = dokumen yang paling sering dipakai; duplikat di-merge ke survivor pertama yang cocok
+        live.sort(key=lambda r: (int(r["metadata"].get("hits", 0)), r["last_used"]), reverse=True)
+        survivors, merged, changed = [], [], set()
+        by_question = {}
+        units = np.zeros((len(live), data["embeddings"].shape[1] if len(live) else 0), dtype=np.float32)
+        for record in live:
+            target = by_question.get(record["question"])
+            if target is None and survivors:
+                similarities = units[:len(survivors)] @ record["unit"]
+                best = int(np.argmax(similarities))
+                if similarities[best] >= CONVERSATION_DEDUP_THRESHOLD:
+                    target = survivors[best]
+            if target is None:
+                units[len(survivors)] = record["unit"]
+                survivors.append(record)
+                by_question.setdefault(record["question"], record)
+                continue
+            meta, other = target["metadata"], record["metadata"]
+            meta["dup_count"] = int(meta.get("dup_count", 1)) + int(other.get("dup_count", 1))
+            meta["hits"] = int(meta.get("hits", 0)) + int(other.get("hits", 0))
+            meta["last_seen"] = max(float(meta["last_seen"]), float(other["last_seen"]))
+            meta["last_hit"] = max(float(meta.get("last_hit", 0.0)), float(other.get("last_hit", 0.0)))
+            target["last_used"] = max(target["last_used"], record["last_used"])
+            merged.append(record)
+            changed.add(target["id"])
+
+        evicted = []
+        if len(survivors) > CONVERSATION_MAX_ENTRIES:
+            # LRU berdasarkan hit retrieval: belum pernah di-retrieve / hit paling lama dibuang lebih dulu
+            survivors.sort(key=lambda r: (float(r["metadata"].get("last_hit", 0.0)),
+                                          int(r["metadata"].get("hits", 0)), r["last_used"]))
+            evicted = survivors[:len(survivors) - CONVERSATION_MAX_ENTRIES]
+            survivors = survivors[len(evicted):]
+
+        # Survivor yang di-merge, dan dokumen format lama (dapat metadata retention), ditulis ulang
+        legacy = {doc_id for doc_id, metadata in zip(data["ids"], data["metadatas"])
+                  if "created_at" not in (metadata or {})}
+        changed = {r["id"] for r in survivors if r["id"] in changed or r["id"] in legacy}
+
+        to_delete = [r["id"] for r in expired + merged + evicted]
+        if not dry_run:
+            for offset in range(0, len(to_delete), 500):
+                collection.delete(ids=to_delete[offset:offset + 500])
+            survivors_by_id = {r["id"]: r for r in survivors}
+            if changed:
+                ids = sorted(changed)
+                collection.update(ids=ids, metadatas=[survivors_by_id[doc_id]["metadata"] for doc_id in ids])
+            if to_delete:
+                bump_index_content_version(vectorstore)
+                invalidate_index_replicas(vectorstore)
+            _write_conversation_retention_state({"compacted_at": now})
+
+    report = {
+        "dry_run": dry_run,
+        "conversations": len(records),
+        "expired": len(expired),
+        "merged": len(merged),
+        "evicted": len(evicted),
+        "remaining": len(survivors),
+        "duration_seconds": round(time.perf_counter() - start, 3),
+    }
+    if not dry_run:
+        with _conversation_lock:
+            _conversation_stats["compactions"] += 1
+            _conversation_stats["last_compaction"] = report
+            _conversation_maintenance["added_since_compaction"] = 0
+    print(f">>> Conversation compaction{' (dry run)' if dry_run else ''}: {report['expired']} expired, "
+          f"{report['merged']} merged, {report['evicted']} evicted, {report['remaining']} remaining")
+    return report
+
+def rebuild_base_index():
+    """
+    Bangun ulang base index dari dokumen yang tersisa (memakai embedding tersimpan, tanpa embedding
+    call) supaya HNSW tidak membawa slot dokumen yang sudah dihapus. Ditulis sebagai versi index
+    baru lalu di-swap, jadi aman dijalankan saat app berjalan.
+    """
+    if get_base_vectorstore() is None:
+        return {"skipped": "base vectorstore not available"}
+    disk_before = get_directory_size(get_base_index_dir(max_age=0))
+    report = build_index_version(keep_conversations=True, reason="compaction")
+    return {"documents": report["documents"], "version": report["version"], "disk_bytes_before": disk_before,
+            "disk_bytes_after": report["disk_bytes"]}
+
+def _read_conversation_retention_state():
+    try:
+        with open(os.path.join(get_base_index_dir(), CONVERSATION_RETENTION_STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_conversation_retention_state(state):
+    state_file = os.path.join(get_base_index_dir(), CONVERSATION_RETENTION_STATE_FILE)
+    tmp_file = f"{state_file}.{os.getpid()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_file, state_file)
+
+def run_conversation_maintenance():
+    """
+    Dipanggil dari ingest worker: flush hit retrieval per CONVERSATION_HIT_FLUSH_INTERVAL, dan
+    compaction jika interval lewat (dicatat di disk, dipakai bersama semua worker) atau jika
+    percakapan baru sejak compaction terakhir > 10% CONVERSATION_MAX_ENTRIES.
+    """
+    now = time.time()
+    if now - _conversation_maintenance["last_flush"] >= CONVERSATION_HIT_FLUSH_INTERVAL:
+        flush_conversation_hits()
+    if CONVERSATION_COMPACT_INTERVAL <= 0 or _base_vectorstore is None:
+        return
+    over_limit = _conversation_maintenance["added_since_compaction"] > CONVERSATION_MAX_ENTRIES * 0.1
+    last = _conversation_maintenance.get("last_compaction_check", 0.0)
+    if not over_limit and now - last < CONVERSATION_COMPACT_INTERVAL:
+        return
+    _conversation_maintenance["last_compaction_check"] = now
+    compacted_at = _read_conversation_retention_state().get("compacted_at", 0.0)
+    if over_limit or now - compacted_at >= CONVERSATION_COMPACT_INTERVAL:
+        try:
+            compact_conversation_knowledge(now=now)
+        except Exception as e:
+            print(f"Error compacting conversations: {e}")
+
+def get_conversation_retention_stats():
+    """Statistik dedup, hit retrieval, dan compaction dokumen percakapan"""
+    with _conversation_lock:
+        total = _conversation_stats["added"] + _conversation_stats["merged"]
+        return {
+            **_conversation_stats,
+            "dedup_rate": round(_conversation_stats["merged"] / total, 4) if total else 0.0,
+            "pending_hits": len(_pending_conversation_hits),
+            "added_since_compaction": _conversation_maintenance["added_since_compaction"],
+            "max_entries": CONVERSATION_MAX_ENTRIES,
+        }
+
+# ================= QUESTION CONTEXTUALIZATION =================
+
+# Rewrite pertanyaan oleh LLM hanya dilakukan jika pertanyaan kemungkinan bergantung
+# pada riwayat percakapan (kata rujukan / pertanyaan sangat pendek). Hasil rewrite
+# untuk pasangan (ekor history, pertanyaan) yang sama di-memoize.
+REFERENTIAL_WORDS = {
+    # Indonesia
+    "itu", "ini", "dia", "ia", "beliau", "tersebut", "tadi", "sebelumnya", "situ", "sana",
+    "mereka", "begitu", "demikian", "lagi", "lainnya", "selanjutnya",
+    # English
+    "it", "its", "that", "this", "these", "those", "he", "him", "his", "she", "her",
+    "they", "them", "their", "there", "above", "previous",
+}
+NYA_SUFFIX_EXCEPTIONS = {"punya", "tanya", "hanya", "bertanya", "menanya", "dunya"}
+CONTEXTUALIZE_SHORT_QUESTION_WORDS = 2  # Pertanyaan <= N kata dianggap follow-up ("lalu?", "kalau react?")
+CONTEXTUALIZE_HISTORY_TAIL = 4          # Jumlah pesan terakhir yang jadi key memoization
+CONTEXTUALIZE_MEMO_MAX_ENTRIES = 1000
+
+_contextualize_memo = OrderedDict()
+_contextualize_lock = threading.Lock()
+_contextualize_stats = {
+    "skipped_no_history": 0,
+    "skipped_self_contained": 0,
+    "memoized": 0,
+    "llm_rewrites": 0,
+}
+
+def needs_contextualization(question, chat_history):
+    """Cek murah apakah pertanyaan perlu di-rewrite dengan konteks history"""
+    if not chat_history:
+        return False
+    words = re.findall(r"\w+", question.lower())
+    if len(words) <= CONTEXTUALIZE_SHORT_QUESTION_WORDS:
+        return True
+    # Kata rujukan atau akhiran "-nya" (misalnya "proyeknya", "skillnya")
+    return any(
+        word in REFERENTIAL_WORDS
+        or (len(word) > 4 and word.endswith("nya") and word not in NYA_SUFFIX_EXCEPTIONS)
+        for word in words
+    )
+
+def _contextualize_memo_key(question, chat_history):
+    tail = chat_history[-CONTEXTUALIZE_HISTORY_TAIL:]
+    raw = "\0".join(f"{msg.type}:{msg.content}" for msg in tail) + "\0" + question
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def create_contextualizing_retriever(llm, retriever, prompt):
+    """
+    Pengganti create_history_aware_retriever: input {"input", "chat_history"} -> documents.
+    LLM rewrite hanya dipanggil jika needs_contextualization() dan belum ada di memo.
+    """
+    rewrite_chain = prompt | llm.with_config(tags=["contextualize"]) | StrOutputParser()
+
+    def lookup(inputs):
+        """(pertanyaan final, None) jika rewrite tidak perlu / sudah di memo, selain itu (None, key memo)"""
+        question = inputs["input"]
+        chat_history = inputs.get("chat_history") or []
+
+        if not chat_history:
+            _contextualize_stats["skipped_no_history"] += 1
+            return question, None
+        if not needs_contextualization(question, chat_history):
+            _contextualize_stats["skipped_self_contained"] += 1
+            return question, None
+
+        key = _contextualize_memo_key(question, chat_history)
+        with _contextualize_lock:
+            rewritten = _contextualize_memo.get(key)
+            if rewritten is not None:
+                _contextualize_memo.move_to_end(key)
+                _contextualize_stats["memoized"] += 1
+                return rewritten, None
+        return None, key
+
+    def remember(inputs, key, rewritten):
+        rewritten = rewritten.strip() or inputs["input"]
+        with _contextualize_lock:
+            _contextualize_stats["llm_rewrites"] += 1
+            _contextualize_memo[key] = rewritten
+            while len(_contextualize_memo) > CONTEXTUALIZE_MEMO_MAX_ENTRIES:
+                _contextualize_memo.popitem(last=False)
+        return rewritten
+
+    @timed_stage("contextualize")
+    def contextualize(inputs):
+        question, key = lookup(inputs)
+        if key is None:
+            return question
+        return remember(inputs, key, rewrite_chain.invoke(inputs))
+
+    async def acontextualize(inputs):
+        # Jalur ainvoke/astream: rewrite LLM di-await, tidak menahan thread executor
+        with timed_stage("contextualize"):
+            question, key = lookup(inputs)
+            if key is None:
+                return question
+            return remember(inputs, key, await rewrite_chain.ainvoke(inputs))
+
+    return RunnableLambda(contextualize, afunc=acontextualize).with_config(run_name="contextualize_question") | retriever
+
+def get_contextualization_stats():
+    """Statistik rewrite pertanyaan: berapa LLM call yang dihindari"""
+    with _contextualize_lock:
+        avoided = (_contextualize_stats["skipped_no_history"] + _contextualize_stats["skipped_self_contained"]
+                   + _contextualize_stats["memoized"])
+        total = avoided + _contextualize_stats["llm_rewrites"]
+        return {
+            **_contextualize_stats,
+            "rewrites_avoided": avoided,
+            "avoided_rate": round(avoided / total, 4) if total else 0.0,
+            "memo_entries": len(_contextualize_memo),
+        }
+
+# ================= CHAT HISTORY TOKEN BUDGET =================
+
+# History yang dikirim ke chain dipilih berdasarkan token, bukan jumlah pesan: turn terbaru
+# yang muat di HISTORY_TOKEN_BUDGET dikirim apa adanya, turn yang lebih lama dilipat ke
+# ringkasan rolling (chat_summary.json di samping log). Ringkasan diperbarui incremental di
+# background: hanya pesan yang baru keluar dari window yang dikirim ke LLM bersama ringkasan lama.
+HISTORY_TOKEN_BUDGET = int(os.getenv('HISTORY_TOKEN_BUDGET', '1500'))
+HISTORY_MESSAGE_OVERHEAD = 4  # Token tambahan per pesan pada format chat OpenAI
+HISTORY_SUMMARY_ENABLED = os.getenv('HISTORY_SUMMARY', '1').lower() in ('1', 'true', 'yes')
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv('HISTORY_SUMMARY_MAX_TOKENS', '300'))
+# Saat melipat, window dipangkas sampai rasio ini dari budget supaya beberapa turn berikutnya
+# tidak perlu memanggil LLM lagi
+HISTORY_SUMMARY_TARGET_RATIO = float(os.getenv('HISTORY_SUMMARY_TARGET_RATIO', '0.6'))
+# Pelipatan dijadwalkan begitu pemakaian budget melewati rasio ini (sebelum ada pesan yang dibuang)
+HISTORY_SUMMARY_TRIGGER_RATIO = float(os.getenv('HISTORY_SUMMARY_TRIGGER_RATIO', '0.85'))
+HISTORY_TOKENIZER_ENCODING = "cl100k_base"
+RATIO_BUCKETS = (0.1, 0.25, 0.5, 0.75, 0.9, 1.0, 1.5)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64)
+
+_histogram_help.update({
+    "history_tokens": "Jumlah token chat history yang dikirim ke chain per request",
+    "history_budget_utilization": "Pemakaian HISTORY_TOKEN_BUDGET per request (rasio)",
+    "history_truncated_messages": "Jumlah pesan yang tidak masuk window per request",
+})
+
+_token_encoder = None
+_token_encoder_loaded = False
+_history_lock = threading.Lock()
+_summary_chain = None
+_summaries_in_flight = set()
+_history_stats = {
+    "assembled": 0,
+    "truncated": 0,             # Request dengan pesan yang dibuang dari window
+    "messages_dropped": 0,      # Tidak masuk window dan belum ada di ringkasan
+    "summary_updates": 0,
+    "summary_failures": 0,
+    "messages_folded": 0,
+}
+
+def _get_token_encoder():
+    """tiktoken encoder jika tersedia (butuh file encoding), None -> estimasi ~4 karakter/token"""
+    global _token_encoder, _token_encoder_loaded
+    if not _token_encoder_loaded:
+        try:
+            import tiktoken
+            _token_encoder = tiktoken.get_encoding(HISTORY_TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f">>> tiktoken not available ({type(e).__name__}), using approximate token count")
+        _token_encoder_loaded = True
+    return _token_encoder
+
+def count_tokens(text):
+    """Hitung token teks (exact dengan tiktoken, perkiraan tanpa tiktoken)"""
+    if not text:
+        return 0
+    encoder = _get_token_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+def truncate_to_tokens(text, max_tokens):
+    """Potong teks supaya maksimal `max_tokens` token"""
+    encoder = _get_token_encoder()
+    if encoder is not None:
+        tokens = encoder.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else encoder.decode(tokens[:max_tokens])
+    return text[:max_tokens * 4]
+
+def _message_text(msg):
+    return msg.get("q", "") if msg.get("is_user") else msg.get("a", "")
+
+def select_recent_turns(entries, budget):
+    """
+    Ambil turn (pertanyaan + jawaban) terbaru dari entries [(offset, msg)] yang muat di `budget`.
+    Window selalu dimulai dari pesan user. Return (kept_entries, tokens_used).
+    """
+    kept, used = [], 0
+    turn, turn_tokens = [], 0
+    for entry in reversed(entries):
+        turn.insert(0, entry)
+        turn_tokens += count_tokens(_message_text(entry[1])) + HISTORY_MESSAGE_OVERHEAD
+        if not entry[1].get("is_user"):
+            continue
+        if used + turn_tokens > budget:
+            break
+        kept[:0] = turn
+        used += turn_tokens
+        turn, turn_tokens = [], 0
+    return kept, used
+
+def _last_turn(entries):
+    """Turn terakhir (mulai dari pesan user terakhir) dari entries"""
+    for i in range(len(entries) - 1, -1, -1):
+        if entries[i][1].get("is_user"):
+            return entries[i:]
+    return entries
+
+def _truncate_turn(messages, budget):
+    """Bagi budget rata ke pesan-pesan dalam satu turn lalu potong isinya"""
+    per_message = max(1, budget // max(1, len(messages)) - HISTORY_MESSAGE_OVERHEAD)
+    truncated = []
+    for msg in messages:
+        key = "q" if msg.get("is_user") else "a"
+        truncated.append(dict(msg, **{key: truncate_to_tokens(_message_text(msg), per_message)}))
+    return truncated
+
+def load_chat_summary(username, log_id):
+    """Baca ringkasan rolling; ringkasan milik log lama (sudah di-reset/trim) diabaikan"""
+    try:
+        with open(get_chat_summary_file(username), 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get("log_id") == log_id:
+            return state
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error loading chat summary: {e}")
+    return {"summary": "", "offset": 0, "log_id": log_id}
+
+def save_chat_summary(username, state):
+    summary_file = get_chat_summary_file(username)
+    tmp_file = f"{summary_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_file, summary_file)
 
-# ================= PERSISTENT STORAGE =================
+def _get_summary_chain():
+    global _summary_chain
+    if _summary_chain is None:
+        prompt = ChatPromptTemplate.from_messages([
+            ("system",
+             "Anda merangkum percakapan antara user dan asisten portfolio. Perbarui ringkasan yang ada "
+             "dengan percakapan baru di bawah. Pertahankan fakta penting: topik yang ditanyakan, nama, "
+             "preferensi user, dan hal yang belum terjawab. Tulis dalam bahasa percakapan, maksimal "
+             "{max_words} kata. Jawab hanya dengan ringkasannya."),
+            ("human", "Ringkasan saat ini:\n{summary}\n\nPercakapan baru:\n{conversation}"),
+        ])
+        llm = get_chat_model(temperature=0, max_tokens=HISTORY_SUMMARY_MAX_TOKENS)
+        _summary_chain = prompt | llm.with_config(tags=["summarize"]) | StrOutputParser()
+    return _summary_chain
 
-CHAT_HISTORY_FILE = "chat_history.json"  # Legacy, akan diganti dengan per-user
+def update_chat_summary(username, log_id):
+    """
+    Lipat pesan di luar window target ke ringkasan rolling. Hanya pesan setelah offset
+    ringkasan terakhir yang dikirim ke LLM (incremental). Return jumlah pesan yang dilipat.
+    """
+    entries, current_log_id = load_chat_history_entries(username, CHAT_HISTORY_WINDOW)
+    if current_log_id != log_id:
+        return 0
+    state = load_chat_summary(username, log_id)
+    entries = [entry for entry in entries if entry[0] >= state["offset"]]
 
-def load_chat_history(username=None):
-    """Load chat history dari file JSON"""
-    if username:
-        chat_file = get_user_chat_history_file(username)
-    else:
-        chat_file = CHAT_HISTORY_FILE
+    target = max(0, int(HISTORY_TOKEN_BUDGET * HISTORY_SUMMARY_TARGET_RATIO) - HISTORY_SUMMARY_MAX_TOKENS)
+    kept, _ = select_recent_turns(entries, target)
+    if not kept:
+        kept = _last_turn(entries)  # Turn terbaru tidak pernah dilipat
+    to_fold = entries[:len(entries) - len(kept)]
+    if not to_fold or not kept:
+        return 0
 
-    if os.path.exists(chat_file):
-        try:
-            with open(chat_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading chat history: {e}")
-            return []
-    return []
+    conversation = "\n".join(
+        f"{'User' if msg.get('is_user') else 'Asisten'}: {_message_text(msg)}" for _, msg in to_fold
+    )
+    summary = _get_summary_chain().invoke({
+        "summary": state["summary"] or "(belum ada)",
+        "conversation": conversation,
+        "max_words": HISTORY_SUMMARY_MAX_TOKENS * 3 // 4,
+    }).strip()
 
-def save_chat_history(messages, username=None):
-    """Save chat history ke file JSON"""
-    if username:
-        chat_file = get_user_chat_history_file(username)
-    else:
-        chat_file = CHAT_HISTORY_FILE
+    # Worker lain bisa sudah melipat lebih jauh selama LLM call berjalan
+    latest = load_chat_summary(username, log_id)
+    if latest["offset"] > state["offset"]:
+        return 0
+    save_chat_summary(username, {
+        "summary": summary,
+        "offset": kept[0][0],
+        "log_id": log_id,
+        "updated_at": datetime.now().isoformat(),
+    })
+    return len(to_fold)
 
+def _run_summary_update(username, log_id):
     try:
-        with open(chat_file, 'w', encoding='utf-8') as f:
-            json.dump(messages, f, ensure_ascii=False, indent=2)
+        folded = update_chat_summary(username, log_id)
+        with _history_lock:
+            if folded:
+                _history_stats["summary_updates"] += 1
+                _history_stats["messages_folded"] += folded
     except Exception as e:
-        print(f"Error saving chat history: {e}")
+        with _history_lock:
+            _history_stats["summary_failures"] += 1
+        print(f"Error updating chat summary: {e}")
+    finally:
+        with _history_lock:
+            _summaries_in_flight.discard(username)
 
-def add_to_vectorstore(user_message, ai_response):
+def schedule_summary_update(username, log_id):
+    """Jalankan update ringkasan di background (maksimal satu per user sekaligus)"""
+    with _history_lock:
+        if username in _summaries_in_flight:
+            return False
+        _summaries_in_flight.add(username)
+    threading.Thread(target=_run_summary_update, args=(username, log_id),
+                     name="chat-summary", daemon=True).start()
+    return True
+
+@timed_stage("history_assemble")
+def assemble_chat_history(username):
     """
-    Menambahkan percakapan baru ke ChromaDB sebagai knowledge tambahan
-    Format: "User bertanya: [question]. Jawabannya: [answer]"
+    Susun chat_history untuk chain: [ringkasan] + turn terbaru yang muat di token budget.
+    Jika ada pesan yang tidak muat, pelipatan ke ringkasan dijadwalkan di background.
     """
-    try:
-        api_key = os.getenv('OPENAI_API_KEY')
-        embeddings = OpenAIEmbeddings(api_key=api_key)
-        persist_dir = "./chroma_db"
-        
-        # Load existing vectorstore
-        vectorstore = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=embeddings
-        )
-        
-        # Format percakapan sebagai knowledge
-        conversation_text = f"User bertanya: {user_message}. Jawabannya: {ai_response}"
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        # Tambahkan metadata untuk tracking
-        vectorstore.add_texts(
-            texts=[conversation_text],
-            metadatas=[{
-                "source": "chat_history",
-                "timestamp": timestamp,
-                "type": "conversation"
-            }]
-        )
-        
-        print(f">>> Conversation added to vectorstore at {timestamp}")
-        
-    except Exception as e:
-        print(f"Error adding to vectorstore: {e}")
+    entries, log_id = load_chat_history_entries(username, CHAT_HISTORY_WINDOW)
+    if not entries:
+        return []
+
+    summary = ""
+    if HISTORY_SUMMARY_ENABLED:
+        state = load_chat_summary(username, log_id)
+        summary = state["summary"]
+        entries = [entry for entry in entries if entry[0] >= state["offset"]]
+    summary_tokens = count_tokens(summary) + HISTORY_MESSAGE_OVERHEAD if summary else 0
+
+    budget = max(0, HISTORY_TOKEN_BUDGET - summary_tokens)
+    kept, used = select_recent_turns(entries, budget)
+    recent = [msg for _, msg in kept]
+    if not kept and entries:
+        # Turn terakhir saja sudah melebihi budget: kirim versi terpotong
+        kept = _last_turn(entries)
+        recent = _truncate_turn([msg for _, msg in kept], budget)
+        used = sum(count_tokens(_message_text(msg)) + HISTORY_MESSAGE_OVERHEAD for msg in recent)
+    dropped = len(entries) - len(kept)
+
+    observe_histogram("history_tokens", used, TOKEN_BUCKETS, part="recent")
+    observe_histogram("history_tokens", summary_tokens, TOKEN_BUCKETS, part="summary")
+    if HISTORY_TOKEN_BUDGET > 0:
+        observe_histogram("history_budget_utilization", (used + summary_tokens) / HISTORY_TOKEN_BUDGET, RATIO_BUCKETS)
+    observe_histogram("history_truncated_messages", dropped, COUNT_BUCKETS)
+    with _history_lock:
+        _history_stats["assembled"] += 1
+        if dropped:
+            _history_stats["truncated"] += 1
+            _history_stats["messages_dropped"] += dropped
+
+    near_budget = used + summary_tokens > HISTORY_TOKEN_BUDGET * HISTORY_SUMMARY_TRIGGER_RATIO
+    if (dropped or near_budget) and HISTORY_SUMMARY_ENABLED and username:
+        schedule_summary_update(username, log_id)
+
+    chat_history = build_chat_history(recent)
+    if summary:
+        chat_history.insert(0, SystemMessage(content=f"Ringkasan percakapan sebelumnya: {summary}"))
+    return chat_history
+
+def get_history_budget_stats():
+    """Statistik token budget history dan ringkasan rolling"""
+    with _history_lock:
+        return {
+            **_history_stats,
+            "token_budget": HISTORY_TOKEN_BUDGET,
+            "summary_enabled": HISTORY_SUMMARY_ENABLED,
+            "summaries_in_flight": len(_summaries_in_flight),
+            "tokenizer": "tiktoken" if _token_encoder is not None else "approximate",
+        }
 
 # ================= RAG SETUP =================
 
+@timed_stage("chain_build")
 def setup_rag_chain(username=None):
     """
-    Menginisialisasi Vector Store (ChromaDB) dan Conversational RAG Chain.
-    Jika username diberikan, akan load data portfolio spesifik user.
+    Menginisialisasi Conversational RAG Chain di atas shared base index.
+    Jika username diberikan dan user punya dokumen privat, overlay user ikut di-query.
     """
-    # Tentukan file portfolio yang akan digunakan
-    if username:
-        file_path = get_user_portfolio_file(username)
-        # Jika file user belum ada, copy dari template default
-        if not os.path.exists(file_path):
-            import shutil
-            default_file = 'portfolio_data.json'
-            if os.path.exists(default_file):
-                shutil.copy(default_file, file_path)
-        chroma_persist_dir = get_user_chroma_dir(username)
-    else:
-        file_path = 'portfolio_data.json'
-        chroma_persist_dir = "./chroma_db"
-
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
         print("WARNING: OPENAI_API_KEY not found in environment")
         return None
 
-    # Import Knowledge base dari file portfolio
-    if not os.path.exists(file_path):
-        print(f"WARNING: Portfolio file not found: {file_path}")
-        return None
-
-    with open(file_path, 'r', encoding='utf-8') as f:
-        knowledge_base = json.load(f)
-
     try:
-        embeddings = OpenAIEmbeddings(api_key=api_key)
-        persist_dir = chroma_persist_dir
+        vectorstore = get_base_vectorstore()
+        if vectorstore is None:
+            return None
+
+        overlay = get_user_overlay_vectorstore(username) if username else None
 
-        # 2. Cek apakah DB sudah ada
-        if os.path.exists(persist_dir) and len(os.listdir(persist_dir)) > 0:
-            print(f">>> Loading existing ChromaDB Vector Store for user: {username or 'default'}...")
-            vectorstore = Chroma(
-                persist_directory=persist_dir,
-                embedding_function=embeddings
-            )
-        else:
-            print(f">>> Creating new ChromaDB Vector Store for user: {username or 'default'}...")
-            vectorstore = Chroma.from_texts(
-                texts=knowledge_base,
-                embedding=embeddings,
-                persist_directory=persist_dir
-            )
-        
         # Retriever dengan K=6 untuk mendapat lebih banyak konteks
-        retriever = vectorstore.as_retriever(search_kwargs={"k": 6})
+        stores = [vectorstore, overlay] if overlay is not None else [vectorstore]
+        if RETRIEVAL_MODE != "vector":
+            retriever = HybridRetriever(vectorstores=stores, k=RETRIEVER_K)
+        elif overlay is not None or VECTOR_ENGINE != "chroma":
+            retriever = MergedRetriever(vectorstores=stores, k=RETRIEVER_K)
+        else:
+            retriever = vectorstore.as_retriever(search_kwargs={"k": RETRIEVER_K})
+        retriever = retriever.with_config(callbacks=[rag_metrics_callback])
 
         # 3. Model (LLM)
-        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7, api_key=api_key)
+        # stream_usage: token usage juga dilaporkan saat streaming (untuk metrics)
+        llm = get_chat_model(temperature=0.7, stream_usage=True)
 
         # PROMPT + RETRIEVER HISTORY/MEMORY PERCAKAPAN SEBELUMNYA SET UP >>>>>>>>>>>>>>>>>>>>>>> START
         # 4. History-Aware Retriever
@@ -218,7 +3348,8 @@ def setup_rag_chain(username=None):
             ("human", "{input}"),
         ])
         
-        history_aware_retriever = create_history_aware_retriever(
+        # Rewrite LLM hanya jika pertanyaan bergantung pada history (lihat needs_contextualization)
+        history_aware_retriever = create_contextualizing_retriever(
             llm, retriever, contextualize_q_prompt
         )
 
@@ -292,7 +3423,7 @@ def setup_rag_chain(username=None):
             ("human", "{input}"),
         ])
         
-        question_answer_chain = create_stuff_documents_chain(llm, qa_prompt)
+        question_answer_chain = lazy_import("create_stuff_documents_chain")(llm, qa_prompt)
 
         # PROMPT + RETRIEVER PRESENT atau sekarang SET UP >>>>>>>>>>>>>>>>>>>>>>> END
 
@@ -300,17 +3431,575 @@ def setup_rag_chain(username=None):
         # history_aware_retriever = Retriever dan Prompt untuk memberi pemahaman dan kemampuan RAG berdasarkan history
         # question_answer_chain = Retriever dan Prompt untuk menjawab pertanyaan present bukan pertanyaan sebelum sebelumnya
         # rag_chain = Gabungan antara kemampuan menjawab pertanyaan saat ini + pemahaman percakapan sebelumnya
-        rag_chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
+        rag_chain = lazy_import("create_retrieval_chain")(history_aware_retriever, question_answer_chain)
         
-        print(">>> ChromaDB & Conversational RAG Initialized Successfully")
+        print(f">>> ChromaDB & Conversational RAG Initialized Successfully for user: {username or 'default'}")
         return rag_chain
 
     except Exception as e:
         print(f"Error initializing RAG: {e}")
         return None
 
-# Initialize Chain Global (akan di-override per user saat login)
-rag_chain = None
+# ================= RAG CHAIN CACHE =================
+
+# Registry chain per user di dalam proses: setiap user cukup build chain sekali,
+# lalu dipakai ulang antar request. Entry yang idle dibuang berdasarkan LRU, TTL,
+# dan batas estimasi memori.
+RAG_CHAIN_CACHE_MAX_ENTRIES = int(os.getenv('RAG_CHAIN_CACHE_MAX_ENTRIES', '64'))
+RAG_CHAIN_CACHE_TTL = int(os.getenv('RAG_CHAIN_CACHE_TTL', '1800'))  # detik idle
+RAG_CHAIN_CACHE_MAX_MB = float(os.getenv('RAG_CHAIN_CACHE_MAX_MB', '512'))
+RAG_CHAIN_BASE_COST_MB = 8.0  # Estimasi overhead per chain (client Chroma, embeddings, LLM)
+
+DEFAULT_CHAIN_KEY = "__default__"
+
+_rag_chain_cache = OrderedDict()
+_rag_chain_cache_lock = threading.Lock()
+_rag_chain_build_locks = {}
+_rag_chain_cache_stats = {
+    "hits": 0,
+    "misses": 0,
+    "builds": 0,
+    "build_failures": 0,
+    "evictions_lru": 0,
+    "evictions_ttl": 0,
+    "evictions_memory": 0,
+    "evictions_manual": 0,
+}
+
+def get_directory_size(path):
+    """Hitung total ukuran file (bytes) di dalam sebuah direktori"""
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _estimate_chain_size_mb(username):
+    """Estimasi memori chain: overhead tetap + ukuran overlay user (base index dipakai bersama)"""
+    size_mb = RAG_CHAIN_BASE_COST_MB
+    if username:
+        overlay_dir = os.path.join(USERS_DATA_DIR, username, "overlay_db")
+        if os.path.exists(overlay_dir):
+            size_mb += get_directory_size(overlay_dir) / (1024 * 1024)
+    return size_mb
+
+def _evict_rag_chain_entry(key, reason):
+    """Buang satu entry dari cache (harus dipanggil saat lock dipegang)"""
+    if _rag_chain_cache.pop(key, None) is not None:
+        _rag_chain_cache_stats[f"evictions_{reason}"] += 1
+
+def _enforce_rag_chain_cache_limits(now):
+    """Terapkan TTL, batas jumlah entry, dan batas memori (harus dipanggil saat lock dipegang)"""
+    # TTL: urutan OrderedDict = urutan last_used, jadi cukup cek dari yang paling lama
+    while _rag_chain_cache:
+        key, entry = next(iter(_rag_chain_cache.items()))
+        if now - entry["last_used"] <= RAG_CHAIN_CACHE_TTL:
+            break
+        _evict_rag_chain_entry(key, "ttl")
+
+    while len(_rag_chain_cache) > RAG_CHAIN_CACHE_MAX_ENTRIES:
+        _evict_rag_chain_entry(next(iter(_rag_chain_cache)), "lru")
+
+    # Sisakan minimal satu entry (yang baru dipakai) walaupun melebihi batas memori
+    while len(_rag_chain_cache) > 1 and sum(e["size_mb"] for e in _rag_chain_cache.values()) > RAG_CHAIN_CACHE_MAX_MB:
+        _evict_rag_chain_entry(next(iter(_rag_chain_cache)), "memory")
+
+def get_rag_chain(username=None):
+    """
+    Ambil RAG chain milik user dari cache, atau build sekali via setup_rag_chain().
+    Return None jika chain gagal diinisialisasi (kegagalan tidak di-cache).
+    """
+    key = username or DEFAULT_CHAIN_KEY
+    # Chain yang di-cache memegang versi index lama jika pointer versi berubah
+    refresh_base_vectorstore()
+
+    with _rag_chain_cache_lock:
+        now = time.time()
+        _enforce_rag_chain_cache_limits(now)
+        entry = _rag_chain_cache.get(key)
+        if entry is not None:
+            entry["last_used"] = now
+            _rag_chain_cache.move_to_end(key)
+            _rag_chain_cache_stats["hits"] += 1
+            return entry["chain"]
+        _rag_chain_cache_stats["misses"] += 1
+        build_lock = _rag_chain_build_locks.setdefault(key, threading.Lock())
+
+    # Build di luar lock global supaya user lain tidak ikut menunggu,
+    # tapi request paralel untuk user yang sama hanya build sekali
+    with build_lock:
+        with _rag_chain_cache_lock:
+            entry = _rag_chain_cache.get(key)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                _rag_chain_cache.move_to_end(key)
+                return entry["chain"]
+
+        chain = setup_rag_chain(username)
+
+        with _rag_chain_cache_lock:
+            _rag_chain_build_locks.pop(key, None)
+            if chain is None:
+                _rag_chain_cache_stats["build_failures"] += 1
+                return None
+            _rag_chain_cache_stats["builds"] += 1
+            now = time.time()
+            _rag_chain_cache[key] = {
+                "chain": chain,
+                "created_at": now,
+                "last_used": now,
+                "size_mb": _estimate_chain_size_mb(username),
+            }
+            _enforce_rag_chain_cache_limits(now)
+            return chain
+
+def evict_rag_chain(username=None):
+    """Hapus chain milik user dari cache (misalnya saat logout)"""
+    with _rag_chain_cache_lock:
+        _evict_rag_chain_entry(username or DEFAULT_CHAIN_KEY, "manual")
+
+def clear_rag_chain_cache():
+    """Hapus semua chain dari cache"""
+    with _rag_chain_cache_lock:
+        for key in list(_rag_chain_cache):
+            _evict_rag_chain_entry(key, "manual")
+
+def get_rag_chain_cache_stats():
+    """Statistik cache chain: hit/miss/eviction dan ukuran saat ini"""
+    with _rag_chain_cache_lock:
+        lookups = _rag_chain_cache_stats["hits"] + _rag_chain_cache_stats["misses"]
+        return {
+            **_rag_chain_cache_stats,
+            "hit_rate": round(_rag_chain_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(_rag_chain_cache),
+            "estimated_size_mb": round(sum(e["size_mb"] for e in _rag_chain_cache.values()), 2),
+            "max_entries": RAG_CHAIN_CACHE_MAX_ENTRIES,
+            "ttl_seconds": RAG_CHAIN_CACHE_TTL,
+            "max_size_mb": RAG_CHAIN_CACHE_MAX_MB,
+        }
+
+# ================= SEMANTIC ANSWER CACHE =================
+
+# Pertanyaan tanpa chat history yang mirip (cosine similarity >= threshold) dengan
+# pertanyaan sebelumnya langsung dijawab dari cache, tanpa memanggil LLM.
+ANSWER_CACHE_THRESHOLD = float(os.getenv('ANSWER_CACHE_THRESHOLD', '0.95'))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '500'))
+
+_answer_cache = OrderedDict()  # question -> {"vector", "answer", "hits"}
+_answer_cache_matrix = None    # Matrix vector ter-normalisasi (dibangun ulang saat cache berubah)
+_answer_cache_keys = []
+_answer_cache_version = None
+_answer_cache_lock = threading.Lock()
+_answer_cache_stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+_kb_version_cache = {"mtime": None, "version": None}
+
+def get_knowledge_base_version():
+    """Versi knowledge base = hash isi portfolio kanonik (di-cache berdasarkan mtime)"""
+    try:
+        mtime = os.path.getmtime(BASE_PORTFOLIO_FILE)
+    except OSError:
+        return None
+    if _kb_version_cache["mtime"] != mtime:
+        with open(BASE_PORTFOLIO_FILE, 'rb') as f:
+            _kb_version_cache["version"] = hashlib.sha256(f.read()).hexdigest()[:16]
+        _kb_version_cache["mtime"] = mtime
+    return _kb_version_cache["version"]
+
+def _normalize_vector(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+def _check_answer_cache_version():
+    """Kosongkan cache jika versi knowledge base berubah (harus dipanggil saat lock dipegang)"""
+    global _answer_cache_version, _answer_cache_matrix
+    version = get_knowledge_base_version()
+    if version != _answer_cache_version:
+        if _answer_cache:
+            _answer_cache_stats["invalidations"] += 1
+        _answer_cache.clear()
+        _answer_cache_matrix = None
+        _answer_cache_version = version
+
+@timed_stage("answer_cache_lookup")
+def lookup_cached_answer(question):
+    """
+    Cari jawaban tersimpan untuk pertanyaan yang mirip.
+    Return (answer atau None, vector pertanyaan) supaya vector bisa dipakai ulang saat store.
+    """
+    global _answer_cache_matrix, _answer_cache_keys
+    try:
+        vector = _normalize_vector(get_embeddings().embed_query(question))
+    except Exception as e:
+        # Embedding tidak tersedia (misalnya offline): lewati cache, retrieval tetap bisa lexical
+        print(f"Error embedding question for answer cache: {e}")
+        return None, None
+
+    with _answer_cache_lock:
+        _check_answer_cache_version()
+        if _answer_cache:
+            if _answer_cache_matrix is None:
+                _answer_cache_keys = list(_answer_cache)
+                _answer_cache_matrix = np.stack([_answer_cache[key]["vector"] for key in _answer_cache_keys])
+            similarities = _answer_cache_matrix @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] >= ANSWER_CACHE_THRESHOLD:
+                key = _answer_cache_keys[best]
+                entry = _answer_cache[key]
+                entry["hits"] += 1
+                _answer_cache.move_to_end(key)  # Urutan matrix tidak berubah, hanya urutan LRU
+                _answer_cache_stats["hits"] += 1
+                return entry["answer"], vector
+        _answer_cache_stats["misses"] += 1
+        return None, vector
+
+def store_cached_answer(question, answer, vector=None):
+    """Simpan jawaban ke cache, buang entry paling lama dipakai jika kapasitas penuh"""
+    global _answer_cache_matrix
+    if vector is None:
+        try:
+            vector = _normalize_vector(get_embeddings().embed_query(question))
+        except Exception as e:
+            print(f"Error embedding question for answer cache: {e}")
+            return
+    with _answer_cache_lock:
+        _check_answer_cache_version()
+        _answer_cache[question] = {"vector": vector, "answer": answer, "hits": 0}
+        _answer_cache.move_to_end(question)
+        while len(_answer_cache) > ANSWER_CACHE_MAX_ENTRIES:
+            _answer_cache.popitem(last=False)
+            _answer_cache_stats["evictions"] += 1
+        _answer_cache_matrix = None
+        _answer_cache_stats["stores"] += 1
+
+def clear_answer_cache():
+    """Kosongkan semua jawaban tersimpan (misalnya setelah knowledge base dihapus)"""
+    global _answer_cache_matrix
+    with _answer_cache_lock:
+        if _answer_cache:
+            _answer_cache_stats["invalidations"] += 1
+        _answer_cache.clear()
+        _answer_cache_matrix = None
+
+def get_answer_cache_stats():
+    """Statistik semantic answer cache"""
+    with _answer_cache_lock:
+        lookups = _answer_cache_stats["hits"] + _answer_cache_stats["misses"]
+        return {
+            **_answer_cache_stats,
+            "hit_rate": round(_answer_cache_stats["hits"] / lookups, 4) if lookups else 0.0,
+            "entries": len(_answer_cache),
+            "max_entries": ANSWER_CACHE_MAX_ENTRIES,
+            "threshold": ANSWER_CACHE_THRESHOLD,
+            "kb_version": _answer_cache_version,
+        }
+
+# ================= GUEST DATA GARBAGE COLLECTOR =================
+
+# Data guest (users_data/guest_*) dihapus setelah tidak aktif selama GUEST_DATA_TTL, dipadatkan
+# (file warisan index per-guest dibuang) dan dibatasi quota disk per guest dan total.
+# Jalan di background tiap GUEST_GC_INTERVAL detik, atau manual: flask --app index.py gc-guests
+GUEST_DATA_TTL = float(os.getenv('GUEST_DATA_TTL', str(7 * 24 * 3600)))  # detik tidak aktif
+GUEST_GC_INTERVAL = float(os.getenv('GUEST_GC_INTERVAL', '3600'))  # 0 = sweeper background mati
+GUEST_GC_MIN_IDLE = float(os.getenv('GUEST_GC_MIN_IDLE', '600'))   # guest yang aktif < N detik tidak disentuh
+GUEST_USER_QUOTA_MB = float(os.getenv('GUEST_USER_QUOTA_MB', '20'))
+GUEST_TOTAL_QUOTA_MB = float(os.getenv('GUEST_TOTAL_QUOTA_MB', '1024'))
+GUEST_GC_TRASH_DIR = os.path.join(USERS_DATA_DIR, ".trash")
+GUEST_GC_LOCK_FILE = os.path.join(USERS_DATA_DIR, ".gc.lock")
+# Sisa versi lama (ChromaDB penuh per guest) yang sudah tidak dipakai sejak ada shared base index
+GUEST_LEGACY_ENTRIES = ("chroma_db",)
+
+_guest_gc_lock = threading.Lock()
+_guest_gc_worker_lock = threading.Lock()
+_guest_gc_worker = None
+_guest_gc_worker_pid = None
+_guest_gc_stats = {
+    "runs": 0,
+    "deleted_users": 0,
+    "compacted_users": 0,
+    "trimmed_users": 0,
+    "reclaimed_bytes": 0,
+    "last_run": None,
+    "last_report": None,
+}
+
+def _scan_guest_dirs():
+    """List direktori guest beserta ukuran dan last_seen (dari user store, fallback mtime)"""
+    last_seen = dict(get_app_db().execute("SELECT user_id, last_seen FROM users WHERE is_guest = 1").fetchall())
+    guests = []
+    for entry in os.scandir(USERS_DATA_DIR):
+        if not entry.name.startswith("guest_") or not entry.is_dir(follow_symlinks=False):
+            continue
+        guests.append({
+            "user_id": entry.name,
+            "path": entry.path,
+            "size": get_directory_size(entry.path),
+            "last_seen": last_seen.get(entry.name, entry.stat().st_mtime),
+        })
+    return guests
+
+def _newest_mtime(path):
+    """Waktu modifikasi terbaru dari direktori dan semua isinya"""
+    newest = os.stat(path).st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                newest = max(newest, os.stat(os.path.join(root, name)).st_mtime)
+            except FileNotFoundError:
+                pass
+    return newest
+
+def _remove_guest_dir(guest, inactive_since):
+    """
+    Hapus data guest jika masih tidak aktif. Record dihapus secara kondisional (last_seen < batas)
+    lalu direktori di-rename ke trash secara atomic, sehingga request yang datang bersamaan
+    hanya melihat direktori lama utuh atau direktori baru yang kosong.
+    """
+    user_id = guest["user_id"]
+    # last_seen di store bisa tertinggal (touch masih di buffer worker lain, atau guest belum
+    # punya record): file yang baru ditulis berarti guest masih aktif
+    try:
+        if _newest_mtime(guest["path"]) >= inactive_since:
+            return False
+    except FileNotFoundError:
+        return False
+    conn = get_app_db()
+    exists = conn.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,)).fetchone() is not None
+    deleted = conn.execute(
+        "DELETE FROM users WHERE user_id = ? AND is_guest = 1 AND last_seen < ?", (user_id, inactive_since)
+    ).rowcount
+    conn.commit()
+    if exists and not deleted:
+        return False  # Guest aktif lagi sejak di-scan
+
+    evict_rag_chain(user_id)
+    os.makedirs(GUEST_GC_TRASH_DIR, exist_ok=True)
+    trash_path = os.path.join(GUEST_GC_TRASH_DIR, f"{user_id}.{os.getpid()}.{int(time.time() * 1000)}")
+    try:
+        os.rename(guest["path"], trash_path)
+    except FileNotFoundError:
+        return False
+    shutil.rmtree(trash_path, ignore_errors=True)
+    return True
+
+def _compact_guest_dir(guest, base_portfolio, dry_run):
+    """Buang file warisan yang tidak dipakai lagi. Return jumlah byte yang dibebaskan"""
+    reclaimed = 0
+    for name in GUEST_LEGACY_ENTRIES:
+        path = os.path.join(guest["path"], name)
+        if os.path.isdir(path):
+            reclaimed += get_directory_size(path)
+            if not dry_run:
+                shutil.rmtree(path, ignore_errors=True)
+
+    # Salinan portfolio yang identik dengan portfolio kanonik tidak berisi dokumen privat
+    portfolio_file = os.path.join(guest["path"], "portfolio_data.json")
+    if base_portfolio is not None and os.path.isfile(portfolio_file):
+        with open(portfolio_file, 'rb') as f:
+            if f.read() == base_portfolio:
+                reclaimed += len(base_portfolio)
+                if not dry_run:
+                    os.remove(portfolio_file)
+    return reclaimed
+
+def sweep_guest_data(dry_run=False, ttl=None, now=None):
+    """
+    Satu putaran garbage collection data guest:
+      1. guest tidak aktif > TTL dihapus
+      2. guest lain dipadatkan, chat log di-trim jika melebihi quota per guest
+      3. jika total masih melebihi quota, guest paling lama tidak aktif dihapus lebih dulu
+    Guest yang aktif dalam GUEST_GC_MIN_IDLE detik terakhir tidak pernah disentuh.
+    Return laporan (termasuk reclaimed_bytes). Aman dijalankan saat app melayani request.
+    """
+    ttl = GUEST_DATA_TTL if ttl is None else ttl
+    now = time.time() if now is None else now
+    if not _guest_gc_lock.acquire(blocking=False):
+        return {"skipped": "sweep already running in this process"}
+    lock_f = None
+    try:
+        os.makedirs(USERS_DATA_DIR, exist_ok=True)
+        # Hanya satu sweeper aktif di antara semua gunicorn worker
+        lock_f = open(GUEST_GC_LOCK_FILE, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return {"skipped": "sweep already running in another process"}
+
+        start = time.perf_counter()
+        flush_user_touches()
+        if not dry_run and os.path.isdir(GUEST_GC_TRASH_DIR):
+            shutil.rmtree(GUEST_GC_TRASH_DIR, ignore_errors=True)  # Sisa sweep yang terputus
+
+        base_portfolio = None
+        if os.path.exists(BASE_PORTFOLIO_FILE):
+            with open(BASE_PORTFOLIO_FILE, 'rb') as f:
+                base_portfolio = f.read()
+
+        guests = _scan_guest_dirs()
+        report = {
+            "dry_run": dry_run,
+            "scanned": len(guests),
+            "deleted_users": 0,
+            "compacted_users": 0,
+            "trimmed_users": 0,
+            "reclaimed_bytes": 0,
+            "bytes_before": sum(guest["size"] for guest in guests),
+        }
+        user_quota = int(GUEST_USER_QUOTA_MB * 1024 * 1024)
+        active_since = now - GUEST_GC_MIN_IDLE
+        remaining = []
+
+        for guest in guests:
+            if guest["last_seen"] >= active_since:
+                remaining.append(guest)
+                continue
+
+            if guest["last_seen"] < now - ttl:
+                if dry_run or _remove_guest_dir(guest, now - ttl):
+                    report["deleted_users"] += 1
+                    report["reclaimed_bytes"] += guest["size"]
+                else:
+                    remaining.append(guest)
+                continue
+
+            reclaimed = _compact_guest_dir(guest, base_portfolio, dry_run)
+            if reclaimed:
+                report["compacted_users"] += 1
+            size = guest["size"] - reclaimed
+
+            if size > user_quota:
+                log_file = os.path.join(guest["path"], CHAT_HISTORY_FILE + "l")
+                log_size = os.path.getsize(log_file) if os.path.exists(log_file) else 0
+                budget = max(0, user_quota - (size - log_size))
+                trimmed = max(0, log_size - budget) if dry_run else trim_chat_log(log_file, budget)
+                if trimmed:
+                    report["trimmed_users"] += 1
+                    reclaimed += trimmed
+                    size -= trimmed
+
+            report["reclaimed_bytes"] += reclaimed
+            remaining.append(dict(guest, size=size))
+
+        # Quota total: hapus guest idle paling lama sampai di bawah batas
+        total_quota = int(GUEST_TOTAL_QUOTA_MB * 1024 * 1024)
+        total = sum(guest["size"] for guest in remaining)
+        for guest in sorted(remaining, key=lambda item: item["last_seen"]):
+            if total <= total_quota:
+                break
+            if guest["last_seen"] >= active_since:
+                continue
+            if dry_run or _remove_guest_dir(guest, active_since):
+                report["deleted_users"] += 1
+                report["reclaimed_bytes"] += guest["size"]
+                total -= guest["size"]
+
+        report["bytes_after"] = report["bytes_before"] - report["reclaimed_bytes"]
+        report["duration_seconds"] = round(time.perf_counter() - start, 3)
+
+        _guest_gc_stats["runs"] += 1
+        _guest_gc_stats["last_run"] = datetime.now().isoformat()
+        _guest_gc_stats["last_report"] = report
+        if not dry_run:
+            for key in ("deleted_users", "compacted_users", "trimmed_users", "reclaimed_bytes"):
+                _guest_gc_stats[key] += report[key]
+        print(f">>> Guest GC: {report['deleted_users']} deleted, {report['compacted_users']} compacted, "
+              f"{report['trimmed_users']} trimmed, {report['reclaimed_bytes']} bytes reclaimed"
+              f"{' (dry run)' if dry_run else ''}")
+        return report
+    finally:
+        if lock_f is not None:
+            if fcntl is not None:
+                fcntl.flock(lock_f.fileno(), fcntl.LOCK_UN)
+            lock_f.close()
+        _guest_gc_lock.release()
+
+def _guest_gc_worker_loop():
+    while True:
+        time.sleep(GUEST_GC_INTERVAL)
+        try:
+            sweep_guest_data()
+        except Exception as e:
+            print(f"Error in guest GC: {e}")
+
+def _ensure_guest_gc_worker():
+    """Start sweeper background (lazy, dan start ulang di proses hasil fork gunicorn)"""
+    global _guest_gc_worker, _guest_gc_worker_pid
+    if GUEST_GC_INTERVAL <= 0:
+        return
+    if _guest_gc_worker is not None and _guest_gc_worker.is_alive() and _guest_gc_worker_pid == os.getpid():
+        return
+    with _guest_gc_worker_lock:
+        if _guest_gc_worker is not None and _guest_gc_worker.is_alive() and _guest_gc_worker_pid == os.getpid():
+            return
+        _guest_gc_worker = threading.Thread(target=_guest_gc_worker_loop, name="guest-gc", daemon=True)
+        _guest_gc_worker_pid = os.getpid()
+        _guest_gc_worker.start()
+
+def get_guest_gc_stats():
+    """Statistik sweeper data guest (kumulatif per proses + laporan sweep terakhir)"""
+    return {
+        **_guest_gc_stats,
+        "ttl_seconds": GUEST_DATA_TTL,
+        "interval_seconds": GUEST_GC_INTERVAL,
+        "user_quota_mb": GUEST_USER_QUOTA_MB,
+        "total_quota_mb": GUEST_TOTAL_QUOTA_MB,
+    }
+
+# ================= STARTUP / PRELOAD =================
+
+# Dengan gunicorn --preload (gunicorn.conf.py) modul di-import sekali di master lalu worker di-fork.
+# warm_shared_state() jalan di master sebelum fork dan hanya menyiapkan state read-only (modul,
+# versi knowledge base, artifact index, tokenizer, template) yang aman dipakai bersama. Koneksi
+# (Chroma, SQLite, httpx) dan thread tetap dibuat per worker setelah fork.
+_startup_stats = {"preloaded": False, "preload_seconds": {}, "worker_warm_seconds": None}
+
+def _import_lazy_modules():
+    for name in _LAZY_IMPORTS:
+        lazy_import(name)
+
+def warm_shared_state():
+    """Siapkan state read-only bersama sebelum fork worker. Return durasi per langkah (detik)"""
+    steps = (
+        ("imports", _import_lazy_modules),
+        ("kb_version", get_knowledge_base_version),
+        ("index_artifact", load_index_artifact),
+        ("tokenizer", _get_token_encoder),
+        ("templates", lambda: app.jinja_env.get_template('index.html')),
+    )
+    timings = {}
+    for name, func in steps:
+        start = time.perf_counter()
+        try:
+            func()
+        except Exception as e:
+            print(f"Error warming {name}: {e}")
+        timings[name] = round(time.perf_counter() - start, 3)
+    _startup_stats.update(preloaded=True, preload_seconds=timings)
+    print(f">>> Shared state warmed in {sum(timings.values()):.2f}s: {timings}")
+    return timings
+
+def _warm_worker():
+    start = time.perf_counter()
+    try:
+        vectorstore = get_base_vectorstore()
+        if vectorstore is not None:
+            get_vector_engine(vectorstore)
+            if RETRIEVAL_MODE != "vector":
+                get_lexical_index(vectorstore)
+    except Exception as e:
+        print(f"Error warming worker: {e}")
+    _startup_stats["worker_warm_seconds"] = round(time.perf_counter() - start, 3)
+
+def warm_worker_state():
+    """Setelah fork / saat server start: buka base index, engine numpy, dan BM25 di background supaya request pertama tidak menunggu"""
+    threading.Thread(target=_warm_worker, name="warm-worker", daemon=True).start()
+
+def get_startup_stats():
+    return {**_startup_stats, "index_artifact": get_index_artifact_stats()}
 
 # ================= ROUTES (AJAX API) =================
 
@@ -319,14 +4008,23 @@ def get_or_create_guest_id():
     import uuid
     if 'guest_id' not in session:
         session['guest_id'] = f"guest_{uuid.uuid4().hex[:12]}"
+        touch_user(session['guest_id'], is_guest=True)
     return session['guest_id']
 
+@app.before_request
+def _start_background_workers():
+    _ensure_guest_gc_worker()
+
 def get_current_user_id():
     """Get current user ID (username jika login, guest_id jika guest)"""
     if session.get('logged_in'):
-        return session.get('username')
+        user_id = session.get('username')
+        touch_user(user_id, is_guest=False)
+        return user_id
     else:
-        return get_or_create_guest_id()
+        user_id = get_or_create_guest_id()
+        touch_user(user_id, is_guest=True)
+        return user_id
 
 @app.route('/')
 def index():
@@ -360,9 +4058,8 @@ def login():
         # Register user if new
         save_registered_user(username)
 
-        # Setup RAG chain untuk user ini
-        global rag_chain
-        rag_chain = setup_rag_chain(username)
+        # Setup RAG chain untuk user ini (dipakai ulang dari cache jika sudah ada)
+        rag_chain = get_rag_chain(username)
 
         if rag_chain is None:
             return jsonify({"success": False, "error": "Gagal menginisialisasi sistem RAG"}), 500
@@ -380,13 +4077,15 @@ def login():
 def logout():
     """API endpoint untuk logout user - kembali ke guest mode"""
     try:
+        # Lepas chain milik user dari cache
+        if session.get('logged_in') and session.get('username'):
+            evict_rag_chain(session.get('username'))
+
         # Clear login info tapi keep guest_id
         guest_id = session.get('guest_id')
         session.clear()
         if guest_id:
             session['guest_id'] = guest_id
-        global rag_chain
-        rag_chain = None
         return jsonify({"success": True, "message": "Logout berhasil", "guest_id": get_or_create_guest_id()})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
@@ -418,166 +4117,500 @@ def get_history():
     """API endpoint untuk mengambil chat history (support guest mode)"""
     try:
         user_id = get_current_user_id()
-        messages = load_chat_history(user_id)
-        return jsonify({"success": True, "messages": messages})
+
+        # Paginasi berbasis cursor: ?limit=N&before=<cursor dari halaman sebelumnya>. Tanpa parameter
+        # hanya halaman terakhir yang dibaca dari ekor log, bukan seluruh file.
+        limit = min(max(request.args.get('limit', CHAT_HISTORY_PAGE_SIZE, type=int), 1), 500)
+        before = request.args.get('before', type=int)
+        messages, next_cursor = load_chat_history_page(user_id, limit, before)
+        return jsonify({"success": True, "messages": messages, "next_cursor": next_cursor})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Tabel rule action buttons (deklaratif). Bisa di-override dengan file JSON berisi list rule
+# dengan format yang sama. "scope": "both" = cek pesan user + jawaban AI, "user" = pesan user saja.
+# "word_boundary": true = keyword harus berupa kata utuh (default: substring, seperti sebelumnya).
+ACTION_RULES_FILE = os.getenv('ACTION_RULES_FILE', 'action_rules.json')
+
+DEFAULT_ACTION_RULES = [
+    {
+        "type": "project_list", "label": "Lihat Semua Proyek", "icon": "💼", "style": "primary",
+        "keywords": ['proyek', 'project', 'portfolio', 'karya', 'aplikasi yang dibuat'],
+        "scope": "both"
+    },
+    {
+        "type": "skills_detail", "label": "Detail Skills", "icon": "🚀", "style": "info",
+        "keywords": ['skill', 'kemampuan', 'keahlian', 'teknologi', 'tech stack', 'bahasa pemrograman'],
+        "scope": "both"
+    },
+    {
+        "type": "experience_timeline", "label": "Timeline Karir", "icon": "📊", "style": "secondary",
+        "keywords": ['pengalaman', 'kerja', 'pekerjaan', 'karir', 'career', 'work experience'],
+        "scope": "both"
+    },
+    {
+        "type": "download_cv", "label": "Download CV", "icon": "📄", "style": "success",
+        "keywords": ['cv', 'resume', 'download', 'unduh'],
+        "scope": "user"
+    },
+    {
+        "type": "contact_info", "label": "Info Kontak", "icon": "📧", "style": "warning",
+        "keywords": ['kontak', 'hubungi', 'contact', 'email', 'linkedin', 'github'],
+        "scope": "user"
+    },
+]
+
+# Action default "Tanya Lainnya?" ditambahkan jika ada action lain yang terdeteksi
+HELP_ACTION = {"type": "help", "label": "Tanya Lainnya?", "icon": "❓", "style": "light"}
+
+def load_action_rules(path=ACTION_RULES_FILE):
+    """Load rule action dari file JSON jika ada, selain itu pakai DEFAULT_ACTION_RULES"""
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"Error loading action rules from {path}: {e}")
+    return DEFAULT_ACTION_RULES
+
+def compile_action_rules(rules):
+    """
+    Compile rule sekali saat startup menjadi list
+    (action, keywords substring, regex kata utuh atau None, cek jawaban AI).
+    Keyword yang mengandung keyword lain di rule yang sama (misalnya "pekerjaan" vs "kerja")
+    dibuang karena tidak mungkin mengubah hasil.
+    """
+    compiled = []
+    for rule in rules:
+        keywords = [kw.lower() for kw in rule["keywords"]]
+        action = {key: rule[key] for key in ("type", "label", "icon", "style")}
+        check_response = rule.get("scope", "user") == "both"
+
+        if rule.get("word_boundary"):
+            pattern = re.compile(r"\b(?:" + "|".join(re.escape(kw) for kw in keywords) + r")\b")
+            compiled.append((action, (), pattern, check_response))
+        else:
+            pruned = tuple(kw for kw in keywords if not any(other != kw and other in kw for other in keywords))
+            compiled.append((action, pruned, None, check_response))
+    return compiled
+
+_action_rules = load_action_rules()
+_compiled_action_rules = compile_action_rules(_action_rules)
+
+@timed_stage("detect_actions")
 def detect_actions(user_message, ai_response):
     """
     Mendeteksi intent dari percakapan dan menentukan action buttons yang sesuai
     Returns: list of action objects
     """
+    # Rule table dipakai supaya keyword bisa dikonfigurasi, bukan untuk kecepatan: waktunya setara
+    # implementasi lama. Satu `keyword in text` per keyword (fast search di C), berhenti di match
+    # pertama per rule. Varian single pass (regex gabungan, atau tokenisasi sekali + lookup
+    # token -> rule) diukur lebih lambat: text.split() saja sudah lebih mahal dari semua scan
+    # substring (lihat benchmarks/bench_detect_actions.py).
+    texts = (user_message.lower(),)
+    texts_with_response = texts + (ai_response.lower(),)
+
     actions = []
-    user_lower = user_message.lower()
-    ai_lower = ai_response.lower()
-
-    # Deteksi intent proyek
-    project_keywords = ['proyek', 'project', 'portfolio', 'karya', 'aplikasi yang dibuat']
-    if any(keyword in user_lower for keyword in project_keywords) or any(keyword in ai_lower for keyword in project_keywords):
-        actions.append({
-            "type": "project_list",
-            "label": "Lihat Semua Proyek",
-            "icon": "💼",
-            "style": "primary"
-        })
+    for action, keywords, pattern, check_response in _compiled_action_rules:
+        matched = False
+        for text in (texts_with_response if check_response else texts):
+            if pattern is not None:
+                matched = pattern.search(text) is not None
+            else:
+                for keyword in keywords:
+                    if keyword in text:
+                        matched = True
+                        break
+            if matched:
+                break
+        if matched:
+            actions.append(dict(action))
 
-    # Deteksi intent skills
-    skill_keywords = ['skill', 'kemampuan', 'keahlian', 'teknologi', 'tech stack', 'bahasa pemrograman']
-    if any(keyword in user_lower for keyword in skill_keywords) or any(keyword in ai_lower for keyword in skill_keywords):
-        actions.append({
-            "type": "skills_detail",
-            "label": "Detail Skills",
-            "icon": "🚀",
-            "style": "info"
-        })
+    if len(actions) > 0:
+        actions.append(dict(HELP_ACTION))
 
-    # Deteksi intent pengalaman kerja
-    experience_keywords = ['pengalaman', 'kerja', 'pekerjaan', 'karir', 'career', 'work experience']
-    if any(keyword in user_lower for keyword in experience_keywords) or any(keyword in ai_lower for keyword in experience_keywords):
-        actions.append({
-            "type": "experience_timeline",
-            "label": "Timeline Karir",
-            "icon": "📊",
-            "style": "secondary"
-        })
+    return actions
 
-    # Deteksi intent CV/Resume
-    cv_keywords = ['cv', 'resume', 'download', 'unduh']
-    if any(keyword in user_lower for keyword in cv_keywords):
-        actions.append({
-            "type": "download_cv",
-            "label": "Download CV",
-            "icon": "📄",
-            "style": "success"
-        })
+# Intent fast path: pertanyaan dengan intent deterministik (kontak, CV, daftar skill, daftar proyek) dijawab dari
+# template yang dibangun sekali per versi portfolio, tanpa retrieval dan LLM call. Intent
+# diklasifikasi lokal dengan tabel keyword action buttons yang sama (DEFAULT_ACTION_RULES /
+# ACTION_RULES_FILE), per kata: kata tanya/umum diabaikan, jadi "dikerjakan" tidak dihitung sebagai
+# keyword "kerja". Hanya pertanyaan yang jelas yang di-route: semua kata lain cocok dengan keyword
+# tepat satu rule ("apa saja skill Adam?"). Selebihnya lewat RAG chain biasa.
+INTENT_FAST_PATH = os.getenv('INTENT_FAST_PATH', '1').lower() in ('1', 'true', 'yes')
+INTENT_MAX_WORDS = 12
 
-    # Deteksi intent kontak
-    contact_keywords = ['kontak', 'hubungi', 'contact', 'email', 'linkedin', 'github']
-    if any(keyword in user_lower for keyword in contact_keywords):
-        actions.append({
-            "type": "contact_info",
-            "label": "Info Kontak",
-            "icon": "📧",
-            "style": "warning"
-        })
+# Action type -> entry portfolio yang dipakai (label sebelum ":", prefix) dan kalimat pembuka jawaban.
+# "fields": isi entry dipecah per "Label: nilai" menjadi satu baris per field.
+INTENT_TEMPLATES = {
+    "contact_info": {"labels": ("kontak",), "fields": True,
+                     "intro": "Berikut informasi kontak yang bisa dihubungi:"},
+    "download_cv": {"labels": ("nama",),
+                    "intro": "CV lengkap bisa diunduh lewat tombol Download CV di bawah. Ringkasan profil:"},
+    "skills_detail": {"labels": ("skills teknis", "soft skills", "tools & platforms", "bahasa"),
+                      "intro": "Berikut daftar skill yang dimiliki:"},
+    "project_list": {"labels": ("proyek",),
+                     "intro": "Berikut daftar proyek yang pernah dikerjakan:"},
+}
 
-    # Tambahkan action default "Tanya Lainnya?"
-    if len(actions) > 0:
-        actions.append({
-            "type": "help",
-            "label": "Tanya Lainnya?",
-            "icon": "❓",
-            "style": "light"
-        })
+# Kata yang tidak mengubah jawaban "list all" (kata tanya, sapaan, kata kerja umum)
+INTENT_FILLER_WORDS = frozenset("""
+apa saja siapa bagaimana gimana mana dimana berapa adakah apakah ada adam dia nya beliau kamu anda
+kak mas yang dan atau serta dengan di ke dari untuk tentang mengenai soal semua seluruh daftar list
+lengkap lengkapnya detail info informasi minta tolong mohon boleh bisa bisakah dong ya sih kah saya
+aku mau ingin lihat tampilkan tunjukkan sebutkan jelaskan kasih berikan punya dimiliki miliki
+memiliki dikuasai menguasai kuasai pernah dibuat membuat buat dikerjakan mengerjakan kerjakan cara
+link what are is his the all of show me tell about give do does have can i please
+""".split())
 
-    return actions
+# (action type, keyword, kata utuh?) dari tabel rule action buttons
+_intent_keywords = [(rule["type"], kw.lower(), bool(rule.get("word_boundary")))
+                    for rule in _action_rules for kw in rule["keywords"]]
+_intent_answers = {"version": None, "answers": {}}
+_intent_lock = threading.Lock()
+_intent_stats = {"routed": 0, "ambiguous": 0, "fallthrough": 0, "builds": 0, "by_intent": {}}
 
-@app.route('/send_message', methods=['POST'])
-def send_message():
-    """API endpoint untuk mengirim pesan dan mendapat response (support guest mode)"""
-    try:
-        # Get user ID (username atau guest_id)
-        user_id = get_current_user_id()
-        is_guest = not session.get('logged_in', False)
+def build_intent_answers(entries):
+    """Jawaban template per intent dari entry portfolio (intent tanpa entry yang cocok tidak dibuat)"""
+    answers = {}
+    for intent, template in INTENT_TEMPLATES.items():
+        lines = []
+        for entry in entries:
+            label, _, content = entry.partition(":")
+            if not label.strip().lower().startswith(template["labels"]):
+                continue
+            if template.get("fields"):
+                # "Email: a, LinkedIn: b, Location: Jakarta, Indonesia" -> pecah hanya sebelum "Label:"
+                fields = re.split(r",\s*(?=[A-Z][\w ]*:)", content.strip())
+                lines.extend(f"- {field.strip().rstrip('.')}" for field in fields if field.strip())
+            else:
+                lines.append(f"- {entry.strip()}")
+        if lines:
+            answers[intent] = "\n".join([template["intro"], *lines])
+    return answers
 
-        # Setup RAG chain jika belum ada
-        global rag_chain
-        if rag_chain is None:
-            rag_chain = setup_rag_chain(user_id)
+def get_intent_answers():
+    """Jawaban template untuk versi portfolio saat ini (dibangun ulang hanya jika versi berubah)"""
+    version = get_knowledge_base_version()
+    if _intent_answers["version"] != version:
+        with _intent_lock:
+            if _intent_answers["version"] != version:
+                answers = build_intent_answers(load_knowledge_base()) if version else {}
+                _intent_answers.update(version=version, answers=answers)
+                _intent_stats["builds"] += 1
+    return _intent_answers["answers"]
 
-        data = request.get_json()
-        user_message = data.get('message', '').strip()
+def classify_intent(user_message):
+    """
+    Intent fast path untuk pesan user, atau None jika tidak ada / ambigu: keyword lebih dari satu
+    rule, pesan terlalu panjang, atau ada kata spesifik lain ("skill Python di proyek X").
+    """
+    text = normalize_question(user_message)
+    if len(text.split()) > INTENT_MAX_WORDS:
+        return None
+    matched = set()
+    # Keyword multi-kata ("tech stack", "aplikasi yang dibuat") dicocokkan sebelum kata umum dibuang
+    for intent, keyword, _ in _intent_keywords:
+        if " " in keyword and keyword in text:
+            matched.add(intent)
+            text = text.replace(keyword, " ")
+    leftover = False
+    for word in text.split():
+        if word in INTENT_FILLER_WORDS:
+            continue
+        intents = {intent for intent, keyword, whole_word in _intent_keywords
+                   if " " not in keyword and (word == keyword if whole_word else keyword in word)}
+        matched |= intents
+        leftover = leftover or not intents
+    if not matched:
+        return None
+    if leftover or len(matched) > 1 or next(iter(matched)) not in INTENT_TEMPLATES:
+        with _intent_lock:
+            _intent_stats["ambiguous"] += 1
+        return None
+    return next(iter(matched))
 
-        if not user_message:
-            return jsonify({"error": "Message cannot be empty"}), 400
+@timed_stage("intent_route")
+def route_intent(user_message, user_id):
+    """Return (intent, jawaban template) jika pesan bisa dijawab fast path, selain itu (None, None)"""
+    if not INTENT_FAST_PATH:
+        return None, None
+    intent = classify_intent(user_message)
+    # User dengan dokumen privat bisa punya kontak/proyek sendiri: selalu lewat chain
+    answer = get_intent_answers().get(intent) if intent else None
+    if answer is None or get_user_private_documents(user_id):
+        with _intent_lock:
+            _intent_stats["fallthrough"] += 1
+        return None, None
+    with _intent_lock:
+        _intent_stats["routed"] += 1
+        _intent_stats["by_intent"][intent] = _intent_stats["by_intent"].get(intent, 0) + 1
+    return intent, answer
 
-        if not os.getenv('OPENAI_API_KEY'):
-            return jsonify({"error": "OpenAI API key is not set!"}), 500
+def get_intent_router_stats():
+    """Statistik intent router: jumlah pesan yang dijawab fast path vs diteruskan ke chain"""
+    with _intent_lock:
+        total = _intent_stats["routed"] + _intent_stats["fallthrough"]
+        return {
+            **_intent_stats,
+            "by_intent": dict(_intent_stats["by_intent"]),
+            "enabled": INTENT_FAST_PATH,
+            "route_rate": round(_intent_stats["routed"] / total, 4) if total else 0.0,
+            "kb_version": _intent_answers["version"],
+            "intents": sorted(_intent_answers["answers"]),
+        }
 
-        # Load chat history for this user (guest atau logged in)
-        messages = load_chat_history(user_id)
+def build_chat_history(messages):
+    """Konversi history tersimpan menjadi list HumanMessage/AIMessage untuk chain"""
+    chat_history = []
+    for msg in messages:
+        if msg.get("is_user"):
+            chat_history.append(HumanMessage(content=msg["q"]))
+        else:
+            chat_history.append(AIMessage(content=msg["a"]))
+    return chat_history
 
-        if rag_chain:
-            # --- PROSES HISTORY ---
-            # Ambil maksimal 20 pesan terakhir (10 percakapan)
-            recent_messages = messages[-20:]
+def save_conversation_turn(user_id, user_message, answer):
+    """Deteksi actions lalu append pertanyaan + jawaban ke history user. Return (timestamp, actions)"""
+    # Deteksi actions berdasarkan percakapan
+    actions = detect_actions(user_message, answer)
 
-            chat_history = []
-            for msg in recent_messages:
-                if msg.get("is_user"):
-                    chat_history.append(HumanMessage(content=msg["q"]))
-                else:
-                    chat_history.append(AIMessage(content=msg["a"]))
+    # Simpan ke file dengan timestamp
+    timestamp = datetime.now().isoformat()
+    new_messages = [
+        {
+            "is_user": True,
+            "q": user_message,
+            "timestamp": timestamp
+        },
+        {
+            "is_user": False,
+            "a": answer,
+            "timestamp": timestamp,
+            "actions": actions  # Tambahkan actions ke message
+        }
+    ]
 
-            # --- INVOKE RAG ---
-            response = rag_chain.invoke({
-                "input": user_message,
-                "chat_history": chat_history
-            })
+    append_chat_messages(new_messages, user_id)
+    return timestamp, actions
 
-            answer = response["answer"]
+AI_UNAVAILABLE_ANSWER = "Maaf, sistem AI sedang tidak dapat diinisialisasi."
 
-            # Simpan percakapan baru ke vectorstore
-            add_to_vectorstore(user_message, answer)
-        else:
-            answer = "Maaf, sistem AI sedang tidak dapat diinisialisasi."
-
-        # Deteksi actions berdasarkan percakapan
-        actions = detect_actions(user_message, answer)
-
-        # Simpan ke file dengan timestamp
-        timestamp = datetime.now().isoformat()
-        new_messages = [
-            {
-                "is_user": True,
-                "q": user_message,
-                "timestamp": timestamp
-            },
-            {
-                "is_user": False,
-                "a": answer,
-                "timestamp": timestamp,
-                "actions": actions  # Tambahkan actions ke message
-            }
-        ]
+def prepare_chat_turn():
+    """
+    Bagian request chat sebelum LLM call (dipakai route sync dan endpoint async di asgi.py):
+    validasi input, intent fast path, ambil chain, susun history, dan cek semantic cache.
+    Harus dipanggil di dalam request context. Return (turn, error_response).
+    """
+    # Get user ID (username atau guest_id)
+    user_id = get_current_user_id()
+    is_guest = not session.get('logged_in', False)
 
-        messages.extend(new_messages)
-        save_chat_history(messages, user_id)
+    data = request.get_json()
+    user_message = data.get('message', '').strip()
 
-        return jsonify({
-            "success": True,
-            "response": answer,
-            "timestamp": timestamp,
-            "actions": actions,  # Return actions ke frontend
-            "is_guest": is_guest,
-            "user_id": user_id
-        })
+    if not user_message:
+        return None, (jsonify({"error": "Message cannot be empty"}), 400)
+
+    if not os.getenv('OPENAI_API_KEY'):
+        return None, (jsonify({"error": "OpenAI API key is not set!"}), 500)
+
+    # --- INTENT FAST PATH: jawaban template tanpa retrieval, LLM, maupun chain ---
+    intent, answer = route_intent(user_message, user_id)
+    if intent:
+        rag_chain, chat_history = None, []
+    else:
+        # Ambil RAG chain milik user ini (build sekali, lalu dari cache)
+        rag_chain = get_rag_chain(user_id)
+        # Susun chat history user (guest atau logged in): ringkasan + turn terbaru sesuai token budget
+        chat_history = assemble_chat_history(user_id)
+
+    turn = {
+        "user_id": user_id,
+        "is_guest": is_guest,
+        "rag_chain": rag_chain,
+        "user_message": user_message,
+        "chat_history": chat_history,
+        "answer": answer,
+        "question_vector": None,
+        "cached": intent is not None,
+        "coalesced": False,
+        "intent": intent,
+        # Jawaban user dengan dokumen privat memakai overlay miliknya: tidak dibagi ke user lain
+        "private": bool(rag_chain and not chat_history and get_user_private_documents(user_id)),
+    }
+    # --- SEMANTIC CACHE (hanya untuk pertanyaan tanpa chat history) ---
+    if rag_chain and not chat_history and not turn["private"]:
+        turn["answer"], turn["question_vector"] = lookup_cached_answer(user_message)
+        turn["cached"] = turn["answer"] is not None
+    return turn, None
+
+def chat_chain_inputs(turn):
+    return {"input": turn["user_message"], "chat_history": turn["chat_history"]}
+
+def begin_answer_flight(turn):
+    """
+    Single-flight untuk jawaban turn ini. Hanya pertanyaan pembuka (tanpa chat history) dari user
+    tanpa dokumen privat yang di-coalesce, syarat yang sama dengan semantic answer cache; key = versi
+    KB + pertanyaan ter-normalisasi. Return (key, future, leader): leader memanggil LLM lalu
+    end_answer_flight(), follower menunggu future.
+    """
+    if (not SINGLE_FLIGHT or turn["cached"] or not turn["rag_chain"] or turn["chat_history"]
+            or turn["private"]):
+        return None, None, True
+    key = (get_knowledge_base_version(), normalize_question(turn["user_message"]))
+    future, leader = _answer_flight.begin(key)
+    return key, future, leader
+
+def end_answer_flight(key, future, answer=None, error=None):
+    if future is not None:
+        _answer_flight.finish(key, future, answer, error)
+
+def invoke_chat_chain(turn):
+    """rag_chain.invoke untuk satu turn; pertanyaan pembuka identik yang sedang berjalan menunggu hasil leader"""
+    key, future, leader = begin_answer_flight(turn)
+    if not leader:
+        try:
+            answer = future.result()
+            turn["coalesced"] = True
+            return answer
+        except SingleFlightAborted:
+            key = future = None
+    try:
+        with timed_stage("chain_invoke"):
+            answer = turn["rag_chain"].invoke(chat_chain_inputs(turn))["answer"]
+    except BaseException as e:
+        end_answer_flight(key, future, error=e)
+        raise
+    end_answer_flight(key, future, answer)
+    return answer
+
+def record_first_token(stream_start):
+    """Catat time-to-first-token untuk jalur streaming"""
+    first_token = time.perf_counter() - stream_start
+    observe_histogram("stage_duration_seconds", first_token, stage="time_to_first_token")
+    record_request_timing("time_to_first_token", first_token)
+
+def finish_chat_turn(turn, answer):
+    """
+    Bagian request chat setelah jawaban didapat: simpan ke semantic cache, enqueue ingestion,
+    append ke history user. Return payload response (sama untuk sync, async, dan streaming).
+    """
+    # Jawaban hasil coalescing sudah disimpan/di-enqueue oleh leader
+    if turn["rag_chain"] and not turn["cached"] and not turn["coalesced"]:
+        if not turn["chat_history"] and not turn["private"]:
+            store_cached_answer(turn["user_message"], answer, turn["question_vector"])
+        # Simpan percakapan baru ke vectorstore (write-behind, tidak menunggu embedding)
+        enqueue_conversation(turn["user_message"], answer)
+
+    timestamp, actions = save_conversation_turn(turn["user_id"], turn["user_message"], answer)
+
+    result = {
+        "success": True,
+        "response": answer,
+        "timestamp": timestamp,
+        "actions": actions,  # Return actions ke frontend
+        "is_guest": turn["is_guest"],
+        "user_id": turn["user_id"],
+        "cached": turn["cached"],
+        "coalesced": turn["coalesced"],
+        "intent": turn["intent"]
+    }
+    if DEBUG_TIMINGS:
+        result["timings"] = get_request_timings()
+    return result
+
+@app.route('/send_message', methods=['POST'])
+def send_message():
+    """API endpoint untuk mengirim pesan dan mendapat response (support guest mode)"""
+    try:
+        turn, error = prepare_chat_turn()
+        if error:
+            return error
+
+        if turn["cached"]:
+            answer = turn["answer"]
+        elif turn["rag_chain"]:
+            # --- INVOKE RAG ---
+            answer = invoke_chat_chain(turn)
+        else:
+            answer = AI_UNAVAILABLE_ANSWER
+
+        return jsonify(finish_chat_turn(turn, answer))
 
     except Exception as e:
         app.logger.error(f"Error in send_message: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def format_sse(event, data):
+    """Format satu Server-Sent Event dengan payload JSON"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # Matikan buffering proxy (nginx) supaya token langsung terkirim
+}
+
+@app.route('/send_message_stream', methods=['POST'])
+def send_message_stream():
+    """
+    Versi streaming dari /send_message: token jawaban dikirim sebagai Server-Sent Events.
+    Event: "token" (potongan jawaban), "done" (payload sama dengan /send_message), "error".
+    """
+    try:
+        turn, error = prepare_chat_turn()
+        if error:
+            return error
+    except Exception as e:
+        app.logger.error(f"Error in send_message_stream: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+    def generate():
+        answer_parts = []
+        try:
+            if turn["cached"]:
+                answer = turn["answer"]
+                yield format_sse("token", {"token": answer})
+            elif turn["rag_chain"]:
+                key, future, leader = begin_answer_flight(turn)
+                answer = None
+                if not leader:
+                    # Pertanyaan identik sedang dijawab request lain: kirim jawabannya sekaligus
+                    try:
+                        answer = future.result()
+                        turn["coalesced"] = True
+                        yield format_sse("token", {"token": answer})
+                    except SingleFlightAborted:
+                        key = future = None
+                if answer is None:
+                    # Token pertama keluar setelah retrieval selesai, tidak menunggu seluruh jawaban
+                    try:
+                        with timed_stage("chain_stream"):
+                            stream_start = time.perf_counter()
+                            for chunk in turn["rag_chain"].stream(chat_chain_inputs(turn)):
+                                token = chunk.get("answer")
+                                if token:
+                                    if not answer_parts:
+                                        record_first_token(stream_start)
+                                    answer_parts.append(token)
+                                    yield format_sse("token", {"token": token})
+                    except BaseException as e:
+                        end_answer_flight(key, future, error=e)
+                        raise
+                    answer = "".join(answer_parts)
+                    end_answer_flight(key, future, answer)
+            else:
+                answer = AI_UNAVAILABLE_ANSWER
+                yield format_sse("token", {"token": answer})
+
+            yield format_sse("done", finish_chat_turn(turn, answer))
+        except Exception as e:
+            app.logger.error(f"Error in send_message_stream: {str(e)}")
+            yield format_sse("error", {"error": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers=SSE_HEADERS)
+
 @app.route('/reset', methods=['POST'])
 def reset():
     """Reset chat history (support guest mode)"""
@@ -591,28 +4624,123 @@ def reset():
 @app.route('/clear_all', methods=['POST'])
 def clear_all():
     """
-    Menghapus semua data (chat history + vectorstore)
+    Menghapus semua data (chat history + percakapan di knowledge base)
     HATI-HATI: Ini akan menghapus semua data termasuk knowledge base!
+    Knowledge base dibangun ulang dari portfolio kanonik di background sebagai versi index baru;
+    index lama tetap melayani chat sampai versi baru aktif. Progress: GET /index/status
     """
     try:
-        import shutil
-        
         # Hapus chat history
-        if os.path.exists(CHAT_HISTORY_FILE):
-            os.remove(CHAT_HISTORY_FILE)
-        
-        # Hapus vectorstore
-        persist_dir = "./chroma_db"
-        if os.path.exists(persist_dir):
-            shutil.rmtree(persist_dir)
-        
-        # Reinitialize RAG dengan knowledge base baru
-        global rag_chain
-        rag_chain = setup_rag_chain()
-        
-        return jsonify({"success": True, "message": "All data cleared successfully"})
+        for chat_file in (CHAT_HISTORY_FILE, get_chat_log_file()):
+            if os.path.exists(chat_file):
+                os.remove(chat_file)
+
+        build, started = start_index_build(keep_conversations=False, reason="clear_all")
+        if not started:
+            return jsonify({"success": False, "error": "Index build already running", "build": build}), 409
+        return jsonify({"success": True, "message": "Chat history cleared, knowledge base rebuild started",
+                        "build": build}), 202
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/index/status', methods=['GET'])
+def index_status():
+    """Versi index aktif, progress build terakhir, dan versi lama yang menunggu garbage collection"""
+    return jsonify({
+        "active": get_knowledge_index_stats(),
+        "pointer": _read_index_versions_file(INDEX_POINTER_FILE) or None,
+        "build": get_index_build_status(),
+        "versions": get_index_versions(),
+        "grace_seconds": INDEX_VERSION_GRACE,
+    })
+
+@app.route('/index/rebuild', methods=['POST'])
+def index_rebuild():
+    """Bangun ulang base index di background (percakapan ikut disalin); swap atomik saat selesai"""
+    try:
+        build, started = start_index_build(keep_conversations=True, reason="api")
+        if not started:
+            return jsonify({"success": False, "error": "Index build already running", "build": build}), 409
+        return jsonify({"success": True, "build": build}), 202
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
+@app.route('/reindex', methods=['POST'])
+def reindex():
+    """
+    Sync incremental knowledge base dengan portfolio_data.json: hanya entry baru/berubah
+    yang di-embed, entry yang dihapus ikut dihapus dari index. `?force=1` abaikan state sync terakhir.
+    """
+    try:
+        report = reindex_knowledge_base(force=request.args.get('force') in ('1', 'true'))
+        return jsonify({"success": True, "report": report})
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+def collect_stats():
+    """Kumpulkan statistik semua cache/queue/index (dipakai /stats dan /metrics)"""
+    return {
+        "rag_chain_cache": get_rag_chain_cache_stats(),
+        "embedding_cache": _embeddings.get_stats() if _embeddings is not None else None,
+        "ingest_queue": get_ingest_queue_stats(),
+        "user_store": get_user_store_stats(),
+        "answer_cache": get_answer_cache_stats(),
+        "contextualization": get_contextualization_stats(),
+        "knowledge_index": get_knowledge_index_stats(),
+        "guest_gc": get_guest_gc_stats(),
+        "retrieval": get_retrieval_stats(),
+        "conversation_retention": get_conversation_retention_stats(),
+        "chat_history": get_history_budget_stats(),
+        "vector_engine": get_vector_engine_stats(),
+        "startup": get_startup_stats(),
+        "index_versions": get_index_versions_stats(),
+        "coalescing": get_coalescing_stats(),
+        "intent_router": get_intent_router_stats(),
+        "openai_pool": get_openai_pool_stats()
+    }
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """API endpoint untuk melihat statistik cache (untuk sizing & monitoring)"""
+    return jsonify(collect_stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Metrics format Prometheus: histogram durasi stage/request/LLM, token per call, dan gauge dari /stats"""
+    return Response(render_metrics(collect_stats()), mimetype='text/plain; version=0.0.4')
+
+@app.cli.command("gc-guests")
+@click.option("--dry-run", is_flag=True, help="Hanya laporkan apa yang akan dihapus/dipadatkan")
+@click.option("--ttl", type=float, default=None, help="Override GUEST_DATA_TTL (detik tidak aktif)")
+def gc_guests_command(dry_run, ttl):
+    """Jalankan satu sweep garbage collection data guest: flask --app index.py gc-guests"""
+    report = sweep_guest_data(dry_run=dry_run, ttl=ttl)
+    print(json.dumps(report, indent=2))
+
+@app.cli.command("compact-conversations")
+@click.option("--dry-run", is_flag=True, help="Hanya laporkan apa yang akan dihapus/di-merge")
+@click.option("--rebuild", is_flag=True, help="Bangun ulang base index sebagai versi baru setelah compaction (swap atomik)")
+def compact_conversations_command(dry_run, rebuild):
+    """Terapkan retention policy percakapan di shared index: flask --app index.py compact-conversations"""
+    report = compact_conversation_knowledge(dry_run=dry_run)
+    if rebuild and not dry_run:
+        report["rebuild"] = rebuild_base_index()
+    print(json.dumps(report, indent=2))
+
+@app.cli.command("reindex")
+@click.option("--force", is_flag=True, help="Sync walaupun versi portfolio sama dengan sync terakhir")
+def reindex_command(force):
+    """Sync incremental knowledge base dengan portfolio_data.json: flask --app index.py reindex"""
+    print(json.dumps(reindex_knowledge_base(force=force), indent=2))
+
+@app.cli.command("build-index")
+@click.option("--keep", type=int, default=INDEX_ARTIFACT_KEEP, show_default=True, help="Jumlah versi artifact yang disimpan")
+def build_index_command(keep):
+    """
+    Bangun artifact index versioned saat build/deploy: flask --app index.py build-index.
+    Ditulis ke INDEX_ARTIFACT_DIR, direktori yang sama yang dibaca saat startup.
+    """
+    print(json.dumps(build_index_artifact(INDEX_ARTIFACT_DIR, keep), indent=2))
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Fixture bersama: modul index di-import di workspace sementara (hanya berisi salinan
+portfolio_data.json), dengan embedding backend `hashing` dan LLM fake dari benchmarks/fakes.py.
+chroma_db/, users_data/ dan file sqlite di repo tidak pernah disentuh.
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+TEST_ENV = {
+    "OPENAI_API_KEY": "sk-test",
+    "EMBEDDING_BACKEND": "hashing",
+    "CONVERSATION_COMPACT_INTERVAL": "0",
+}
+
+
+@pytest.fixture(scope="session")
+def index(tmp_path_factory):
+    workspace = tmp_path_factory.mktemp("workspace")
+    shutil.copy(os.path.join(REPO_ROOT, "portfolio_data.json"), workspace)
+    previous_cwd = os.getcwd()
+    previous_env = {name: os.environ.get(name) for name in TEST_ENV}
+    os.chdir(workspace)
+    os.environ.update(TEST_ENV)
+
+    import index as index_module
+    from benchmarks.fakes import install_fakes
+    install_fakes(index_module)
+    yield index_module
+
+    os.chdir(previous_cwd)
+    for name, value in previous_env.items():
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Chat history JSONL: append dan pagination dengan cursor byte offset"""
+
+
+def _messages(start, count, text="pesan"):
+    return [{"q": f"{text} {i}", "is_user": True} for i in range(start, start + count)]
+
+
+def _read_all_pages(index, username, limit):
+    pages, cursor = [], None
+    while True:
+        page, cursor = index.load_chat_history_page(username, limit=limit, before=cursor)
+        pages.append(page)
+        if cursor is None:
+            return pages
+
+
+def test_append_keeps_order_across_calls(index):
+    index.append_chat_messages(_messages(0, 3), "log_order")
+    index.append_chat_messages(_messages(3, 2), "log_order")
+
+    assert index.load_chat_history("log_order") == _messages(0, 5)
+    assert index.load_chat_history("log_order", limit=2) == _messages(3, 2)
+
+
+def test_pages_walk_back_to_start_without_gaps(index):
+    index.append_chat_messages(_messages(0, 120), "log_pages")
+
+    pages = _read_all_pages(index, "log_pages", limit=50)
+
+    assert [len(page) for page in pages] == [50, 50, 20]
+    assert [msg for page in reversed(pages) for msg in page] == _messages(0, 120)
+
+
+def test_first_page_cursor_is_none_when_everything_fits(index):
+    index.append_chat_messages(_messages(0, 10), "log_small")
+
+    messages, cursor = index.load_chat_history_page("log_small", limit=50)
+
+    assert messages == _messages(0, 10)
+    assert cursor is None
+
+
+def test_pages_span_multiple_read_blocks_and_multibyte_text(index):
+    # Pesan lebih panjang dari CHAT_LOG_READ_BLOCK dan teks non-ASCII (offset dalam byte, bukan karakter)
+    long_text = "ç" * (index.CHAT_LOG_READ_BLOCK + 100)
+    expected = _messages(0, 7, text="héllo 👋") + _messages(7, 3, text=long_text)
+    index.append_chat_messages(expected, "log_blocks")
+
+    pages = _read_all_pages(index, "log_blocks", limit=3)
+
+    assert [msg for page in reversed(pages) for msg in page] == expected
+
+
+def test_cursor_stays_valid_after_new_appends(index):
+    index.append_chat_messages(_messages(0, 30), "log_stable")
+    newest, cursor = index.load_chat_history_page("log_stable", limit=10)
+
+    index.append_chat_messages(_messages(30, 5), "log_stable")
+    older, _ = index.load_chat_history_page("log_stable", limit=10, before=cursor)
+
+    assert newest == _messages(20, 10)
+    assert older == _messages(10, 10)
+
+
+def test_missing_log_returns_empty_page(index):
+    assert index.load_chat_history_page("log_missing") == ([], None)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Ingest percakapan: duplikat exact dan near-duplicate di-merge ke dokumen yang sudah ada"""
+import numpy as np
+
+LONG_QUESTION = ("Bisa jelaskan pengalaman Adam membangun sistem rekomendasi produk untuk platform "
+                 "e-commerce berskala besar?")
+
+
+def _conversation(index, question):
+    vectorstore = index.get_base_vectorstore()
+    data = vectorstore._collection.get(ids=[index.conversation_doc_id(question)],
+                                       include=["documents", "metadatas", "embeddings"])
+    if not data["ids"]:
+        return None
+    return data["documents"][0], data["metadatas"][0], np.asarray(data["embeddings"][0])
+
+
+def _count(index):
+    return index.get_base_vectorstore()._collection.count()
+
+
+def test_exact_duplicate_in_batch_keeps_latest_answer(index):
+    before = _count(index)
+    assert index.add_conversations_to_vectorstore([
+        ("Apa hobi Adam di akhir pekan?", "Jawaban lama.", {}),
+        ("apa hobi adam di akhir pekan", "Jawaban terbaru.", {}),
+    ])
+
+    text, metadata, _ = _conversation(index, "Apa hobi Adam di akhir pekan?")
+    assert _count(index) == before + 1
+    assert text.endswith("Jawaban terbaru.")
+    assert metadata["dup_count"] == 2
+
+
+def test_exact_duplicate_of_indexed_question_replaces_text_and_vector(index):
+    question = "Bahasa pemrograman apa yang paling sering dipakai Adam?"
+    index.add_conversations_to_vectorstore([(question, "Python (sebelum portfolio diubah).", {})])
+    _, _, old_vector = _conversation(index, question)
+    before = _count(index)
+
+    index.add_conversations_to_vectorstore([(question + "??", "Go dan Python.", {})])
+
+    text, metadata, vector = _conversation(index, question)
+    assert _count(index) == before
+    assert text.endswith("Go dan Python.")
+    assert metadata["dup_count"] == 2
+    # Vector di-embed ulang dari teks baru, bukan vector jawaban lama
+    expected = index.get_embeddings().embed_documents([text])[0]
+    assert np.allclose(vector, expected, atol=1e-5)
+    assert not np.allclose(vector, old_vector, atol=1e-5)
+
+
+def test_same_answer_again_only_bumps_dup_count(index):
+    question = "Di kota mana Adam tinggal sekarang?"
+    index.add_conversations_to_vectorstore([(question, "Bandung.", {})])
+    index.add_conversations_to_vectorstore([(question, "Bandung.", {})])
+
+    text, metadata, _ = _conversation(index, question)
+    assert text.endswith("Bandung.")
+    assert metadata["dup_count"] == 2
+
+
+def test_near_duplicate_is_merged_into_existing_document(index, monkeypatch):
+    # Hashing embedding: pertanyaan + satu kata tambahan ~0.947 cosine
+    monkeypatch.setattr(index, "CONVERSATION_DEDUP_THRESHOLD", 0.9)
+    index.add_conversations_to_vectorstore([(LONG_QUESTION, "Ya, di proyek marketplace.", {})])
+    before = _count(index)
+
+    index.add_conversations_to_vectorstore([
+        (LONG_QUESTION + " dong", "Ya, di proyek marketplace.", {}),
+        ("Apa saja sertifikasi cloud yang dimiliki Adam?", "AWS Solutions Architect.", {}),
+    ])
+
+    _, metadata, _ = _conversation(index, LONG_QUESTION)
+    assert _count(index) == before + 1
+    assert _conversation(index, LONG_QUESTION + " dong") is None
+    assert _conversation(index, "Apa saja sertifikasi cloud yang dimiliki Adam?") is not None
+    assert metadata["dup_count"] == 2
+
+
+def test_merged_text_is_visible_to_lexical_replica(index):
+    question = "Berapa lama Adam bekerja di zqxfirma?"
+    vectorstore = index.get_base_vectorstore()
+    index.add_conversations_to_vectorstore([(question, "Dua tahun.", {})])
+    index.get_lexical_index(vectorstore)
+
+    index.add_conversations_to_vectorstore([(question, "Tiga tahun wkvbn.", {})])
+
+    results, _ = index.get_lexical_index(vectorstore).search("wkvbn", 3)
+    assert any("Tiga tahun wkvbn." in document.page_content for document, _ in results)
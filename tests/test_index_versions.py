@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Versi base index: pointer CURRENT di-swap atomik, perubahan selama build disusul (catch-up)"""
+import os
+import threading
+import time
+
+
+def _pointer_version(index):
+    return index._read_index_versions_file(index.INDEX_POINTER_FILE).get("version")
+
+
+def _open_store(index, persist_dir):
+    return index.lazy_import("Chroma")(persist_directory=persist_dir, embedding_function=index.get_embeddings())
+
+
+def _has_conversation(store, index, question):
+    return bool(store._collection.get(ids=[index.conversation_doc_id(question)], include=[])["ids"])
+
+
+def test_build_swaps_pointer_and_keeps_conversations(index):
+    question = "Apa nama startup pertama Adam?"
+    index.add_conversations_to_vectorstore([(question, "Startup logistik.", {})])
+    previous_dir = index.get_base_index_dir(max_age=0)
+
+    report = index.build_index_version(keep_conversations=True, reason="test")
+
+    active_dir = index.get_base_index_dir(max_age=0)
+    assert _pointer_version(index) == report["version"]
+    assert os.path.abspath(active_dir) == os.path.abspath(os.path.join(index.INDEX_VERSIONS_DIR, report["version"]))
+    assert os.path.abspath(report["previous"]) == os.path.abspath(previous_dir)
+    vectorstore = index.get_base_vectorstore()
+    assert os.path.abspath(index._vectorstore_persist_dir(vectorstore)) == os.path.abspath(active_dir)
+    assert _has_conversation(vectorstore, index, question)
+
+
+def test_build_without_conversations_keeps_only_portfolio(index):
+    index.add_conversations_to_vectorstore([("Apa warna favorit Adam?", "Biru.", {})])
+
+    report = index.build_index_version(keep_conversations=False, reason="test")
+
+    data = index.get_base_vectorstore().get(include=["metadatas"])
+    assert report["copied"] == 0
+    assert data["ids"]
+    assert all((metadata or {}).get("source") == "portfolio" for metadata in data["metadatas"])
+
+
+def test_catch_up_copies_changes_and_removes_deleted(index, tmp_path):
+    source = _open_store(index, str(tmp_path / "source"))
+    target = _open_store(index, str(tmp_path / "target"))
+    conversation = {"source": "chat_history", "type": "conversation"}
+    source.add_texts(["percakapan tetap", "teks diperbarui", "percakapan baru"], metadatas=[conversation] * 3,
+                     ids=["same", "changed", "new"])
+    target.add_texts(["percakapan tetap", "teks lama", "sudah di-compact", "chunk portfolio"],
+                     metadatas=[conversation] * 3 + [{"source": "portfolio"}],
+                     ids=["same", "changed", "deleted", "portfolio-chunk"])
+    version_before = index._vectorstore_signature(target)[1]
+
+    copied, removed = index._catch_up_index_documents(source, target)
+
+    data = target.get(include=["documents"])
+    assert (copied, removed) == (2, 1)
+    assert dict(zip(data["ids"], data["documents"])) == {
+        "same": "percakapan tetap",
+        "changed": "teks diperbarui",
+        "new": "percakapan baru",
+        "portfolio-chunk": "chunk portfolio",  # Dokumen portfolio dikelola sync, tidak disentuh catch-up
+    }
+    assert index._vectorstore_signature(target)[1] == version_before + 1
+
+
+def test_ingest_racing_a_swap_lands_in_active_version(index):
+    index.build_index_version(keep_conversations=True, reason="test")
+    question = "Apa proyek open source terbaru Adam?"
+    source_dir = index.get_base_index_dir(max_age=0)
+    results = {}
+
+    # Ingest dan build sama-sama menunggu lock versi aktif; urutan mana pun, dokumen harus ada di versi baru
+    with index._index_lock(source_dir):
+        ingest = threading.Thread(target=lambda: results.setdefault(
+            "ingest", index.add_conversations_to_vectorstore([(question, "CLI untuk RAG.", {})])))
+        build = threading.Thread(target=lambda: results.setdefault(
+            "build", index.build_index_version(keep_conversations=True, reason="test")))
+        ingest.start()
+        build.start()
+        time.sleep(0.5)
+    ingest.join(60)
+    build.join(60)
+
+    active_dir = index.get_base_index_dir(max_age=0)
+    assert results["ingest"] is True
+    assert os.path.abspath(active_dir) != os.path.abspath(source_dir)
+    assert _has_conversation(index.get_base_vectorstore(), index, question)
+
+
+def test_ingest_blocked_by_swap_rechecks_pointer(index):
+    # Dua versi siap pakai; pointer dikembalikan ke versi lama supaya bisa di-swap di bawah lock-nya
+    old_version = index.build_index_version(keep_conversations=True, reason="test")["version"]
+    new_version = index.build_index_version(keep_conversations=True, reason="test")["version"]
+    index._write_index_versions_file(index.INDEX_POINTER_FILE, {"version": old_version})
+    old_dir = index.get_base_index_dir(max_age=0)
+    index.get_base_vectorstore()
+    question = "Kapan Adam mulai belajar machine learning?"
+    results = {}
+
+    with index._index_lock(old_dir):
+        ingest = threading.Thread(target=lambda: results.setdefault(
+            "ingest", index.add_conversations_to_vectorstore([(question, "Tahun 2018.", {})])))
+        ingest.start()
+        time.sleep(0.5)  # Ingest sudah memegang store versi lama dan menunggu lock
+        index._write_index_versions_file(index.INDEX_POINTER_FILE, {"version": new_version})
+    ingest.join(60)
+
+    assert results["ingest"] is True
+    assert _has_conversation(_open_store(index, os.path.join(index.INDEX_VERSIONS_DIR, new_version)), index, question)
+    assert not _has_conversation(_open_store(index, old_dir), index, question)
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""SingleFlight: leader menjalankan call, follower memakai hasil / exception-nya, abort tidak dibagikan"""
+import threading
+import time
+
+import pytest
+
+
+def _start_follower(flight, key, func, results):
+    def run():
+        try:
+            results.append(flight.do(key, func))
+        except Exception as e:  # noqa: BLE001 - exception leader diteruskan ke follower
+            results.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_for_followers(flight, count):
+    # Follower sudah terdaftar (coalesced) sebelum leader selesai
+    for _ in range(500):
+        if flight.get_stats()["coalesced"] >= count:
+            return
+        time.sleep(0.01)
+    raise AssertionError("follower tidak bergabung ke call yang sedang berjalan")
+
+
+def test_followers_share_leader_result(index):
+    flight = index.SingleFlight("test-share")
+    calls = []
+    future, leader = flight.begin("q")
+    results = []
+    threads = [_start_follower(flight, "q", lambda: calls.append("follower") or "sendiri", results)
+               for _ in range(3)]
+    _wait_for_followers(flight, 3)
+
+    flight.finish("q", future, "jawaban leader")
+    for thread in threads:
+        thread.join(5)
+
+    assert leader
+    assert calls == []
+    assert results == [("jawaban leader", True)] * 3
+    stats = flight.get_stats()
+    assert (stats["leaders"], stats["coalesced"], stats["inflight"]) == (1, 3, 0)
+
+
+def test_do_runs_once_for_concurrent_callers(index):
+    flight = index.SingleFlight("test-do")
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait(5)
+        return 42
+
+    results = []
+    leader_thread = _start_follower(flight, "k", slow, results)
+    while not calls:
+        time.sleep(0.01)
+    follower_thread = _start_follower(flight, "k", slow, results)
+    _wait_for_followers(flight, 1)
+    release.set()
+    leader_thread.join(5)
+    follower_thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(results) == [(42, False), (42, True)]
+
+
+def test_leader_exception_is_shared(index):
+    flight = index.SingleFlight("test-error")
+    future, _ = flight.begin("q")
+    results = []
+    thread = _start_follower(flight, "q", lambda: "tidak dipanggil", results)
+    _wait_for_followers(flight, 1)
+
+    flight.finish("q", future, error=ValueError("provider error"))
+    thread.join(5)
+
+    assert isinstance(results[0], ValueError)
+    assert flight.get_stats()["errors"] == 1
+
+
+def test_aborted_leader_lets_followers_run_their_own_call(index):
+    flight = index.SingleFlight("test-abort")
+    future, _ = flight.begin("q")
+    results = []
+    threads = [_start_follower(flight, "q", lambda: "jawaban sendiri", results) for _ in range(2)]
+    _wait_for_followers(flight, 2)
+
+    # BaseException non-Exception (misalnya client disconnect di generator) = abort
+    flight.finish("q", future, error=GeneratorExit())
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [("jawaban sendiri", False)] * 2
+    with pytest.raises(index.SingleFlightAborted):
+        future.result()
+
+
+def test_new_call_after_finish_gets_new_leader(index):
+    flight = index.SingleFlight("test-reuse")
+    assert flight.do("q", lambda: 1) == (1, False)
+    assert flight.do("q", lambda: 2) == (2, False)
+    assert flight.get_stats()["coalesced"] == 0